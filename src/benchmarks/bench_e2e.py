@@ -0,0 +1,218 @@
+"""
+End-to-end benchmark of main.py against a local stand-in for BoligPortal.
+Each mode runs in a fresh process on a copy of the configuration pointing
+at the local site and a temporary folder, and reports:
+
+    * scrape: discovery time, ads/sec, p50/p99 page fetch latency
+    * filter: rows/sec over synthetic listings
+    * all: wall time, peak resident memory and time per stage, from the
+      run report main.py saves
+
+Results are saved as JSON, and compared with an earlier result if given.
+
+Run from the src folder:
+python -m benchmarks.bench_e2e --ads 2000 --compare ../data/benchmarks/<earlier>.json
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from typing import Dict, List
+
+from benchmarks.bench_filter import make_ads
+from benchmarks.fixtures import DEFAULT_ROWS_PATH, MockSite
+from benchmarks.mock_server import MockServer
+from dependencies.general import add_timestamp, load_configuration_file
+from dependencies.storage import load_ads
+
+
+MODES = ["scrape", "filter", "full"]
+
+
+def run_mode(mode: str, directory: str, scraper_config: str, filter_config: str) -> Dict:
+    """Run main.py in a new process, returning its run report."""
+    metrics_path = os.path.join(directory, "metrics")
+    log_path = os.path.join(directory, f"{mode}.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        process = subprocess.run(
+            [
+                sys.executable, "main.py",
+                "--mode", mode,
+                "--scraper_config", scraper_config,
+                "--filter_config", filter_config,
+                "--metrics_path", metrics_path,
+            ],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    if process.returncode != 0:
+        with open(log_path, "r", encoding="utf-8") as log:
+            raise RuntimeError(f"{mode} failed:\n" + "".join(log.readlines()[-20:]))
+
+    (report_name,) = [name for name in os.listdir(metrics_path) if name.endswith(".json")]
+    with open(os.path.join(metrics_path, report_name), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def count_ads(directory: str) -> int:
+    """Count the ads saved in the scraper output folder."""
+    return sum(
+        len(load_ads(os.path.join(directory, name)))
+        for name in os.listdir(directory)
+        if not name.endswith(".checkpoint")
+    )
+
+
+def summarize_scrape(site: MockSite, log: List, ads: int, report: Dict) -> Dict:
+    """Discovery time and ads/sec from the server's request log, fetch latency from the run report."""
+    results_pages = [(start, end) for path, start, end in log if site.is_results_page(path)]
+    ad_pages = [(start, end) for path, start, end in log if not site.is_results_page(path)]
+    discovery_seconds = max(end for _, end in results_pages) - min(start for start, _ in results_pages)
+    ad_seconds = max(end for _, end in ad_pages) - min(start for start, _ in ad_pages)
+    return {
+        "discovery_seconds": round(discovery_seconds, 3),
+        "ads": ads,
+        "ads_per_sec": round(ads / ad_seconds, 1),
+        "fetch_latency_p50_ms": report["stages"]["fetch"]["p50_ms"],
+        "fetch_latency_p99_ms": report["stages"]["fetch"]["p99_ms"],
+        "requests": len(log),
+    }
+
+
+def compare(results: Dict, previous_path: str) -> None:
+    """Print how every metric changed since an earlier result."""
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"\nCompared to {previous_path} ({previous.get('commit')})")
+    print("# -------------------------------------- #")
+    for mode, metrics in results["runs"].items():
+        for metric, value in metrics.items():
+            before = previous["runs"].get(mode, {}).get(metric)
+            if isinstance(value, (int, float)) and before:
+                change = (value - before) / before * 100
+                print(f"\t* {mode} {metric}: {before} -> {value} ({change:+.1f}%)")
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", type=str, nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--rows", type=str, default=DEFAULT_ROWS_PATH)
+    parser.add_argument("--ads", type=int, default=1000)
+    parser.add_argument("--embed_json", action="store_true")
+    parser.add_argument("--filter_rows", type=int, default=1000000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--failure_rate", type=float, default=0.0)
+    parser.add_argument("--rate_limit", type=float, default=0, help="0 for none")
+    parser.add_argument("--scraper_config", type=str, default="../config/scraper_config.json")
+    parser.add_argument("--filter_config", type=str, default="../config/filter_config.json")
+    parser.add_argument("--output", type=str, default="../data/benchmarks/e2e.json")
+    parser.add_argument("--compare", type=str, default=None)
+    args = parser.parse_args()
+
+    site = MockSite(args.rows, args.ads, args.embed_json)
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "settings": {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "compare")
+        },
+        "runs": {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory, MockServer(
+        render=site.render, latency=args.latency, failure_rate=args.failure_rate
+    ) as server:
+        filter_input_path = os.path.join(directory, "listings.csv")
+        if "filter" in args.modes:
+            make_ads(args.filter_rows).to_csv(filter_input_path, index=False)
+
+        for mode in args.modes:
+            run_directory = os.path.join(directory, mode)
+            output_directory = os.path.join(run_directory, "output")
+            os.makedirs(output_directory)
+
+            scraper_config = load_configuration_file(args.scraper_config)
+            scraper_config.update({
+                "MAIN_URL": site.main_url(server.url),
+                "RESULTS_PAGES": 0,
+                "RATE_LIMIT": args.rate_limit,
+                "TRANSLATION_BACKEND": "fake",
+                "TRANSLATION_CACHE_PATH": os.path.join(run_directory, "translation_cache.sqlite"),
+                # Every stage runs, whatever the shipped config turns on
+                "INCREMENTAL": "yes",
+                "ARCHIVE_PAGES": "yes",
+                "SAVE_TO_DATABASE": "yes",
+                "LISTING_INDEX_PATH": os.path.join(run_directory, "listing_index.sqlite"),
+                "ARCHIVE_PATH": os.path.join(run_directory, "archive"),
+                "DATABASE_PATH": os.path.join(run_directory, "listings.sqlite"),
+                # Fingerprinted per mode, so no mode reuses another's translations
+                "DEDUPLICATE": "yes",
+                "FINGERPRINT_PATH": os.path.join(run_directory, "fingerprints.sqlite"),
+                "OUTPUT_PATH": os.path.join(
+                    output_directory, os.path.basename(scraper_config["OUTPUT_PATH"])
+                ),
+            })
+            filter_config = load_configuration_file(args.filter_config)
+            filter_config.update({
+                "INPUT_PATH": filter_input_path,
+                "OUTPUT_PATH": os.path.join(run_directory, "filter_output.xlsx"),
+            })
+            scraper_config_path = os.path.join(run_directory, "scraper_config.json")
+            filter_config_path = os.path.join(run_directory, "filter_config.json")
+            with open(scraper_config_path, "w", encoding="utf-8") as f:
+                json.dump(scraper_config, f)
+            with open(filter_config_path, "w", encoding="utf-8") as f:
+                json.dump(filter_config, f)
+
+            server.reset_counters()
+            report = run_mode(mode, run_directory, scraper_config_path, filter_config_path)
+            run = {"seconds": round(report["seconds"], 2)}
+            if mode in ("scrape", "full"):
+                run.update(summarize_scrape(
+                    site, server.log, count_ads(output_directory), report
+                ))
+            if mode == "filter":
+                run["rows"] = args.filter_rows
+                run["rows_per_sec"] = round(args.filter_rows / report["seconds"])
+            run["peak_rss_mb"] = report["peak_rss_mb"]
+            run["stage_seconds"] = {
+                stage: stats["seconds"] for stage, stats in report["stages"].items()
+            }
+            results["runs"][mode] = run
+
+    print(f"\n{args.ads} ads at {args.latency}s latency, {args.filter_rows} rows to filter")
+    print("# -------------------------------------- #")
+    for mode, run in results["runs"].items():
+        print(f"\t* {mode}: {run}")
+
+    output_path = add_timestamp(args.output, datetime.now().strftime("%Y_%m_%d-%I_%M_%S_%p"))
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+    print(f"Results saved to {output_path}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
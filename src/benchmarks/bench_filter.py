@@ -0,0 +1,207 @@
+"""
+Compare filter_data with the previous implementation, which parsed dates
+one by one and copied the data after every filter, on large synthetic
+datasets. Reports time and peak resident memory for each and checks both
+select the same listings.
+
+Run from the src folder: python -m benchmarks.bench_filter --rows 1000000 10000000
+"""
+
+
+import argparse
+import gc
+import os
+import threading
+from datetime import date, datetime, timedelta
+from time import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from dependencies.filter import filter_data
+from dependencies.general import load_configuration_file
+
+
+DISTRICTS = ["København K", "København S", "København N", "Frederiksberg", "Valby"]
+HOUSING_TYPES = ["Apartment", "Townhouse", "House", "Room"]
+RENTAL_PERIODS = ["Unlimited", "12-23 months", "24+ months", "1-11 months"]
+
+
+def make_ads(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Random ads shaped like the scraper's CSV output, dates as strings."""
+    rng = np.random.default_rng(seed)
+
+    def dates(start: date, days: int) -> np.ndarray:
+        offsets = pd.to_timedelta(rng.integers(0, days, rows), unit="D")
+        return (pd.Timestamp(start) + offsets).strftime("%m/%d/%Y").to_numpy()
+
+    today = date.today()
+    monthly_rent = rng.integers(4000, 25000, rows)
+    return pd.DataFrame({
+        "creation_date": dates(today - timedelta(days=90), 91),
+        "scraped_date": dates(today, 1),
+        "zip_code": rng.integers(1000, 3000, rows),
+        "district": rng.choice(DISTRICTS, rows),
+        "housing_type": rng.choice(HOUSING_TYPES, rows),
+        "size": rng.integers(20, 200, rows),
+        "number_of_rooms": rng.integers(1, 7, rows),
+        "rental_period": rng.choice(RENTAL_PERIODS, rows),
+        "available_from": dates(date(2022, 12, 1), 90),
+        "total_monthly_cost": monthly_rent + rng.integers(0, 2000, rows),
+        "months_of_deposit": rng.integers(0, 5, rows),
+        "months_of_prepaid_rent": rng.integers(0, 5, rows),
+        "occupancy_price": monthly_rent * rng.integers(3, 8, rows),
+        "is_furnished": rng.integers(0, 2, rows),
+        "is_shareable": rng.integers(0, 2, rows),
+        "pets_allowed": rng.integers(0, 2, rows),
+        "has_elevator": rng.integers(0, 2, rows),
+        "students_only": rng.integers(0, 2, rows),
+        "has_balcony": rng.integers(0, 2, rows),
+        "has_parking": rng.integers(0, 2, rows),
+    })
+
+
+def isin_list(df: pd.DataFrame, col: str, filter: List) -> pd.DataFrame:
+    """Check if series values in list and return filtered df."""
+    boolean_series = df[col].isin(filter)
+    df = df[boolean_series]
+    return df
+
+
+def is_not_in_list(df: pd.DataFrame, col: str, filter: List) -> pd.DataFrame:
+    """Check if series values is not in list and return filtered df."""
+    boolean_series = df[col].isin(filter)
+    df = df[~boolean_series]
+    return df
+
+
+def obj_to_date(creation_date: str) -> datetime.date:
+    """Convert object/string to date."""
+    return datetime.strptime(creation_date, '%m/%d/%Y').date()
+
+
+def legacy_filter_data(df: pd.DataFrame, config_options) -> pd.DataFrame:
+    """filter_data as it was before the single mask."""
+    df["creation_date"] = df["creation_date"].apply(lambda x: obj_to_date(x))
+    df["available_from"] = df["available_from"].apply(lambda x: obj_to_date(x))
+    df["scraped_date"] = df["scraped_date"].apply(lambda x: obj_to_date(x))
+
+    earliest_creation_date = date.today() - timedelta(
+        days=config_options["MAX_DAYS_SINCE_CREATION"])
+    df = df[df["creation_date"] >= earliest_creation_date]
+
+    df = isin_list(df, "rental_period", config_options["RENTAL_PERIOD_FILTER"])
+
+    available_from_range = config_options["AVAILABLE_FROM_RANGE"]
+    df = df[df["available_from"] >= obj_to_date(available_from_range[0])]
+    df = df[df["available_from"] <= obj_to_date(available_from_range[1])]
+
+    if config_options["USE_ZIPCODE_FILTER"] == "yes":
+        zipcode_filter_type = config_options["ZIPCODE_FILTER_TYPE"]
+        if zipcode_filter_type == "range":
+            df = df[df["zip_code"] >= config_options["ZIPCODE_RANGE_FILTER"][0]]
+            df = df[df["zip_code"] <= config_options["ZIPCODE_RANGE_FILTER"][1]]
+        elif zipcode_filter_type == "list":
+            df = isin_list(df, "zip_code", config_options["ZIPCODE_LIST_FILTER"])
+        elif zipcode_filter_type == "exclude":
+            df = is_not_in_list(df, "zip_code", config_options["ZIPCODE_EXCLUDE_FILTER"])
+
+    if config_options["USE_DISTRICT_FILTER"] == "yes":
+        df = isin_list(df, "district", config_options["DISTRICT_FILTER"])
+
+    df = df[df["total_monthly_cost"] <= config_options["TOTAL_RENT_MAX"]]
+    df = df[df["months_of_deposit"] <= config_options["DEPOSIT_MAX"]]
+    if config_options["PREPAID_RENT"] == "yes":
+        df = df[df["months_of_prepaid_rent"] <= config_options["PREPAID_RENT_MAX"]]
+    df = df[df["occupancy_price"] <= config_options["OCCUPANCY_PRICE_MAX"]]
+
+    if config_options["USE_HOUSING_TYPE_FILTER"] == "yes":
+        df = isin_list(df, "housing_type", config_options["HOUSING_TYPE_FILTER"])
+
+    df = df[df["number_of_rooms"] >= config_options["NUMBER_OF_ROOMS_FILTER"][0]]
+    df = df[df["number_of_rooms"] <= config_options["NUMBER_OF_ROOMS_FILTER"][1]]
+    df = df[df["size"] >= config_options["SIZE_FILTER"][0]]
+    df = df[df["size"] <= config_options["SIZE_FILTER"][1]]
+
+    df = isin_list(df, "is_furnished", config_options["FURNISHED"])
+    df = isin_list(df, "is_shareable", config_options["SHAREABLE"])
+    df = isin_list(df, "pets_allowed", config_options["PETS_ALLOWED"])
+    df = isin_list(df, "has_elevator", config_options["HAS_ELEVATOR"])
+    df = isin_list(df, "students_only", config_options["STUDENTS_ONLY"])
+    df = isin_list(df, "has_balcony", config_options["HAS_BALCONY"])
+    df = isin_list(df, "has_parking", config_options["HAS_PARKING"])
+
+    return df
+
+
+def get_rss() -> int:
+    """Resident memory of this process in bytes (Linux)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class PeakMemory:
+    """
+    Sample resident memory in a thread while in the with block, giving the
+    peak above where it started. tracemalloc would slow the per-row Python
+    code of the previous implementation down by an order of magnitude.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self.stop = threading.Event()
+
+    def sample(self) -> None:
+        while not self.stop.wait(self.interval):
+            self.peak = max(self.peak, get_rss() - self.start)
+
+    def __enter__(self) -> "PeakMemory":
+        gc.collect()
+        self.start = get_rss()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, get_rss() - self.start)
+
+
+def measure(function, df: pd.DataFrame, config_options):
+    """Run function on a copy of df, returning (result, seconds, peak MB)."""
+    df = df.copy()
+    with PeakMemory() as memory:
+        start_time = time()
+        result = function(df, config_options)
+        seconds = time() - start_time
+    return result, seconds, memory.peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000000])
+    parser.add_argument("--filter_config", type=str, default="../config/filter_config.json")
+    args = parser.parse_args()
+
+    config_options = load_configuration_file(args.filter_config)
+
+    for rows in args.rows:
+        df = make_ads(rows)
+        # Freed memory is reused rather than given back, so the lighter
+        # implementation goes first for a fair peak
+        current, seconds, peak = measure(filter_data, df, config_options)
+        legacy, legacy_seconds, legacy_peak = measure(legacy_filter_data, df, config_options)
+        pd.testing.assert_frame_equal(current, legacy)
+
+        print(f"\n{rows} ads, {current.shape[0]} selected")
+        print("# -------------------------------------- #")
+        print(f"\t* previous: {round(legacy_seconds, 2)}s, {round(legacy_peak)} MB peak")
+        print(f"\t* current: {round(seconds, 2)}s, {round(peak)} MB peak")
+        print(f"\t* speedup: {round(legacy_seconds / seconds, 1)}x")
+
+
+if __name__ == "__main__":
+    main()
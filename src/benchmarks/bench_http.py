@@ -0,0 +1,69 @@
+"""
+Compare the pooled session behind make_soup with a new urlopen per request.
+
+Run from the src folder: python -m benchmarks.bench_http
+"""
+
+
+import argparse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from benchmarks.mock_server import MockServer
+from dependencies.session import configure_session, fetch
+
+
+def fetch_urlopen(url: str) -> bytes:
+    """The previous make_soup transport: new connection for every call."""
+    req = urllib.request.Request(url, headers={"User-Agent": "Magic Browser"})
+    with urllib.request.urlopen(req) as http:
+        return http.read()
+
+
+def run(server: MockServer, fetcher, requests: int, workers: int) -> dict:
+    """Fetch requests pages with the given fetcher and count the cost."""
+    server.reset_counters()
+    urls = [f"{server.url}/ad/{i}" for i in range(requests)]
+
+    start_time = time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        total_bytes = sum(len(body) for body in executor.map(fetcher, urls))
+    runtime = time() - start_time
+
+    return {
+        "requests": server.requests,
+        "connections": server.connections,
+        "bytes": total_bytes,
+        "seconds": round(runtime, 3),
+        "ms_per_request": round(1000 * runtime / requests, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--connect_latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    configure_session(pool_size=args.workers)
+
+    with MockServer(latency=args.latency, connect_latency=args.connect_latency) as server:
+        results = {
+            "urlopen": run(server, fetch_urlopen, args.requests, args.workers),
+            "session": run(server, fetch, args.requests, args.workers),
+        }
+
+    print(
+        f"\n{args.requests} requests, {args.workers} workers, "
+        f"{args.latency}s latency, {args.connect_latency}s per new connection"
+    )
+    print("# -------------------------------------- #")
+    for name, result in results.items():
+        print(f"\t* {name}: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Parse-only benchmark of the HTML parser backends, with and without only
+building the elements scrape_ad reads.
+
+Run from the src folder: python -m benchmarks.bench_parsing
+"""
+
+
+import argparse
+from time import perf_counter
+
+from benchmarks.fixtures import get_fixtures
+from dependencies.parsing import DEFAULT_BACKEND, PARSER_BACKENDS, configure_parser, parse_html
+from dependencies.scraper import AD_STRAINER, parse_ad
+
+
+def time_per_page(function, pages, repeat: int) -> float:
+    """Return the best ms/page over repeat runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = perf_counter()
+        for url, page in pages:
+            function(url, page)
+        best = min(best, perf_counter() - start_time)
+    return 1000 * best / len(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", type=str, default="", help="Folder of saved ad pages")
+    parser.add_argument("--archive", type=str, default="", help="Page archive folder")
+    parser.add_argument("--rows", type=str, default="../data/bp_ads.csv")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = get_fixtures(args.rows, args.fixtures, archive_path=args.archive)[: args.pages]
+    size = sum(len(page) for _, page in pages) / len(pages) / 1024
+    print(f"\n{len(pages)} pages of {round(size, 1)} KB on average")
+    print("# -------------------------------------- #")
+
+    backends = PARSER_BACKENDS if DEFAULT_BACKEND == "lxml" else ["html.parser"]
+    for backend in backends:
+        configure_parser(backend)
+        full = time_per_page(
+            lambda url, page: parse_html(page, backend=backend), pages, args.repeat
+        )
+        strained = time_per_page(
+            lambda url, page: parse_html(page, parse_only=AD_STRAINER, backend=backend),
+            pages,
+            args.repeat,
+        )
+        extract = time_per_page(parse_ad, pages, args.repeat)
+        print(
+            f"\t* {backend}: full tree {round(full, 2)} ms/page, "
+            f"strained {round(strained, 2)} ms/page, "
+            f"parse_ad {round(extract, 2)} ms/page"
+        )
+
+
+if __name__ == "__main__":
+    main()
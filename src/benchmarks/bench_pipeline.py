@@ -0,0 +1,55 @@
+"""
+Measure how ads/sec scales with the number of parser processes, scraping
+recorded pages from a local server.
+
+Run from the src folder: python -m benchmarks.bench_pipeline
+"""
+
+
+import argparse
+import os
+from time import time
+
+from benchmarks.fixtures import ad_path, get_fixtures
+from benchmarks.mock_server import MockServer
+from dependencies.pipeline import scrape_ads_pipeline
+from dependencies.scraper import scrape_ads
+from dependencies.session import configure_session
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=str, default="../data/bp_ads.csv")
+    parser.add_argument("--fetch_workers", type=int, default=8)
+    parser.add_argument("--max_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    pages = {ad_path(url): page for url, page in get_fixtures(args.rows)}
+    configure_session(pool_size=args.fetch_workers)
+
+    results = {}
+    with MockServer(render=pages.get, latency=args.latency) as server:
+        urls = [server.url + path for path in pages]
+
+        start_time = time()
+        count = sum(1 for _ in scrape_ads(urls, args.fetch_workers))
+        results["threads only"] = count / (time() - start_time)
+
+        workers = 1
+        while workers <= args.max_workers:
+            start_time = time()
+            count = sum(
+                1 for _ in scrape_ads_pipeline(urls, args.fetch_workers, workers)
+            )
+            results[f"{workers} parser processes"] = count / (time() - start_time)
+            workers *= 2
+
+    print(f"\n{len(pages)} ads, {args.fetch_workers} fetchers, {args.latency}s latency")
+    print("# -------------------------------------- #")
+    for name, throughput in results.items():
+        print(f"\t* {name}: {round(throughput, 1)} ads/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark of scraping through the work queue against a local stand-in for
+BoligPortal: discovery fills the queue, then 1, 2, 4... worker processes
+drain it together. Reports ads/sec for each number of workers, and with
+--crash, kills one worker halfway to check its URLs are still scraped once
+its lease runs out.
+
+Each worker keeps few requests in flight, as one worker per host would,
+so the total is bounded by the number of workers rather than the server.
+
+Run from the src folder:
+python -m benchmarks.bench_queue --ads 400 --workers 1 2 4 --crash
+"""
+
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, sleep
+from typing import Dict, List
+
+from benchmarks.fixtures import DEFAULT_ROWS_PATH, MockSite
+from benchmarks.mock_server import MockServer
+from dependencies.general import load_configuration_file
+from dependencies.work_queue import SQLiteWorkQueue
+
+
+def start_main(mode: str, directory: str, scraper_config: str, name: str) -> subprocess.Popen:
+    log = open(os.path.join(directory, f"{name}.log"), "w", encoding="utf-8")
+    return subprocess.Popen(
+        [
+            sys.executable, "main.py",
+            "--mode", mode,
+            "--scraper_config", scraper_config,
+            "--metrics_path", os.path.join(directory, "metrics"),
+            "--worker_id", name,
+        ],
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+def wait(process: subprocess.Popen, directory: str, name: str) -> None:
+    if process.wait() != 0:
+        with open(os.path.join(directory, f"{name}.log"), "r", encoding="utf-8") as log:
+            raise RuntimeError(f"{name} failed:\n" + "".join(log.readlines()[-20:]))
+
+
+def run_workers(
+    site: MockSite, server: MockServer, args, workers: int, crash: bool = False
+) -> Dict:
+    """Discover into a new queue, then time workers draining it."""
+    with tempfile.TemporaryDirectory() as directory:
+        scraper_config = load_configuration_file(args.scraper_config)
+        scraper_config.update({
+            "MAIN_URL": site.main_url(server.url),
+            "RESULTS_PAGES": 0,
+            "MAX_CONCURRENT_REQUESTS": args.concurrency,
+            "RATE_LIMIT": 0,
+            "INCREMENTAL": "no",
+            "ARCHIVE_PAGES": "no",
+            "SAVE_TO_DATABASE": "no",
+            "DEDUPLICATE": "no",
+            "FINGERPRINT_PATH": os.path.join(directory, "fingerprints.sqlite"),
+            "TRANSLATION_BACKEND": "fake",
+            "TRANSLATION_CACHE_PATH": os.path.join(directory, "translation_cache.sqlite"),
+            "QUEUE_PATH": os.path.join(directory, "work_queue.sqlite"),
+            "QUEUE_BATCH_SIZE": args.batch_size,
+            "QUEUE_VISIBILITY_TIMEOUT": args.visibility_timeout,
+            "OUTPUT_PATH": os.path.join(directory, "bp_ads.csv"),
+        })
+        scraper_config_path = os.path.join(directory, "scraper_config.json")
+        with open(scraper_config_path, "w", encoding="utf-8") as f:
+            json.dump(scraper_config, f)
+
+        wait(start_main("discover", directory, scraper_config_path, "discover"), directory, "discover")
+        server.reset_counters()
+        start_time = perf_counter()
+        names = [f"worker-{i}" for i in range(workers)]
+        processes = [start_main("worker", directory, scraper_config_path, name) for name in names]
+        if crash:
+            # Killed mid-batch, its leased URLs are left for the others
+            sleep(args.crash_after)
+            processes[0].send_signal(signal.SIGKILL)
+            processes[0].wait()
+            names, processes = names[1:], processes[1:]
+        for name, process in zip(names, processes):
+            wait(process, directory, name)
+        seconds = perf_counter() - start_time
+
+        queue = SQLiteWorkQueue(scraper_config["QUEUE_PATH"])
+        stats = queue.stats()
+        queue.close()
+        ad_requests = sum(1 for path, _, _ in server.log if not site.is_results_page(path))
+        return {
+            "workers": workers,
+            "seconds": round(seconds, 2),
+            "ads": stats["done"],
+            "ads_per_sec": round(stats["done"] / seconds, 1),
+            "ad_requests": ad_requests,
+            "queue": stats,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=str, default=DEFAULT_ROWS_PATH)
+    parser.add_argument("--ads", type=int, default=400)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--batch_size", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--crash", action="store_true")
+    parser.add_argument("--crash_after", type=float, default=3.0)
+    parser.add_argument("--visibility_timeout", type=float, default=10.0)
+    parser.add_argument("--scraper_config", type=str, default="../config/scraper_config.json")
+    args = parser.parse_args()
+
+    site = MockSite(args.rows, args.ads)
+    results: List[Dict] = []
+    with MockServer(render=site.render, latency=args.latency) as server:
+        for workers in args.workers:
+            results.append(run_workers(site, server, args, workers))
+        if args.crash:
+            results.append(run_workers(site, server, args, max(max(args.workers), 2), crash=True))
+
+    print(f"\n{args.ads} ads at {args.latency}s latency, {args.concurrency} requests per worker")
+    print("# -------------------------------------- #")
+    base = results[0]["ads_per_sec"] / results[0]["workers"]
+    for i, result in enumerate(results):
+        crashed = " (one killed)" if args.crash and i == len(results) - 1 else ""
+        print(
+            f"\t* {result['workers']} workers{crashed}: {result['ads']} ads in "
+            f"{result['seconds']}s, {result['ads_per_sec']} ads/sec "
+            f"({result['ads_per_sec'] / base / result['workers']:.0%} of linear), "
+            f"{result['ad_requests']} ad requests, queue {result['queue']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
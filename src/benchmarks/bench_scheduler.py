@@ -0,0 +1,85 @@
+"""
+Scrape a local server that throttles like a busy site, first with plain
+requests at fixed concurrency, then through the adaptive scheduler,
+reporting pages/sec and what failed.
+
+Run from the src folder: python -m benchmarks.bench_scheduler
+"""
+
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from benchmarks.mock_server import MockServer
+from dependencies.scheduler import Scheduler
+from dependencies.session import configure_session, fetch, get_session
+
+
+def fetch_unscheduled(url: str) -> bytes:
+    """fetch as it was before the scheduler: one GET, no pacing or retries."""
+    response = get_session().get(url, timeout=(5, 30))
+    response.raise_for_status()
+    return response.content
+
+
+def scrape(urls, workers: int, fetch_function=fetch):
+    """Fetch every URL, returning (pages fetched, pages failed, seconds)."""
+    def try_fetch(url: str) -> bool:
+        try:
+            fetch_function(url)
+            return True
+        except Exception:
+            return False
+
+    start_time = time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(try_fetch, urls))
+    return sum(results), results.count(False), time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--max_rate", type=float, default=60)
+    parser.add_argument("--max_concurrency", type=int, default=6)
+    parser.add_argument("--failure_rate", type=float, default=0.01)
+    parser.add_argument("--retry_after", type=int, default=1)
+    args = parser.parse_args()
+
+    schedulers = {
+        "no scheduler": None,
+        "adaptive": Scheduler(rate=5, max_rate=200, max_concurrency=args.workers),
+    }
+
+    print(
+        f"\n{args.pages} pages, {args.workers} workers, server allows "
+        f"{args.max_rate} req/s and {args.max_concurrency} at a time, "
+        f"{args.failure_rate:.0%} random failures"
+    )
+    print("# -------------------------------------- #")
+    for name, scheduler in schedulers.items():
+        with MockServer(
+            latency=args.latency,
+            max_rate=args.max_rate,
+            max_concurrency=args.max_concurrency,
+            failure_rate=args.failure_rate,
+            retry_after=args.retry_after,
+        ) as server:
+            configure_session(pool_size=args.workers, scheduler=scheduler)
+            urls = [f"{server.url}/ad-id-{i}" for i in range(args.pages)]
+            fetched, failed, seconds = scrape(
+                urls, args.workers, fetch if scheduler else fetch_unscheduled
+            )
+            print(
+                f"\t* {name}: {round(fetched / seconds, 1)} pages/sec, {failed} failed, "
+                f"{server.throttled} throttled by the server"
+            )
+            if scheduler is not None:
+                print(f"\t  {scheduler.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare reading ads from their embedded JSON record against reading them
+from the DOM, on the same pages. The synthetic pages are rendered from the
+same rows for both paths, so also check real pages, archived by a scrape
+with ARCHIVE_PAGES or saved in a folder, with --archive or --directory.
+
+Run from the src folder: python -m benchmarks.bench_structured
+python -m benchmarks.bench_structured --archive ../data/archive
+"""
+
+
+import argparse
+
+from benchmarks.bench_parsing import time_per_page
+from benchmarks.fixtures import get_fixtures
+from dependencies.scraper import parse_ad_dom
+from dependencies.structured import extract_structured_ad
+from dependencies.writer import AD_SCHEMA
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=str, default="../data/bp_ads.csv")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--directory", type=str, default="")
+    parser.add_argument("--archive", type=str, default="")
+    args = parser.parse_args()
+
+    pages = get_fixtures(
+        args.rows, args.directory, embed_json=True, archive_path=args.archive
+    )
+    # Pages without a JSON record are left to the DOM, nothing to compare
+    without_record = sum(extract_structured_ad(url, page) is None for url, page in pages)
+    pages = [(url, page) for url, page in pages if extract_structured_ad(url, page) is not None]
+    pages = pages[: args.pages]
+
+    # Both paths should agree on everything but the text they don't clean
+    # the same way, before comparing their speed
+    mismatches = {}
+    for url, page in pages:
+        structured, dom = extract_structured_ad(url, page), parse_ad_dom(url, page)
+        for key in AD_SCHEMA:
+            if key in ["full_address", "street", "summary"]:
+                continue
+            if structured.get(key) != dom.get(key):
+                mismatches[key] = mismatches.get(key, 0) + 1
+
+    dom = time_per_page(parse_ad_dom, pages, args.repeat)
+    structured = time_per_page(extract_structured_ad, pages, args.repeat)
+
+    print(f"\n{len(pages)} pages, {without_record} more without a JSON record")
+    print("# -------------------------------------- #")
+    print(f"\t* DOM: {round(dom, 2)} ms/page")
+    print(f"\t* embedded JSON: {round(structured, 2)} ms/page")
+    print(f"\t* speedup: {round(dom / structured, 1)}x")
+    print(f"\t* fields differing: {mismatches or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
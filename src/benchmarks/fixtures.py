@@ -0,0 +1,257 @@
+"""
+Synthetic BoligPortal pages, in the markup scrape_ads_urls and scrape_ad
+expect, rendered from the rows of an earlier scrape.
+"""
+
+
+import csv
+import html
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from dependencies.archive import PageArchive
+from dependencies.scraper import BASE_URL, DANISH_MONTHS, RESULTS_PER_PAGE
+from dependencies.translation import FakeBackend
+
+
+DEFAULT_ROWS_PATH = "../data/bp_ads.csv"
+MONTH_NAMES = {number: name for name, number in DANISH_MONTHS.items()}
+TO_DANISH = {english: danish for danish, english in FakeBackend.vocabulary.items()}
+TO_DANISH.update({"The living room": "Stuen", "Terraced house": "Rækkehus"})
+
+# Real pages carry a lot of markup we never read: navigation, similar
+# listings, scripts. Pad the pages with some so parsing costs are realistic.
+PADDING_BLOCKS = 150
+PADDING = "".join(
+    f'<div class="css-card"><a href="/lejligheder/k%C3%B8benhavn/{i}">'
+    f'<span class="css-title">Lejlighed {i}</span>'
+    f'<span class="css-price">{10000 + i}.000 kr.</span>'
+    f'<img src="/img/{i}.jpg" alt=""></a></div>'
+    for i in range(PADDING_BLOCKS)
+)
+SCRIPT = "<script>window.__APP__ = {" + ",".join(f'"k{i}": {i}' for i in range(2000)) + "};</script>"
+
+
+def load_rows(path: str = DEFAULT_ROWS_PATH) -> List[Dict[str, str]]:
+    """Read the ads of an earlier scrape."""
+    with open(path, "r", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def danish_price(value: str) -> str:
+    """Format an amount like the site does e.g. '13.800 kr.'."""
+    return f"{int(float(value)):,} kr.".replace(",", ".")
+
+
+def danish_date(value: str) -> str:
+    """Format a MM/DD/YYYY date like the site does e.g. '1. december 2021'."""
+    day = datetime.strptime(value, "%m/%d/%Y").date()
+    return f"{day.day}. {MONTH_NAMES[day.month]} {day.year}"
+
+
+def yes_no(value: str) -> str:
+    return "Ja" if value == "1" else "Nej"
+
+
+def render_page(body: str, data: str = "") -> bytes:
+    return (
+        "<!DOCTYPE html><html lang=\"da\"><head><meta charset=\"utf-8\">"
+        "<title>BoligPortal</title></head><body>"
+        f"<header><nav>{PADDING[:2000]}</nav></header><main>{body}</main>"
+        f"<aside>{PADDING}</aside>{SCRIPT}{data}</body></html>"
+    ).encode("utf-8")
+
+
+def render_next_data(row: Dict[str, str]) -> str:
+    """Render the Next.js data script carrying the ad's record."""
+    iso_date = lambda value: datetime.strptime(value, "%m/%d/%Y").date().isoformat()
+    categories = {
+        "Apartment": "rental_apartment",
+        "Room": "rental_room",
+        "House": "rental_house",
+        "Terraced house": "rental_townhouse",
+    }
+    months = {"Unlimited": 0, "1-11 months": 6, "12-23 months": 12, "24+ months": 24}
+    address = row["full_address"].split(",")
+    record = {
+        "id": int(row["url"].split("-id-")[-1]),
+        "url": row["url"],
+        "category": categories.get(row["housing_type"], "rental_apartment"),
+        "street_name": row["street"],
+        "postal_code": row["zip_code"],
+        "city": address[1].replace(row["zip_code"], "").strip() if len(address) > 1 else "",
+        "city_area": row["district"],
+        "size_m2": float(row["size"]),
+        "rooms": int(row["number_of_rooms"]),
+        "floor": (
+            int(row["floor"]) if row["floor"].isdigit()
+            else TO_DANISH.get(row["floor"], row["floor"])
+        ),
+        "rental_period": months.get(row["rental_period"], 0),
+        "available_from": iso_date(row["available_from"]),
+        "advertised_date": iso_date(row["creation_date"]) + "T09:30:00+01:00",
+        "description": row["summary"],
+        "monthly_rent": int(row["monthly_rent"]),
+        "monthly_rent_extra_costs": int(row["aconto"]),
+        "deposit": int(row["deposit"]),
+        "prepaid_rent": int(row["prepaid_rent"]),
+        "move_in_price": int(row["occupancy_price"]),
+        "features": {
+            "furnished": row["is_furnished"] == "1",
+            "shareable": row["is_shareable"] == "1",
+            "pets_allowed": row["pets_allowed"] == "1",
+            "elevator": row["has_elevator"] == "1",
+            "student_only": row["students_only"] == "1",
+            "balcony": row["has_balcony"] == "1",
+            "parking": row["has_parking"] == "1",
+        },
+    }
+    data = {"props": {"pageProps": {"ad": record}}, "page": "/ad"}
+    return (
+        '<script id="__NEXT_DATA__" type="application/json">'
+        + json.dumps(data, ensure_ascii=False).replace("</", "<\\/")
+        + "</script>"
+    )
+
+
+def render_ad_page(row: Dict[str, str], embed_json: bool = False) -> bytes:
+    """Render the page of one ad, with its JSON record if embed_json."""
+    floor = row["floor"]
+    floor = f"{floor}." if floor.isdigit() else TO_DANISH.get(floor, floor)
+    details = {
+        "Boligtype": TO_DANISH.get(row["housing_type"], row["housing_type"]),
+        "Størrelse": f"{float(row['size']):g} m²",
+        "Værelser": row["number_of_rooms"],
+        "Etage": floor,
+        "Møbleret": yes_no(row["is_furnished"]),
+        "Delevenlig": yes_no(row["is_shareable"]),
+        "Husdyr tilladt": yes_no(row["pets_allowed"]),
+        "Elevator": yes_no(row["has_elevator"]),
+        "Kun for studerende": yes_no(row["students_only"]),
+        "Balkon/altan": yes_no(row["has_balcony"]),
+        "Parkering": yes_no(row["has_parking"]),
+        "Lejeperiode": TO_DANISH.get(row["rental_period"], row["rental_period"]),
+        "Ledig fra": danish_date(row["available_from"]),
+        "Månedlig leje": danish_price(row["monthly_rent"]),
+        "Aconto": danish_price(row["aconto"]),
+        "Depositum": danish_price(row["deposit"]),
+        "Forudbetalt husleje": danish_price(row["prepaid_rent"]),
+        "Indflytningspris": danish_price(row["occupancy_price"]),
+        "Oprettelsesdato": datetime.strptime(row["creation_date"], "%m/%d/%Y").strftime(
+            "%d.%m.%Y"
+        ),
+    }
+    rows = "".join(
+        f'<div class="css-row"><span class="css-1218edi">{html.escape(key)}</span>'
+        f'<span class="css-1e8e3fr">{html.escape(value)}</span></div>'
+        for key, value in details.items()
+    )
+    body = (
+        f'<div class="css-1bbi9fj"><h1>{html.escape(row["size"])} m² lejlighed</h1></div>'
+        f'<div class="css-1bbi9fj">{html.escape(row["full_address"])}</div>'
+        f'<section>{rows}</section>'
+        f'<div class="css-1oj64sa"><p>{html.escape(row["summary"])}</p></div>'
+    )
+    return render_page(body, render_next_data(row) if embed_json else "")
+
+
+def render_results_page(urls: List[str], total: int) -> bytes:
+    """Render a results page linking to urls, reporting total results."""
+    cards = "".join(
+        f'<div class="css-1e7fg19"><a href="{html.escape(url)}">Lejlighed</a></div>'
+        for url in urls
+    )
+    return render_page(f"<h1>{total} lejeboliger</h1>{cards}")
+
+
+def ad_path(url: str) -> str:
+    """Return the path part of a BoligPortal ad URL."""
+    return url.replace(BASE_URL, "")
+
+
+def get_fixtures(
+    rows_path: str = DEFAULT_ROWS_PATH,
+    directory: str = "",
+    embed_json: bool = False,
+    archive_path: str = "",
+) -> List[Tuple[str, bytes]]:
+    """
+    Return (url, html) of ad pages. Archived pages are read from the page
+    archive at archive_path, or saved pages from directory, if given. Else
+    pages are rendered from the rows of an earlier scrape.
+    """
+    if archive_path:
+        archive = PageArchive(archive_path)
+        fixtures = [
+            (url, page) for url, _, page in archive.iter_pages(url_pattern="%-id-%")
+        ]
+        archive.close()
+        return fixtures
+    if directory:
+        fixtures = []
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name), "rb") as f:
+                fixtures.append((name, f.read()))
+        return fixtures
+    return [
+        (row["url"], render_ad_page(row, embed_json)) for row in load_rows(rows_path)
+    ]
+
+
+def results_pages(urls: List[str]) -> List[bytes]:
+    """Render the results pages for a list of ad URLs."""
+    return [
+        render_results_page(
+            [ad_path(url) for url in urls[i : i + RESULTS_PER_PAGE]], len(urls)
+        )
+        for i in range(0, len(urls), RESULTS_PER_PAGE)
+    ]
+
+
+class MockSite:
+    """
+    BoligPortal as a MockServer render function: the search results at
+    results_path, paginated with &offset=N like the site, and the page of
+    every ad they link to. Pages are rendered from the rows of an earlier
+    scrape as they're requested; for more ads than rows, rows are reused
+    under new ad IDs.
+    """
+
+    results_path = "/lejeboliger/k%C3%B8benhavn/"
+
+    def __init__(
+        self,
+        rows_path: str = DEFAULT_ROWS_PATH,
+        ads: int = 0,
+        embed_json: bool = False,
+    ):
+        rows = load_rows(rows_path)
+        self.embed_json = embed_json
+        self.rows = []
+        for i in range(ads or len(rows)):
+            row = rows[i % len(rows)]
+            if i >= len(rows):
+                prefix, ad_id = row["url"].rsplit("-id-", 1)
+                row = dict(row, url=f"{prefix}-id-{int(ad_id) + i * 10000000}")
+            self.rows.append(row)
+        self.paths = {ad_path(row["url"]): i for i, row in enumerate(self.rows)}
+
+    def main_url(self, server_url: str) -> str:
+        return server_url + self.results_path
+
+    def is_results_page(self, path: str) -> bool:
+        return urlsplit(path).path == self.results_path
+
+    def render(self, path: str) -> Optional[bytes]:
+        if self.is_results_page(path):
+            offset = int(parse_qs(urlsplit(path).query).get("offset", ["0"])[0])
+            rows = self.rows[offset : offset + RESULTS_PER_PAGE]
+            return render_results_page(
+                [ad_path(row["url"]) for row in rows], len(self.rows)
+            )
+        if path in self.paths:
+            return render_ad_page(self.rows[self.paths[path]], self.embed_json)
+        return None
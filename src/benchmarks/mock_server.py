@@ -0,0 +1,162 @@
+"""Local stand-in HTTP server used by the benchmarks."""
+
+
+import gzip
+import random
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+from typing import Callable, List, Optional, Tuple
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Serve the server's page for any path, over HTTP/1.1 keep-alive."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle and
+    # delayed ACKs add ~40ms to every keep-alive request.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.count_connection()
+        if self.server.connect_latency:
+            # Stand-in for the TCP+TLS handshake of a real remote host
+            sleep(self.server.connect_latency)
+
+    def do_GET(self):
+        start_time = monotonic()
+        status = self.server.count_request()
+        try:
+            if status is not None:
+                self.send_throttled(status)
+                return
+            if self.server.latency:
+                sleep(self.server.latency)
+            self.send_page()
+        finally:
+            self.server.finish_request_count(self.path, start_time)
+
+    def send_throttled(self, status: int):
+        self.send_response(status)
+        if status == 429 and self.server.retry_after is not None:
+            self.send_header("Retry-After", str(self.server.retry_after))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_page(self):
+        body = self.server.render(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            encoding = "gzip"
+        else:
+            encoding = None
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server running in the background that counts connections
+    and requests, and logs (path, start, end) of each request on the
+    monotonic clock. Use as a context manager to start and stop it.
+
+    Like a site protecting itself, it can answer 429 to requests over
+    max_rate per second, with a Retry-After of retry_after seconds if set,
+    503 to requests over max_concurrency at a time and 503 to a random
+    failure_rate of requests.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        render: Optional[Callable[[str], bytes]] = None,
+        latency: float = 0.0,
+        connect_latency: float = 0.0,
+        handler=MockHandler,
+        max_rate: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        failure_rate: float = 0.0,
+        retry_after: Optional[int] = None,
+    ):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.render = render or (lambda path: b"<html><body>" + b"x" * 20000 + b"</body></html>")
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after
+        self.connections = 0
+        self.requests = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.recent = deque()
+        self.log: List[Tuple[str, float, float]] = []
+        self._counter_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_connection(self):
+        with self._counter_lock:
+            self.connections += 1
+
+    def count_request(self) -> Optional[int]:
+        """Count a request, returning the status to throttle it with, if any."""
+        with self._counter_lock:
+            self.requests += 1
+            self.in_flight += 1
+            now = monotonic()
+            while self.recent and self.recent[0] < now - 1:
+                self.recent.popleft()
+            status = None
+            if self.max_rate is not None and len(self.recent) >= self.max_rate:
+                status = 429
+            elif self.max_concurrency is not None and self.in_flight > self.max_concurrency:
+                status = 503
+            elif self.failure_rate and random.random() < self.failure_rate:
+                status = 503
+            else:
+                self.recent.append(now)
+            if status is not None:
+                self.throttled += 1
+            return status
+
+    def finish_request_count(self, path: str, start_time: float):
+        with self._counter_lock:
+            self.in_flight -= 1
+            self.log.append((path, start_time, monotonic()))
+
+    def reset_counters(self):
+        with self._counter_lock:
+            self.connections = 0
+            self.requests = 0
+            self.throttled = 0
+            self.log = []
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,191 @@
+"""
+Compressed archive of every fetched page, so ads can be re-parsed later
+without going back to the site.
+"""
+
+
+import hashlib
+import os
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+from time import monotonic
+from typing import Iterator, Optional, Tuple
+
+# zstd compresses HTML better and faster than zlib, which stays as the
+# fallback when zstandard is not installed.
+try:
+    import zstandard
+
+    DEFAULT_CODEC = "zstd"
+except ImportError:
+    zstandard = None
+    DEFAULT_CODEC = "zlib"
+
+
+DEFAULT_ARCHIVE_PATH = "../data/archive"
+SEGMENT_SIZE = 64 * 1024 * 1024
+# The index is committed every COMMIT_PAGES pages or COMMIT_SECONDS, and on close
+COMMIT_PAGES = 100
+COMMIT_SECONDS = 5.0
+
+
+def compress(body: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(body)
+    return zlib.compress(body, 6)
+
+
+def decompress(blob: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Page was archived with zstd, install zstandard to read it.")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
+
+
+class PageArchive:
+    """
+    Pages stored once per distinct content (by SHA-256), compressed and
+    appended to segment files of up to SEGMENT_SIZE. A SQLite index maps
+    each fetch of an URL, with its time, to the stored content. Pages are
+    compressed outside the lock, so fetch threads only wait on each other
+    for the append, and the index is committed in batches.
+    """
+
+    def __init__(self, path: str = DEFAULT_ARCHIVE_PATH, codec: str = DEFAULT_CODEC):
+        self.path = path
+        self.codec = codec
+        self.uncommitted = 0
+        self.last_commit = monotonic()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        self.connection = sqlite3.connect(
+            os.path.join(path, "index.sqlite"), check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                codec TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS fetches (
+                url TEXT NOT NULL,
+                fetched_at TEXT NOT NULL,
+                sha256 TEXT NOT NULL REFERENCES blobs (sha256)
+            );
+            CREATE INDEX IF NOT EXISTS fetches_url ON fetches (url, fetched_at);
+            CREATE INDEX IF NOT EXISTS fetches_time ON fetches (fetched_at);
+            """
+        )
+        self.connection.commit()
+
+        (self.segment,) = self.connection.execute(
+            "SELECT COALESCE(MAX(segment), 0) FROM blobs"
+        ).fetchone()
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"segment-{segment:05d}.bin")
+
+    def segment_size(self) -> int:
+        path = self.segment_path(self.segment)
+        return os.path.getsize(path) if os.path.isfile(path) else 0
+
+    def store(self, url: str, body: bytes, fetched_at: Optional[datetime] = None) -> str:
+        """Archive a fetched page and return the SHA-256 of its content."""
+        sha256 = hashlib.sha256(body).hexdigest()
+        fetched_at = (fetched_at or datetime.now()).isoformat(timespec="seconds")
+
+        with self._lock:
+            known = self._is_stored(sha256)
+        blob = None if known else compress(body, self.codec)
+
+        with self._lock:
+            # Another thread may have stored the same content meanwhile
+            if blob is not None and not self._is_stored(sha256):
+                if self.segment == 0 or self.segment_size() + len(blob) > SEGMENT_SIZE:
+                    self.segment += 1
+                with open(self.segment_path(self.segment), "ab") as f:
+                    offset = f.tell()
+                    f.write(blob)
+                self.connection.execute(
+                    "INSERT INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+                    (sha256, self.segment, offset, len(blob), len(body), self.codec),
+                )
+            self.connection.execute(
+                "INSERT INTO fetches VALUES (?, ?, ?)", (url, fetched_at, sha256)
+            )
+            self.uncommitted += 1
+            if (
+                self.uncommitted >= COMMIT_PAGES
+                or monotonic() - self.last_commit >= COMMIT_SECONDS
+            ):
+                self._commit()
+
+        return sha256
+
+    def _is_stored(self, sha256: str) -> bool:
+        return self.connection.execute(
+            "SELECT 1 FROM blobs WHERE sha256 = ?", (sha256,)
+        ).fetchone() is not None
+
+    def _commit(self) -> None:
+        self.connection.commit()
+        self.uncommitted = 0
+        self.last_commit = monotonic()
+
+    def load(self, sha256: str) -> bytes:
+        """Return the content of an archived page."""
+        with self._lock:
+            segment, offset, length, codec = self.connection.execute(
+                "SELECT segment, offset, length, codec FROM blobs WHERE sha256 = ?",
+                (sha256,),
+            ).fetchone()
+        with open(self.segment_path(segment), "rb") as f:
+            f.seek(offset)
+            return decompress(f.read(length), codec)
+
+    def iter_pages(
+        self,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        url_pattern: str = "%",
+        daily: bool = True,
+    ) -> Iterator[Tuple[str, datetime, bytes]]:
+        """
+        Yield (url, fetch time, content) of archived pages fetched between
+        the since and until ISO dates, for URLs matching the SQL LIKE
+        url_pattern. With daily, only the last fetch of each URL per day.
+        """
+        query = "SELECT url, fetched_at, sha256 FROM fetches WHERE url LIKE ?"
+        parameters = [url_pattern]
+        if since:
+            query += " AND fetched_at >= ?"
+            parameters.append(since)
+        if until:
+            query += " AND fetched_at < date(?, '+1 day')"
+            parameters.append(until)
+        if daily:
+            query = (
+                "SELECT url, MAX(fetched_at), sha256 FROM ("
+                + query
+                + ") GROUP BY url, substr(fetched_at, 1, 10)"
+            )
+        query += " ORDER BY 2"
+
+        with self._lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+        for url, fetched_at, sha256 in rows:
+            yield url, datetime.fromisoformat(fetched_at), self.load(sha256)
+
+    def close(self) -> None:
+        with self._lock:
+            self._commit()
+            self.connection.close()
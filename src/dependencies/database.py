@@ -0,0 +1,298 @@
+"""Local SQLite database of every ad scraped, with price and availability history."""
+
+
+import os
+import random
+import sqlite3
+import threading
+from datetime import date, datetime
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from dependencies.listing_index import get_ad_id
+from dependencies.writer import AD_SCHEMA, DATE_FORMAT
+
+
+DATABASE_EXTENSIONS = (".sqlite", ".db")
+DATE_COLUMNS = ["creation_date", "scraped_date", "available_from"]
+INTEGER_COLUMNS = [
+    "zip_code",
+    "number_of_rooms",
+    "monthly_rent",
+    "aconto",
+    "deposit",
+    "prepaid_rent",
+    "occupancy_price",
+    "total_monthly_cost",
+    "months_of_prepaid_rent",
+    "months_of_deposit",
+    "is_furnished",
+    "is_shareable",
+    "pets_allowed",
+    "has_elevator",
+    "students_only",
+    "has_balcony",
+    "has_parking",
+]
+REAL_COLUMNS = ["size"]
+INDEXED_COLUMNS = [
+    "zip_code",
+    "total_monthly_cost",
+    "available_from",
+    "creation_date",
+    "district",
+]
+# A new history entry is kept whenever one of these changes
+HISTORY_COLUMNS = [
+    "monthly_rent",
+    "aconto",
+    "deposit",
+    "prepaid_rent",
+    "total_monthly_cost",
+    "available_from",
+    "rental_period",
+]
+
+
+def is_database(path: str) -> bool:
+    return path.endswith(DATABASE_EXTENSIONS)
+
+
+def get_sql_type(column: str) -> str:
+    if column in INTEGER_COLUMNS:
+        return "INTEGER"
+    if column in REAL_COLUMNS:
+        return "REAL"
+    return "TEXT"
+
+
+def is_missing(value) -> bool:
+    return (
+        value is None
+        or value is pd.NaT
+        or value == ""
+        or (isinstance(value, float) and value != value)
+    )
+
+
+def to_sql_date(value) -> Optional[str]:
+    """Return a date, or a MM/DD/YYYY or YYYY-MM-DD string, as YYYY-MM-DD."""
+    if is_missing(value):
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.strptime(value, DATE_FORMAT)
+        except ValueError:
+            value = date.fromisoformat(value)
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.isoformat()
+
+
+def to_sql_integer(value) -> Optional[int]:
+    if is_missing(value):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_sql_real(value) -> Optional[float]:
+    return None if is_missing(value) else float(value)
+
+
+def to_sql_text(value) -> Optional[str]:
+    return None if is_missing(value) else str(value)
+
+
+def get_sql_converter(column: str) -> Callable:
+    """Return how values of a column are stored: dates as YYYY-MM-DD, missing ones as NULL."""
+    if column in DATE_COLUMNS:
+        return to_sql_date
+    if column in INTEGER_COLUMNS:
+        return to_sql_integer
+    if column in REAL_COLUMNS:
+        return to_sql_real
+    return to_sql_text
+
+
+class ListingDatabase:
+    """
+    SQLite table of the latest version of every ad, keyed by ad ID, and a
+    history table with an entry each time an ad's price or availability
+    changes. Dates are stored as YYYY-MM-DD so they compare as text, and
+    the columns filters use the most are indexed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.last_query = None
+        self.rows_read = 0
+        self.changes = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        columns = ",\n".join(
+            f"{column} {get_sql_type(column)}" for column in AD_SCHEMA
+        )
+        history_columns = ",\n".join(
+            f"{column} {get_sql_type(column)}" for column in HISTORY_COLUMNS
+        )
+        self.connection.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS ads (
+                ad_id TEXT PRIMARY KEY,
+                {columns},
+                first_seen TEXT NOT NULL,
+                last_updated TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS ad_history (
+                ad_id TEXT NOT NULL,
+                scraped_date TEXT NOT NULL,
+                {history_columns},
+                PRIMARY KEY (ad_id, scraped_date)
+            );
+            """
+            + "".join(
+                f"CREATE INDEX IF NOT EXISTS ads_{column} ON ads ({column});\n"
+                for column in INDEXED_COLUMNS
+            )
+        )
+        # Columns added to the schema since the database was made
+        existing = {row[1] for row in self.connection.execute("PRAGMA table_info(ads)")}
+        for column in AD_SCHEMA:
+            if column not in existing:
+                self.connection.execute(
+                    f"ALTER TABLE ads ADD COLUMN {column} {get_sql_type(column)}"
+                )
+        self.connection.commit()
+
+    def upsert(self, ads: Iterable[Dict]) -> int:
+        """
+        Insert new ads and update known ones by ad ID, adding a history entry
+        for every ad that is new or whose price or availability changed.
+        Returns how many history entries were added.
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        converters = [(column, get_sql_converter(column)) for column in AD_SCHEMA]
+        rows = {}
+        for ad in ads:
+            ad_id = get_ad_id(ad.get("url") or "")
+            if ad_id is not None:
+                rows[ad_id] = [convert(ad.get(column)) for column, convert in converters]
+        if not rows:
+            return 0
+
+        history_positions = [AD_SCHEMA.index(column) for column in HISTORY_COLUMNS]
+        scraped_date_position = AD_SCHEMA.index("scraped_date")
+
+        with self._lock:
+            known = {}
+            ad_ids = list(rows)
+            for i in range(0, len(ad_ids), 500):
+                batch = ad_ids[i:i + 500]
+                known.update(
+                    (row[0], row[1:])
+                    for row in self.connection.execute(
+                        f"SELECT ad_id, {', '.join(HISTORY_COLUMNS)} FROM ads "
+                        f"WHERE ad_id IN ({', '.join('?' * len(batch))})",
+                        batch,
+                    )
+                )
+
+            history = []
+            for ad_id, row in rows.items():
+                values = tuple(row[i] for i in history_positions)
+                if known.get(ad_id) != values:
+                    scraped_date = row[scraped_date_position] or date.today().isoformat()
+                    history.append((ad_id, scraped_date) + values)
+
+            update = ", ".join(
+                f"{column} = excluded.{column}" for column in AD_SCHEMA + ["last_updated"]
+            )
+            self.connection.executemany(
+                f"""
+                INSERT INTO ads (ad_id, {', '.join(AD_SCHEMA)}, first_seen, last_updated)
+                VALUES ({', '.join('?' * (len(AD_SCHEMA) + 3))})
+                ON CONFLICT (ad_id) DO UPDATE SET {update}
+                """,
+                [[ad_id] + row + [now, now] for ad_id, row in rows.items()],
+            )
+            self.connection.executemany(
+                f"""
+                INSERT OR REPLACE INTO ad_history (ad_id, scraped_date, {', '.join(HISTORY_COLUMNS)})
+                VALUES ({', '.join('?' * (len(HISTORY_COLUMNS) + 2))})
+                """,
+                history,
+            )
+            self.connection.commit()
+        self.changes += len(rows)
+        return len(history)
+
+    def get_history(self, ad_id: str) -> pd.DataFrame:
+        """Return the price and availability history of an ad, oldest first."""
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT * FROM ad_history WHERE ad_id = ? ORDER BY scraped_date",
+                self.connection,
+                params=[ad_id],
+            )
+
+    def sample(self, columns: List[str], size: int = 1000) -> pd.DataFrame:
+        """Return some columns of up to size ads picked at random, dates as datetimes."""
+        with self._lock:
+            last_rowid = self.connection.execute("SELECT MAX(rowid) FROM ads").fetchone()[0] or 0
+            rowids = random.sample(range(1, last_rowid + 1), min(size, last_rowid))
+            rows = []
+            for i in range(0, len(rowids), 500):
+                batch = rowids[i:i + 500]
+                rows += self.connection.execute(
+                    f"SELECT {', '.join(columns)} FROM ads "
+                    f"WHERE rowid IN ({', '.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+        df = pd.DataFrame(rows, columns=columns)
+        for column in DATE_COLUMNS:
+            if column in df.columns:
+                df[column] = pd.to_datetime(df[column], format="%Y-%m-%d")
+        return df
+
+    def select(self, where: str, params: List) -> pd.DataFrame:
+        """
+        Return the ads matching a WHERE clause, indexed by ad ID, with dates
+        as dates like filter_data returns them.
+        """
+        query = f"SELECT ad_id, {', '.join(AD_SCHEMA)} FROM ads WHERE {where}"
+        with self._lock:
+            start_time = perf_counter()
+            df = pd.read_sql_query(query, self.connection, params=params, index_col="ad_id")
+            seconds = perf_counter() - start_time
+            plan = self.connection.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+            self.rows_read = self.connection.execute("SELECT COUNT(*) FROM ads").fetchone()[0]
+        for column in DATE_COLUMNS:
+            df[column] = pd.to_datetime(df[column], format="%Y-%m-%d").dt.date
+        self.last_query = (query, params, [row[-1] for row in plan], len(df), seconds)
+        return df
+
+    def describe(self) -> List[str]:
+        """Lines for explain() about the last query."""
+        if self.last_query is None:
+            return []
+        query, params, plan, rows, seconds = self.last_query
+        lines = [f"\t* SQL: {query}", f"\t* parameters: {params}"]
+        lines += [f"\t* SQLite: {step}" for step in plan]
+        lines.append(f"\t* rows: {rows} in {round(seconds, 4)}s")
+        return lines
+
+    def close(self) -> None:
+        with self._lock:
+            # Keep the statistics the query planner picks indexes by up to date
+            if self.changes:
+                self.connection.execute("PRAGMA analysis_limit = 1000")
+                self.connection.execute("ANALYZE")
+            self.connection.close()
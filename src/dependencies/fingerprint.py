@@ -0,0 +1,227 @@
+"""
+Fingerprints of scraped ads, to recognize an unchanged listing, or the same
+flat reposted under a new ad ID, before translating it again. An ad's
+record key hashes its normalized address, size and rent; its summary is
+compared by MinHash of word shingles, so small edits still match.
+"""
+
+
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from dependencies.listing_index import get_ad_id
+from dependencies.metrics import count, set_gauge
+
+
+DEFAULT_FINGERPRINT_PATH = "../data/fingerprints.sqlite"
+DEFAULT_SIMILARITY = 0.8
+SHINGLE_SIZE = 3
+MINHASH_PERMUTATIONS = 64
+MERSENNE_PRIME = (1 << 31) - 1
+# Fixed so fingerprints stay comparable across runs
+_rng = random.Random(20221201)
+MINHASH_A = np.array(
+    [_rng.randrange(1, MERSENNE_PRIME) for _ in range(MINHASH_PERMUTATIONS)], dtype=np.uint64
+)
+MINHASH_B = np.array(
+    [_rng.randrange(0, MERSENNE_PRIME) for _ in range(MINHASH_PERMUTATIONS)], dtype=np.uint64
+)
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize_text(text: Optional[str]) -> List[str]:
+    """Lowercase words without punctuation, e.g. ['ørestads', 'boulevard', '2300']"""
+    return WORD_PATTERN.findall(str(text or "").casefold())
+
+
+def get_record_key(ad: Dict) -> str:
+    """Hash of the normalized address, size in m² and monthly rent."""
+    size = ad.get("size")
+    rent = ad.get("monthly_rent")
+    fields = [
+        " ".join(normalize_text(ad.get("full_address"))),
+        "" if size in (None, "") else str(round(float(size))),
+        "" if rent in (None, "") else str(int(rent)),
+    ]
+    return hashlib.sha1("|".join(fields).encode("utf-8")).hexdigest()
+
+
+def get_minhash(text: Optional[str]) -> np.ndarray:
+    """MinHash signature of the text's word shingles, SHINGLE_SIZE words each."""
+    words = normalize_text(text)
+    shingles = {
+        " ".join(words[i:i + SHINGLE_SIZE])
+        for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))
+    }
+    hashes = np.array(
+        [zlib.crc32(shingle.encode("utf-8")) % MERSENNE_PRIME for shingle in shingles],
+        dtype=np.uint64,
+    )
+    permuted = (np.outer(hashes, MINHASH_A) + MINHASH_B) % MERSENNE_PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def get_similarity(minhash: np.ndarray, other: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the shingles behind two signatures."""
+    return float(np.mean(minhash == other))
+
+
+class Fingerprint:
+    """What identifies an ad's content, computed from its Danish text."""
+
+    def __init__(self, ad: Dict):
+        self.ad_id = get_ad_id(ad.get("url") or "")
+        self.record_key = get_record_key(ad)
+        self.summary_hash = hashlib.sha1(
+            " ".join(normalize_text(ad.get("summary"))).encode("utf-8")
+        ).hexdigest()
+        self.minhash = get_minhash(ad.get("summary"))
+
+
+class FingerprintStore:
+    """
+    SQLite table of the fingerprints of translated ads, with their
+    translations. An ad with the record key of a stored one and the same
+    or a similar enough summary reuses its translations instead of being
+    translated, and is marked as a duplicate_of it if its ad ID differs.
+    """
+
+    def __init__(self, path: str = DEFAULT_FINGERPRINT_PATH, similarity: float = DEFAULT_SIMILARITY):
+        self.path = path
+        self.similarity = similarity
+        self.pending: Dict[int, Fingerprint] = {}
+        self.matches = {"exact": 0, "near": 0, "new": 0}
+        self.texts_reused = 0
+        self.texts_translated = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                ad_id TEXT PRIMARY KEY,
+                record_key TEXT NOT NULL,
+                summary_hash TEXT NOT NULL,
+                minhash BLOB NOT NULL,
+                translations TEXT NOT NULL,
+                first_seen TEXT NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS fingerprints_record_key ON fingerprints (record_key)"
+        )
+        self.connection.commit()
+
+    def find(self, fingerprint: Fingerprint) -> Optional[Tuple[str, str, Dict]]:
+        """
+        Return how an ad matches a stored one, 'exact' or 'near', with the
+        stored ad's ID and translations, or None. The ad's own earlier
+        version is preferred, then the first ad seen.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT ad_id, summary_hash, minhash, translations FROM fingerprints "
+                "WHERE record_key = ? ORDER BY ad_id = ? DESC, first_seen",
+                (fingerprint.record_key, fingerprint.ad_id),
+            ).fetchall()
+        for ad_id, summary_hash, minhash, translations in rows:
+            if summary_hash == fingerprint.summary_hash:
+                return "exact", ad_id, json.loads(translations)
+        for ad_id, summary_hash, minhash, translations in rows:
+            similarity = get_similarity(fingerprint.minhash, np.frombuffer(minhash, dtype=np.uint32))
+            if similarity >= self.similarity:
+                return "near", ad_id, json.loads(translations)
+        return None
+
+    def reuse(self, ads: List[Dict], fields: List[str]) -> List[Dict]:
+        """
+        Fill in the translations of the ads matching a stored one, and
+        return the others, which are still to be translated.
+        """
+        to_translate = []
+        for ad in ads:
+            fingerprint = Fingerprint(ad)
+            match = self.find(fingerprint)
+            if match is None or not all(field in match[2] for field in fields):
+                self.matches["new"] += 1
+                self.pending[id(ad)] = fingerprint
+                to_translate.append(ad)
+                continue
+
+            kind, ad_id, translations = match
+            texts = [field for field in fields if isinstance(ad.get(field), str)]
+            for field in texts:
+                ad[field] = translations[field]
+            if ad_id != fingerprint.ad_id:
+                ad["duplicate_of"] = ad_id
+            self.matches[kind] += 1
+            self.texts_reused += len(texts)
+            count("fingerprint_matches", kind=kind)
+        self.update_gauge()
+        return to_translate
+
+    def add(self, ads: List[Dict], fields: List[str]) -> None:
+        """Store the fingerprints of ads just translated, with their translations."""
+        now = datetime.now().isoformat(timespec="seconds")
+        rows = []
+        for ad in ads:
+            fingerprint = self.pending.pop(id(ad), None)
+            if fingerprint is None or fingerprint.ad_id is None:
+                continue
+            self.texts_translated += sum(isinstance(ad.get(field), str) for field in fields)
+            translations = {field: ad.get(field) for field in fields}
+            rows.append((
+                fingerprint.ad_id,
+                fingerprint.record_key,
+                fingerprint.summary_hash,
+                fingerprint.minhash.tobytes(),
+                json.dumps(translations, ensure_ascii=False, default=str),
+                now,
+            ))
+        with self._lock:
+            self.connection.executemany(
+                """
+                INSERT INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (ad_id) DO UPDATE SET
+                    record_key = excluded.record_key,
+                    summary_hash = excluded.summary_hash,
+                    minhash = excluded.minhash,
+                    translations = excluded.translations
+                """,
+                rows,
+            )
+            self.connection.commit()
+        self.update_gauge()
+
+    def discard(self, ads: List[Dict]) -> None:
+        """Forget the fingerprints of ads which failed to translate."""
+        for ad in ads:
+            self.pending.pop(id(ad), None)
+
+    def avoided(self) -> float:
+        """Fraction of the texts to translate this run reused from a stored ad."""
+        total = self.texts_reused + self.texts_translated
+        return self.texts_reused / total if total else 0.0
+
+    def update_gauge(self) -> None:
+        set_gauge("translations_avoided_ratio", round(self.avoided(), 4))
+
+    def stats(self) -> Dict[str, object]:
+        return {**self.matches, "translations_avoided": f"{self.avoided():.1%}"}
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
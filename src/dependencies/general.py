@@ -3,9 +3,7 @@
 
 import json
 import os
-from functools import wraps
-from typing import Callable, Union, Dict
-from time import time
+from typing import Union, Dict
 
 
 def read_json_local(path: str):
@@ -32,15 +30,12 @@ def load_configuration_file(path: str) -> Union[bool, Dict[str, Union[str, int]]
         return False
 
 
-def timing(f: Callable) -> None:
-    """Timing decorator for funcctions."""
-
-    @wraps(f)
-    def wrap(*args, **kw):
-        ts = time()
-        result = f(*args, **kw)
-        te = time()
-        print(f"Elapsed time: {round((te - ts)/ 60, 2):,} min")
-        return result
-
-    return wrap
+def add_timestamp(path: str, timestr: str) -> str:
+    """Insert a timestamp before the extension e.g. 'ads.csv' to 'ads_<timestr>.csv'."""
+    return (
+        (".").join(path.split(".")[:-1])
+        + "_"
+        + timestr
+        + "."
+        + path.split(".")[-1]
+    )
@@ -0,0 +1,128 @@
+"""
+Offline location lookup by ZIP code: coordinates and public transport fare
+zone of each ZIP code, from a table bundled with the project, compiled once
+into an array indexed by ZIP code and memory-mapped. A grid over the
+coordinates answers "within N km of a point" as the set of ZIP codes in
+range, for the filters to look every listing's ZIP code up in at once.
+"""
+
+
+import math
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+GEO_TABLE_PATH = "../data/geo/zip_codes.csv"
+ZIP_CODES = 10000
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.2
+# About 5.6 km north to south and 3.1 km east to west at Copenhagen
+GRID_CELL_DEGREES = 0.05
+GEO_DTYPE = np.dtype([("latitude", "f4"), ("longitude", "f4"), ("fare_zone", "i2")])
+
+
+def compile_geo_table(table_path: str, index_path: str) -> None:
+    """
+    Compile the table of ZIP code ranges into an array with a row per ZIP
+    code, unknown ones with no coordinates and fare zone 0, saved as .npy.
+    """
+    table = pd.read_csv(table_path)
+    geo = np.zeros(ZIP_CODES, dtype=GEO_DTYPE)
+    geo["latitude"] = np.nan
+    geo["longitude"] = np.nan
+    for row in table.itertuples():
+        codes = slice(row.zip_from, row.zip_to + 1)
+        geo["latitude"][codes] = row.latitude
+        geo["longitude"][codes] = row.longitude
+        geo["fare_zone"][codes] = row.fare_zone
+    # Written aside and renamed, so a filter running meanwhile never maps half a file
+    np.save(index_path + ".tmp.npy", geo)
+    os.replace(index_path + ".tmp.npy", index_path)
+
+
+def get_cell(latitude: float, longitude: float) -> Tuple[int, int]:
+    return math.floor(latitude / GRID_CELL_DEGREES), math.floor(longitude / GRID_CELL_DEGREES)
+
+
+def get_distances(
+    latitudes: np.ndarray, longitudes: np.ndarray, latitude: float, longitude: float
+) -> np.ndarray:
+    """Great-circle distances in km from a point, by the haversine formula."""
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class GeoIndex:
+    """
+    Coordinates and fare zone by ZIP code, memory-mapped from the array
+    compiled next to the table, which is compiled again if the table
+    changed. ZIP codes are bucketed in a grid of GRID_CELL_DEGREES cells,
+    so a radius query only measures the distance to ZIP codes near it.
+    """
+
+    def __init__(self, table_path: str = GEO_TABLE_PATH):
+        self.table_path = table_path
+        self.index_path = os.path.splitext(table_path)[0] + ".npy"
+        if not os.path.isfile(self.index_path) or (
+            os.path.getmtime(self.index_path) < os.path.getmtime(table_path)
+        ):
+            compile_geo_table(table_path, self.index_path)
+        self.geo = np.load(self.index_path, mmap_mode="r")
+
+        located = np.flatnonzero(~np.isnan(self.geo["latitude"]))
+        cells = {}
+        for zip_code in located:
+            cell = get_cell(self.geo["latitude"][zip_code], self.geo["longitude"][zip_code])
+            cells.setdefault(cell, []).append(zip_code)
+        self.grid: Dict[Tuple[int, int], np.ndarray] = {
+            cell: np.array(codes) for cell, codes in cells.items()
+        }
+
+    def within(self, latitude: float, longitude: float, km: float) -> np.ndarray:
+        """Return a mask by ZIP code of the ones within km of a point."""
+        low = get_cell(
+            latitude - km / KM_PER_DEGREE,
+            longitude - km / (KM_PER_DEGREE * math.cos(math.radians(latitude))),
+        )
+        high = get_cell(
+            latitude + km / KM_PER_DEGREE,
+            longitude + km / (KM_PER_DEGREE * math.cos(math.radians(latitude))),
+        )
+        candidates = [
+            self.grid[(row, column)]
+            for row in range(low[0], high[0] + 1)
+            for column in range(low[1], high[1] + 1)
+            if (row, column) in self.grid
+        ]
+        mask = np.zeros(ZIP_CODES, dtype=bool)
+        if not candidates:
+            return mask
+        candidates = np.concatenate(candidates)
+        distances = get_distances(
+            self.geo["latitude"][candidates], self.geo["longitude"][candidates],
+            latitude, longitude,
+        )
+        mask[candidates[distances <= km]] = True
+        return mask
+
+    def in_fare_zones(self, fare_zones: List[int]) -> np.ndarray:
+        """Return a mask by ZIP code of the ones in the fare zones."""
+        return np.isin(self.geo["fare_zone"], fare_zones)
+
+
+_geo_indexes: Dict[str, GeoIndex] = {}
+
+
+def get_geo_index(table_path: str = GEO_TABLE_PATH) -> GeoIndex:
+    """The index of a table, loaded once however many filters use it."""
+    if table_path not in _geo_indexes:
+        _geo_indexes[table_path] = GeoIndex(table_path)
+    return _geo_indexes[table_path]
@@ -0,0 +1,179 @@
+"""Index of the listings captured by earlier scraping runs."""
+
+
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dependencies.session import pop_validators, revalidate
+
+
+AD_ID_PATTERN = re.compile(r"id-(\d+)")
+DEFAULT_INDEX_PATH = "../data/listing_index.sqlite"
+
+
+def get_ad_id(url: str) -> Optional[str]:
+    """Return the BoligPortal ad ID of an URL e.g. '5240279' for '...-id-5240279'."""
+    match = AD_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+class ListingIndex:
+    """
+    SQLite table of every listing seen so far, keyed by ad ID, with the
+    HTTP validators (ETag, Last-Modified) of its page for revalidation.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS listings (
+                ad_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                last_scraped TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                removed INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self.connection.commit()
+
+    def get_known(self) -> Dict[str, Tuple[str, Optional[str], Optional[str], int]]:
+        """Return {ad ID: (url, etag, last modified, removed)} of scraped listings."""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT ad_id, url, etag, last_modified, removed FROM listings "
+                "WHERE last_scraped IS NOT NULL"
+            ).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def mark_scraped(self, urls: Iterable[str]) -> None:
+        """
+        Record that ads were fully scraped just now, with the validators
+        of the pages they were scraped from.
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        rows = [
+            (get_ad_id(url), url, now, now, now, *pop_validators(url))
+            for url in urls
+            if get_ad_id(url) is not None
+        ]
+        with self._lock:
+            self.connection.executemany(
+                """
+                INSERT INTO listings (
+                    ad_id, url, first_seen, last_seen, last_scraped, etag, last_modified
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (ad_id) DO UPDATE SET
+                    url = excluded.url,
+                    last_seen = excluded.last_seen,
+                    last_scraped = excluded.last_scraped,
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    removed = 0
+                """,
+                rows,
+            )
+            self.connection.commit()
+
+    def mark_seen(
+        self, ad_id: str, etag: Optional[str] = None, last_modified: Optional[str] = None
+    ) -> None:
+        """Record that a known listing is still online, with its validators."""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self.connection.execute(
+                "UPDATE listings SET last_seen = ?, removed = 0, "
+                "etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) "
+                "WHERE ad_id = ?",
+                (now, etag, last_modified, ad_id),
+            )
+            self.connection.commit()
+
+    def mark_removed(self, ad_ids: Iterable[str]) -> None:
+        """Record that listings are no longer in the search results."""
+        with self._lock:
+            self.connection.executemany(
+                "UPDATE listings SET removed = 1 WHERE ad_id = ?",
+                [(ad_id,) for ad_id in ad_ids],
+            )
+            self.connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+
+def select_urls_to_scrape(
+    urls: Iterable[str],
+    index: ListingIndex,
+    revalidate_known: bool = False,
+    max_workers: int = 8,
+    discovery_complete: bool = True,
+) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Split the discovered URLs into the ones to scrape, new or changed, and
+    the ones already captured. Known listings are only revalidated with a
+    HEAD request if revalidate_known is set, otherwise they count as
+    unchanged. Listings missing from the URLs are marked as removed, if
+    discovery_complete says every results page was scraped, with none
+    failed or left out by a page limit.
+    """
+    known = index.get_known()
+    to_scrape = []
+    known_urls = []
+    found_ids = set()
+
+    for url in urls:
+        ad_id = get_ad_id(url)
+        found_ids.add(ad_id)
+        if ad_id is None or ad_id not in known:
+            to_scrape.append(url)
+        else:
+            known_urls.append(url)
+
+    counts = {"new": len(to_scrape), "changed": 0, "unchanged": 0, "removed": 0}
+
+    def check(url: str) -> bool:
+        _, etag, last_modified, _ = known[get_ad_id(url)]
+        if not revalidate_known:
+            index.mark_seen(get_ad_id(url))
+            return False
+        try:
+            changed, etag, last_modified = revalidate(url, etag, last_modified)
+        except Exception as e:
+            print(f"Failed to revalidate {url}: {type(e).__name__}: {e}")
+            return True
+        index.mark_seen(get_ad_id(url), etag, last_modified)
+        return changed
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for url, changed in zip(known_urls, executor.map(check, known_urls)):
+            if changed:
+                to_scrape.append(url)
+                counts["changed"] += 1
+            else:
+                counts["unchanged"] += 1
+
+    if discovery_complete:
+        removed_ids = [
+            ad_id for ad_id, (_, _, _, removed) in known.items()
+            if ad_id not in found_ids and not removed
+        ]
+        index.mark_removed(removed_ids)
+        counts["removed"] = len(removed_ids)
+
+    return to_scrape, counts
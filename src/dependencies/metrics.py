@@ -0,0 +1,325 @@
+"""
+Counters and latency histograms for each stage of a run (fetch, parse,
+cleanup, translation, write, filter predicates...), saved as a JSON run
+report and in Prometheus text format.
+"""
+
+
+import json
+import os
+import resource
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+PREFIX = "boligportal"
+# From 0.1ms to about 2 minutes, each bucket sqrt(2) times the last
+LATENCY_BUCKETS = tuple(0.0001 * 2 ** (i / 2) for i in range(41))
+PROMETHEUS_FILE = "metrics.prom"
+THROUGHPUT_HISTORY = 5
+# Modes whose scrape throughput is checked; a watch poll scrapes too few ads
+THROUGHPUT_MODES = ["scrape", "full"]
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def make_key(name: str, labels: Dict[str, object]) -> Key:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_key(key: Key) -> str:
+    """e.g. filter_predicate{column="zip_code"}"""
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    """Counts of observed seconds per bucket, with their sum."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, counts: List[int], total: float) -> None:
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.count += sum(counts)
+        self.sum += total
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile, interpolating within its bucket like Prometheus."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                return low + (self.buckets[i] - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of one run, each by name and labels.
+    Safe to update from several threads; parser processes hand theirs back
+    with drain() for the main process to merge().
+    """
+
+    def __init__(self):
+        self.counters: Dict[Key, float] = {}
+        self.gauges: Dict[Key, float] = {}
+        self.histograms: Dict[Key, Histogram] = {}
+        self.started = datetime.now()
+        self.start_time = perf_counter()
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        key = make_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.gauges[make_key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = make_key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    def drain(self) -> Dict:
+        """Return the counters and histograms recorded so far, and reset them."""
+        with self._lock:
+            state = {
+                "counters": list(self.counters.items()),
+                "histograms": [
+                    (key, histogram.counts, histogram.sum)
+                    for key, histogram in self.histograms.items()
+                ],
+            }
+            self.counters = {}
+            self.histograms = {}
+        return state
+
+    def merge(self, state: Dict) -> None:
+        """Add what another process drained."""
+        with self._lock:
+            for key, value in state["counters"]:
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, counts, total in state["histograms"]:
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                self.histograms[key].merge(counts, total)
+
+    def report(self, mode: str = "") -> Dict:
+        """The run summarized: time and peak memory, counters, and each stage's latency."""
+        seconds = perf_counter() - self.start_time
+        with self._lock:
+            stages = {
+                format_key(key): {
+                    "count": histogram.count,
+                    "seconds": round(histogram.sum, 4),
+                    "mean_ms": round(histogram.sum / histogram.count * 1000, 3),
+                    "p50_ms": round(histogram.quantile(0.5) * 1000, 3),
+                    "p99_ms": round(histogram.quantile(0.99) * 1000, 3),
+                }
+                for key, histogram in sorted(self.histograms.items())
+                if histogram.count
+            }
+            counters = {format_key(key): value for key, value in sorted(self.counters.items())}
+            gauges = {format_key(key): value for key, value in sorted(self.gauges.items())}
+        return {
+            "mode": mode,
+            "started": self.started.isoformat(timespec="seconds"),
+            "seconds": round(seconds, 3),
+            "peak_rss_mb": round(get_peak_rss() / 2 ** 20, 1),
+            "counters": counters,
+            "gauges": gauges,
+            "stages": stages,
+        }
+
+    def to_prometheus(self) -> str:
+        """The metrics in the Prometheus text format, for the node exporter's textfile collector."""
+        lines = []
+        with self._lock:
+            for name, items in group_by_name(self.counters):
+                lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+                lines += [f"{PREFIX}_{format_key((name + '_total', labels))} {format_value(value)}" for labels, value in items]
+            for name, items in group_by_name(self.gauges):
+                lines.append(f"# TYPE {PREFIX}_{name} gauge")
+                lines += [f"{PREFIX}_{format_key((name, labels))} {format_value(value)}" for labels, value in items]
+            for name, items in group_by_name(self.histograms):
+                metric = f"{PREFIX}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, histogram in items:
+                    cumulative = 0
+                    bounds = [f"{bound:.6g}" for bound in histogram.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        lines.append(
+                            f"{format_key((metric + '_bucket', labels + (('le', bound),)))} {cumulative}"
+                        )
+                    lines.append(f"{format_key((metric + '_sum', labels))} {format_value(histogram.sum)}")
+                    lines.append(f"{format_key((metric + '_count', labels))} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def group_by_name(metrics: Dict[Key, object]) -> Iterator[Tuple[str, List]]:
+    names = {}
+    for (name, labels), value in sorted(metrics.items(), key=lambda item: item[0]):
+        names.setdefault(name, []).append((labels, value))
+    return iter(names.items())
+
+
+def get_peak_rss() -> int:
+    """
+    Peak resident memory in bytes of this process, or of the parser
+    processes it started if larger. On Linux, VmHWM is read rather than
+    ru_maxrss, which counts the process that started this one.
+    """
+    peak = 0
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024)
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def reset_metrics() -> Metrics:
+    """Start counting a new run."""
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def count(name: str, value: float = 1, **labels) -> None:
+    _metrics.count(name, value, **labels)
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    _metrics.set_gauge(name, value, **labels)
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    _metrics.observe(name, seconds, **labels)
+
+
+@contextmanager
+def timed(name: str, **labels) -> Iterator[None]:
+    """Observe how long the with block takes in the name histogram."""
+    start_time = perf_counter()
+    try:
+        yield
+    finally:
+        _metrics.observe(name, perf_counter() - start_time, **labels)
+
+
+def drain_metrics() -> Dict:
+    return _metrics.drain()
+
+
+def merge_metrics(state: Dict) -> None:
+    _metrics.merge(state)
+
+
+def check_throughput(
+    report: Dict, directory: str, tolerance: float, history: int = THROUGHPUT_HISTORY
+) -> Optional[str]:
+    """
+    Compare the scrape throughput of a run with the median of the last
+    history runs of the same mode reported in directory. Returns an alert
+    if it dropped by more than tolerance, e.g. 0.2 for 20%.
+    """
+    throughput = report["gauges"].get("scrape_ads_per_second")
+    if not throughput or report["mode"] not in THROUGHPUT_MODES:
+        return None
+    previous = []
+    paths = sorted(
+        (
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.startswith("run_") and name.endswith(".json")
+        ),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for path in paths:
+        # A report from an older version or a crashed run is skipped
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                earlier = json.load(f)
+            value = earlier["gauges"].get("scrape_ads_per_second")
+            mode = earlier["mode"]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            continue
+        if mode == report["mode"] and value:
+            previous.append(value)
+        if len(previous) >= history:
+            break
+    if not previous or throughput >= median(previous) * (1 - tolerance):
+        return None
+    return (
+        f"Scrape throughput regressed: {round(throughput, 2)} ads/sec against "
+        f"{round(median(previous), 2)} over the last {len(previous)} {report['mode']} runs."
+    )
+
+
+def save_report(
+    directory: str, timestr: str, mode: str, throughput_alert: float = 0.2
+) -> Dict:
+    """
+    Save the run report as run_<timestr>.json, after checking it for a
+    throughput regression, and the metrics to metrics.prom, both in directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    report = _metrics.report(mode)
+    alert = check_throughput(report, directory, throughput_alert)
+    report["alerts"] = [alert] if alert else []
+    _metrics.set_gauge("throughput_regressed", 1 if alert else 0)
+    _metrics.set_gauge("run_seconds", report["seconds"], mode=mode)
+    _metrics.set_gauge("peak_rss_bytes", report["peak_rss_mb"] * 2 ** 20, mode=mode)
+
+    # Both written aside and renamed, so nothing ever reads half a file
+    report_path = os.path.join(directory, f"run_{timestr}.json")
+    with open(report_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    os.replace(report_path + ".tmp", report_path)
+    prometheus_path = os.path.join(directory, PROMETHEUS_FILE)
+    with open(prometheus_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(_metrics.to_prometheus())
+    os.replace(prometheus_path + ".tmp", prometheus_path)
+    return report
@@ -0,0 +1,51 @@
+"""Turn HTML into soup with the fastest parser available."""
+
+
+from typing import Optional, Union
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+# lxml's C parser is several times faster than the pure Python html.parser,
+# which stays as the fallback when lxml is not installed.
+try:
+    import lxml  # noqa: F401
+
+    DEFAULT_BACKEND = "lxml"
+except ImportError:
+    DEFAULT_BACKEND = "html.parser"
+
+
+PARSER_BACKENDS = ["lxml", "html.parser"]
+
+_backend = DEFAULT_BACKEND
+
+
+def configure_parser(backend: str = DEFAULT_BACKEND) -> str:
+    """Pick the parser backend, falling back to html.parser if unavailable."""
+    global _backend
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(
+            f"Parser backend needs to be one of {PARSER_BACKENDS}. Detected '{backend}'."
+        )
+    if backend == "lxml" and DEFAULT_BACKEND != "lxml":
+        print("lxml is not installed. Falling back to html.parser.")
+        backend = "html.parser"
+    _backend = backend
+    return _backend
+
+
+def parse_html(
+    html: Union[str, bytes],
+    parse_only: Optional[SoupStrainer] = None,
+    backend: Optional[str] = None,
+) -> BeautifulSoup:
+    """
+    Parse an HTML document. With parse_only, only the matching elements and
+    their children are built into the tree, the rest is skipped.
+    """
+    return BeautifulSoup(html, features=backend or _backend, parse_only=parse_only)
+
+
+def get_parser_backend() -> str:
+    """Return the parser backend in use."""
+    return _backend
@@ -0,0 +1,204 @@
+"""
+Scrape ads in stages: threads fetch pages (I/O), a pool of processes parses
+them (CPU), and the caller consumes the parsed ads as the single writer.
+"""
+
+
+import queue
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from datetime import datetime
+from itertools import chain, islice
+from time import time
+from typing import Dict, Iterable, Iterator, Tuple, Union
+
+from tqdm import tqdm
+
+from dependencies.metrics import count, drain_metrics, merge_metrics, reset_metrics, set_gauge
+from dependencies.parsing import configure_parser, get_parser_backend
+from dependencies.scraper import parse_ad
+from dependencies.session import fetch
+
+
+# Parser processes when PARSER_WORKERS isn't set, 0 parsing in the fetching threads
+DEFAULT_PARSE_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 64
+
+
+def init_parser_process(backend: str) -> None:
+    """Set up a parser process, without the metrics it inherited from its parent."""
+    configure_parser(backend)
+    reset_metrics()
+
+
+def parse_ad_in_process(url: str, html: bytes) -> Tuple[Dict, Dict]:
+    """parse_ad in a parser process, handing back the metrics it recorded."""
+    return parse_ad(url, html), drain_metrics()
+
+
+def scrape_ads_pipeline(
+    urls: Iterable[str],
+    fetch_workers: int = 8,
+    parse_workers: int = DEFAULT_PARSE_WORKERS,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> Iterator[Dict]:
+    """
+    Scrape all ads like scrape_ads, but parse them in parse_workers processes
+    so parsing isn't held back by the GIL. Fetched pages wait in a queue of
+    queue_size, and fetchers block when it's full, which caps memory when
+    parsing falls behind. An ad which fails is reported and skipped.
+    """
+    urls = list(urls)
+    pages = queue.Queue(maxsize=queue_size)
+    start_time = time()
+    scraped = 0
+    failed_urls = []
+
+    stopped = threading.Event()
+
+    def fetch_page(url: str) -> None:
+        if stopped.is_set():
+            return
+        try:
+            pages.put((url, fetch(url), None))
+        except Exception as e:
+            pages.put((url, None, e))
+
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetchers, ProcessPoolExecutor(
+        max_workers=parse_workers,
+        initializer=init_parser_process,
+        initargs=(get_parser_backend(),),
+    ) as parsers:
+        try:
+            for url in urls:
+                fetchers.submit(fetch_page, url)
+
+            received = 0
+            parsing = {}
+            with tqdm(total=len(urls)) as progress:
+                while received < len(urls) or parsing:
+                    # Keep every parser busy with one page and one more waiting
+                    while received < len(urls) and len(parsing) < 2 * parse_workers:
+                        try:
+                            url, html, error = pages.get(timeout=0.05 if parsing else None)
+                        except queue.Empty:
+                            break
+                        received += 1
+                        if error is not None:
+                            failed_urls.append(url)
+                            count("ads_failed")
+                            progress.update()
+                            tqdm.write(f"Failed to fetch {url}: {type(error).__name__}: {error}")
+                            continue
+                        parsing[parsers.submit(parse_ad_in_process, url, html)] = url
+
+                    if not parsing:
+                        continue
+                    done, _ = wait(parsing, timeout=0.05, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        url = parsing.pop(future)
+                        progress.update()
+                        try:
+                            ad, metrics = future.result()
+                        except Exception as e:
+                            failed_urls.append(url)
+                            count("ads_failed")
+                            tqdm.write(f"Failed to parse {url}: {type(e).__name__}: {e}")
+                            continue
+                        merge_metrics(metrics)
+                        scraped += 1
+                        count("ads_scraped")
+                        yield ad
+        finally:
+            # If the consumer stops early, unblock the fetchers so the
+            # pools can shut down
+            stopped.set()
+            fetchers.shutdown(wait=False, cancel_futures=True)
+            while not pages.empty():
+                pages.get_nowait()
+
+    end_time = time()
+    runtime = end_time - start_time
+    throughput = scraped / runtime if runtime > 0 else 0.0
+    set_gauge("scrape_ads_per_second", throughput)
+    print(
+        f"Scraped {scraped} ads ({len(failed_urls)} failed) "
+        f"in {round(runtime,2):,}s: {round(throughput,2):,} ads/sec"
+    )
+
+
+def parse_page(page: Tuple[str, datetime, bytes]) -> Union[Dict, Exception]:
+    """
+    Parse an already fetched (url, fetch time, html) page into an ad scraped
+    on the day it was fetched. Errors are returned, not raised.
+    """
+    url, fetched_at, html = page
+    try:
+        ad = parse_ad(url, html)
+    except Exception as e:
+        return e
+    ad["scraped_date"] = fetched_at.date()
+    return ad
+
+
+def parse_page_in_process(page: Tuple[str, datetime, bytes]) -> Tuple[Union[Dict, Exception], Dict]:
+    """parse_page in a parser process, handing back the metrics it recorded."""
+    return parse_page(page), drain_metrics()
+
+
+def parse_pages(
+    pages: Iterable[Tuple[str, datetime, bytes]],
+    parse_workers: int = DEFAULT_PARSE_WORKERS,
+) -> Iterator[Dict]:
+    """
+    Parse already fetched pages into ads, in parse_workers processes if
+    above 0. A page which fails is reported and skipped.
+    """
+    start_time = time()
+    parsed = 0
+    failed = 0
+
+    if parse_workers > 0:
+        executor = ProcessPoolExecutor(
+            max_workers=parse_workers,
+            initializer=init_parser_process,
+            initargs=(get_parser_backend(),),
+        )
+        # Hand pages over a window at a time, as map would otherwise read
+        # every page into memory before the first result comes back
+        pages = iter(pages)
+        windows = iter(lambda: list(islice(pages, 64 * parse_workers)), [])
+        results = chain.from_iterable(
+            executor.map(parse_page_in_process, window, chunksize=16) for window in windows
+        )
+    else:
+        executor = None
+        results = ((parse_page(page), None) for page in pages)
+
+    try:
+        for result, metrics in tqdm(results):
+            if metrics is not None:
+                merge_metrics(metrics)
+            if isinstance(result, Exception):
+                failed += 1
+                count("ads_failed")
+                tqdm.write(f"Failed to parse a page: {type(result).__name__}: {result}")
+                continue
+            parsed += 1
+            count("ads_parsed")
+            yield result
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    runtime = time() - start_time
+    throughput = parsed / runtime if runtime > 0 else 0.0
+    print(
+        f"Parsed {parsed} ads ({failed} failed) "
+        f"in {round(runtime,2):,}s: {round(throughput,2):,} ads/sec"
+    )
@@ -0,0 +1,717 @@
+"""
+Compile the filter configuration into a query plan: typed predicates ordered
+by estimated cost and selectivity, evaluated chunk by chunk as the input is
+read, so data larger than memory can be filtered. Several filter profiles
+can share one read of the input and the predicates they have in common.
+"""
+
+
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from dependencies.database import ListingDatabase, is_database
+from dependencies.geo import GEO_TABLE_PATH, get_geo_index
+from dependencies.metrics import count, observe, timed
+from dependencies.storage import get_format, open_dataset
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+
+DATE_COLUMNS = ["creation_date", "scraped_date", "available_from"]
+CALIBRATION_ROWS = 10000
+FLAG_OPTIONS = {
+    "is_furnished": "FURNISHED",
+    "is_shareable": "SHAREABLE",
+    "pets_allowed": "PETS_ALLOWED",
+    "has_elevator": "HAS_ELEVATOR",
+    "students_only": "STUDENTS_ONLY",
+    "has_balcony": "HAS_BALCONY",
+    "has_parking": "HAS_PARKING",
+}
+
+
+def to_datetimes(series: pd.Series) -> pd.Series:
+    """Convert a column of MM/DD/YYYY strings or dates to datetimes, all at once."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    first = series.dropna().head(1).tolist()
+    if first and isinstance(first[0], date):
+        return pd.to_datetime(series, errors="coerce")
+    return pd.to_datetime(series, format="%m/%d/%Y", errors="coerce")
+
+
+class Predicate(ABC):
+    """
+    A condition on one column. cost is the time to evaluate a row and
+    selectivity the fraction of rows kept, estimated until calibrate()
+    measures them. Rows, kept rows and time are counted for explain().
+    """
+
+    cost = 1.0
+    selectivity = 0.5
+
+    def __init__(self, column: str):
+        self.column = column
+        self.rows_in = 0
+        self.rows_out = 0
+        self.seconds = 0.0
+
+    @abstractmethod
+    def evaluate(self, values: pd.Series) -> np.ndarray:
+        """Return a boolean array, True for rows to keep."""
+
+    def to_expression(self) -> Optional["ds.Expression"]:
+        """Return the predicate as a pyarrow expression, if row group statistics can use it."""
+        return None
+
+    @abstractmethod
+    def to_sql(self) -> List[Tuple[str, List]]:
+        """Return the predicate as SQL conditions, all to hold, and their parameters."""
+
+    @abstractmethod
+    def key(self) -> Tuple:
+        """What makes two predicates the same, so one can be evaluated for both."""
+
+    def rank(self) -> float:
+        """Cost per row dropped, lowest first: cheap and selective predicates go first."""
+        return self.cost / max(1.0 - self.selectivity, 1e-6)
+
+    def calibrate(self, values: pd.Series) -> None:
+        """Measure cost and selectivity on a sample of the column."""
+        if len(values) == 0:
+            return
+        start_time = perf_counter()
+        keep = self.evaluate(values)
+        self.cost = (perf_counter() - start_time) / len(values)
+        self.selectivity = keep.mean()
+
+    def apply(self, values: pd.Series) -> np.ndarray:
+        """Evaluate, counting rows and time."""
+        start_time = perf_counter()
+        keep = self.evaluate(values)
+        seconds = perf_counter() - start_time
+        rows_out = int(keep.sum())
+        self.seconds += seconds
+        self.rows_in += len(values)
+        self.rows_out += rows_out
+        observe("filter_predicate", seconds, column=self.column)
+        count("filter_rows_in", len(values), column=self.column)
+        count("filter_rows_out", rows_out, column=self.column)
+        return keep
+
+
+class Range(Predicate):
+    """low <= column <= high, either bound optional. Date bounds compare as dates."""
+
+    def __init__(
+        self,
+        column: str,
+        low: Optional[Union[float, date]] = None,
+        high: Optional[Union[float, date]] = None,
+    ):
+        super().__init__(column)
+        self.low = low
+        self.high = high
+        self.is_date = isinstance(low, date) or isinstance(high, date)
+        self.cost = 10.0 if self.is_date else 1.0
+        self.selectivity = 0.5 if low is None or high is None else 0.25
+
+    def evaluate(self, values: pd.Series) -> np.ndarray:
+        if self.is_date:
+            values = to_datetimes(values)
+        keep = np.ones(len(values), dtype=bool)
+        if self.low is not None:
+            low = pd.Timestamp(self.low) if self.is_date else self.low
+            keep &= (values >= low).to_numpy(dtype=bool, na_value=False)
+        if self.high is not None:
+            high = pd.Timestamp(self.high) if self.is_date else self.high
+            keep &= (values <= high).to_numpy(dtype=bool, na_value=False)
+        return keep
+
+    def to_sql(self) -> List[Tuple[str, List]]:
+        conditions = []
+        for bound, operator in [(self.low, ">="), (self.high, "<=")]:
+            if bound is not None:
+                conditions.append((
+                    f"{self.column} {operator} ?",
+                    [bound.isoformat() if self.is_date else bound],
+                ))
+        return conditions
+
+    def key(self) -> Tuple:
+        return ("range", self.column, self.low, self.high)
+
+    def to_expression(self) -> Optional["ds.Expression"]:
+        field = ds.field(self.column)
+        expressions = []
+        for bound, compare in [(self.low, field.__ge__), (self.high, field.__le__)]:
+            if bound is not None:
+                if self.is_date:
+                    bound = pa.scalar(bound, type=pa.date32())
+                expressions.append(compare(bound))
+        expression = expressions[0]
+        for other in expressions[1:]:
+            expression = expression & other
+        return expression
+
+    def __str__(self) -> str:
+        low = "" if self.low is None else f"{self.low} <= "
+        high = "" if self.high is None else f" <= {self.high}"
+        return f"{low}{self.column}{high}"
+
+
+class IsIn(Predicate):
+    """column in values, or not in them with exclude."""
+
+    cost = 2.0
+
+    def __init__(self, column: str, values: List, exclude: bool = False):
+        super().__init__(column)
+        self.values = values
+        self.exclude = exclude
+        self.selectivity = 0.9 if exclude else 0.5
+
+    def evaluate(self, values: pd.Series) -> np.ndarray:
+        keep = values.isin(self.values).to_numpy(dtype=bool, na_value=False)
+        return ~keep if self.exclude else keep
+
+    def to_sql(self) -> List[Tuple[str, List]]:
+        placeholders = ", ".join("?" * len(self.values))
+        if self.exclude:
+            # Like pandas, missing values are not in the list
+            condition = f"({self.column} IS NULL OR {self.column} NOT IN ({placeholders}))"
+        else:
+            condition = f"{self.column} IN ({placeholders})"
+        return [(condition, list(self.values))]
+
+    def key(self) -> Tuple:
+        return ("isin", self.column, frozenset(self.values), self.exclude)
+
+    def __str__(self) -> str:
+        return f"{self.column} {'not in' if self.exclude else 'in'} {self.values}"
+
+
+class InZipCodes(Predicate):
+    """
+    ZIP code column in a set given as a mask by ZIP code, e.g. the ones
+    within some km of a point, looked up for every row at once.
+    """
+
+    cost = 2.0
+
+    def __init__(self, column: str, mask: np.ndarray, description: str):
+        super().__init__(column)
+        self.mask = mask
+        self.zip_codes = np.flatnonzero(mask)
+        self.description = description
+
+    def evaluate(self, values: pd.Series) -> np.ndarray:
+        codes = pd.to_numeric(values, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        known = (codes >= 0) & (codes < len(self.mask))
+        keep = np.zeros(len(codes), dtype=bool)
+        keep[known] = self.mask[codes[known].astype(np.int64)]
+        return keep
+
+    def to_sql(self) -> List[Tuple[str, List]]:
+        # Written out rather than bound, as they can be more than SQLite allows parameters
+        zip_codes = ", ".join(str(zip_code) for zip_code in self.zip_codes)
+        return [(f"{self.column} IN ({zip_codes})", [])]
+
+    def key(self) -> Tuple:
+        return ("zip_codes", self.column, self.zip_codes.tobytes())
+
+    def to_expression(self) -> Optional["ds.Expression"]:
+        # Row groups whose ZIP codes are all outside the lowest to highest are skipped
+        if len(self.zip_codes) == 0:
+            return None
+        field = ds.field(self.column)
+        return (field >= int(self.zip_codes[0])) & (field <= int(self.zip_codes[-1]))
+
+    def __str__(self) -> str:
+        return f"{self.column} {self.description} ({len(self.zip_codes)} ZIP codes)"
+
+
+def combine(predicates: Iterator[Predicate]) -> Optional["ds.Expression"]:
+    """The predicates pyarrow can skip row groups by, and-ed together."""
+    expression = None
+    for predicate in predicates:
+        other = predicate.to_expression()
+        if other is not None:
+            expression = other if expression is None else expression & other
+    return expression
+
+
+class ChunkReader:
+    """
+    Read a CSV file, or a Parquet/Feather dataset, in chunks of about
+    chunk_size rows. Each chunk comes with a function returning the whole
+    rows at the given positions in it, indexed by their position in the
+    input. Columnar chunks only hold the given columns until then, and
+    Parquet row groups whose statistics rule out row_filter are skipped.
+    CSV chunks are read whole, see iter_csv.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        columns: List[str],
+        chunk_size: int = 100000,
+        row_filter: Optional["ds.Expression"] = None,
+    ):
+        self.path = path
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.row_filter = row_filter
+        self.chunks = 0
+        self.rows_read = 0
+        self.row_groups = 0
+        self.row_groups_skipped = 0
+
+    def __iter__(self) -> Iterator[Tuple[pd.DataFrame, Callable[[np.ndarray], pd.DataFrame]]]:
+        if get_format(self.path) is None:
+            chunks = self.iter_csv()
+        else:
+            chunks = self.iter_columnar()
+        for df, fetch in chunks:
+            self.chunks += 1
+            self.rows_read += len(df)
+            yield df, fetch
+
+    def empty(self) -> pd.DataFrame:
+        """A frame with the input's columns and no rows."""
+        if get_format(self.path) is None:
+            return pd.read_csv(self.path, nrows=0)
+        return pd.DataFrame(columns=open_dataset(self.path).schema.names)
+
+    def iter_csv(self) -> Iterator[Tuple[pd.DataFrame, Callable]]:
+        # Every column is read: a CSV row has to be tokenized whole either
+        # way, and reading the other columns of the kept rows in a second
+        # pass cost as much as reading them all at once (300k rows: 1.4s
+        # for the filter columns + 1.0s for 5% of rows, against 2.5s)
+        for chunk in pd.read_csv(self.path, chunksize=self.chunk_size):
+            yield chunk, chunk.take
+
+    def iter_columnar(self) -> Iterator[Tuple[pd.DataFrame, Callable]]:
+        dataset = open_dataset(self.path)
+        schema = dataset.schema
+
+        pieces = []
+        rows = 0
+        for piece, offset in self.iter_pieces(dataset):
+            table = piece.to_table(schema=schema, columns=self.columns)
+            pieces.append((piece, offset, table))
+            rows += table.num_rows
+            if rows >= self.chunk_size:
+                yield self.read_pieces(pieces, schema)
+                pieces = []
+                rows = 0
+        if pieces:
+            yield self.read_pieces(pieces, schema)
+
+    def iter_pieces(self, dataset: "ds.Dataset") -> Iterator[Tuple["ds.Fragment", int]]:
+        """
+        Yield each file, or each Parquet row group not ruled out by the
+        row filter, with the position of its first row in the dataset.
+        """
+        offset = 0
+        for fragment in dataset.get_fragments():
+            if not isinstance(fragment, ds.ParquetFileFragment) or self.row_filter is None:
+                self.row_groups += 1
+                yield fragment, offset
+                offset += fragment.count_rows()
+                continue
+
+            fragment.ensure_complete_metadata()
+            kept = {rg.id for rg in fragment.subset(filter=self.row_filter).row_groups}
+            for row_group in fragment.row_groups:
+                self.row_groups += 1
+                if row_group.id in kept:
+                    yield fragment.subset(row_group_ids=[row_group.id]), offset
+                else:
+                    self.row_groups_skipped += 1
+                offset += row_group.num_rows
+
+    def read_pieces(self, pieces: List, schema: "pa.Schema") -> Tuple[pd.DataFrame, Callable]:
+        """Return the filter columns of a chunk of pieces, and how to fetch whole rows."""
+        df = pa.concat_tables([t for _, _, t in pieces]).to_pandas(date_as_object=False)
+        other_columns = [c for c in schema.names if c not in self.columns]
+
+        def fetch(rows: np.ndarray) -> pd.DataFrame:
+            positions = []
+            others = []
+            start = 0
+            for piece, offset, table in pieces:
+                end = start + table.num_rows
+                local_rows = rows[(rows >= start) & (rows < end)] - start
+                start = end
+                if len(local_rows) == 0:
+                    continue
+                # By the dataset schema, so columns older parts lack come back empty
+                part = piece.scanner(schema=schema, columns=other_columns).take(local_rows)
+                others.append(part.to_pandas(date_as_object=False))
+                positions.append(local_rows + offset)
+
+            if not others:
+                return pd.DataFrame(columns=schema.names)
+            kept = df.take(rows)
+            kept.index = np.concatenate(positions)
+            others = pd.concat(others)
+            others.index = kept.index
+            return pd.concat([kept, others], axis=1)[schema.names]
+
+        return df, fetch
+
+    def describe(self) -> List[str]:
+        """Lines for explain() about what was read."""
+        lines = [f"\t* columns filtered on: {', '.join(self.columns)}"]
+        if self.row_groups:
+            lines.append(f"\t* row group filter: {self.row_filter}")
+            lines.append(
+                f"\t* row groups: {self.row_groups_skipped} of "
+                f"{self.row_groups} skipped"
+            )
+        lines.append(f"\t* rows read: {self.rows_read} in {self.chunks} chunks")
+        return lines
+
+
+def concat_chunks(chunks: List[pd.DataFrame], reader: ChunkReader) -> pd.DataFrame:
+    """Join the rows kept from each chunk, dates as dates."""
+    chunks = [chunk for chunk in chunks if len(chunk)]
+    return to_output(pd.concat(chunks) if chunks else reader.empty())
+
+
+class QueryPlan:
+    """
+    Predicates to keep a row by, all of which must hold. Each predicate only
+    sees the rows the ones before it kept, so the order matters: it is
+    re-estimated on the first rows filtered. Only the columns predicates
+    need are read before rows are dropped. With hide_duplicates, an ad kept
+    along with the ad it reposts is dropped.
+    """
+
+    def __init__(self, predicates: List[Predicate], hide_duplicates: bool = False):
+        self.predicates = sorted(predicates, key=lambda p: p.rank())
+        self.hide_duplicates = hide_duplicates
+        self.duplicates_hidden = 0
+        self.calibrated = False
+        self.reader = None
+
+    @property
+    def columns(self) -> List[str]:
+        """Columns the predicates read, in order of first use."""
+        return list(dict.fromkeys(p.column for p in self.predicates))
+
+    @property
+    def rows_read(self) -> int:
+        """Rows the last execute() filtered."""
+        return 0 if self.reader is None else self.reader.rows_read
+
+    def calibrate(self, df: pd.DataFrame) -> None:
+        """Measure every predicate on the first rows and reorder them."""
+        sample = df.iloc[:CALIBRATION_ROWS]
+        for predicate in self.predicates:
+            predicate.calibrate(sample[predicate.column])
+        self.predicates.sort(key=lambda p: p.rank())
+        self.calibrated = True
+
+    def row_group_filter(self) -> Optional["ds.Expression"]:
+        """The predicates pyarrow can skip row groups by, combined."""
+        return combine(self.predicates)
+
+    def to_sql(self) -> Tuple[str, List]:
+        """
+        Return the plan as an SQL WHERE clause and its parameters. Each
+        condition carries its estimated likelihood, for SQLite to pick the
+        index of the most selective one.
+        """
+        conditions = []
+        params = []
+        for predicate in self.predicates:
+            predicate_conditions = predicate.to_sql()
+            likelihood = max(predicate.selectivity, 0.0001) ** (1 / len(predicate_conditions))
+            for condition, condition_params in predicate_conditions:
+                conditions.append(f"likelihood({condition}, {likelihood:.4f})")
+                params += condition_params
+        return " AND ".join(conditions) or "1", params
+
+    def select(self, df: pd.DataFrame) -> np.ndarray:
+        """Return the positions of the rows of df kept by all predicates."""
+        if not self.calibrated:
+            self.calibrate(df)
+
+        rows = np.arange(len(df))
+        for predicate in self.predicates:
+            if len(rows) == 0:
+                break
+            values = df[predicate.column]
+            if len(rows) < len(df):
+                values = values.take(rows)
+            rows = rows[predicate.apply(values)]
+        return rows
+
+    def drop_duplicates(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Drop the kept ads whose duplicate_of is also kept, if hide_duplicates.
+        A repost stays if the ad it reposts was filtered out.
+        """
+        if not self.hide_duplicates or "duplicate_of" not in df.columns:
+            return df
+        ad_ids = pd.to_numeric(df["url"].str.extract(r"id-(\d+)", expand=False), errors="coerce")
+        originals = pd.to_numeric(df["duplicate_of"], errors="coerce")
+        keep = ~originals.isin(ad_ids.dropna()).to_numpy()
+        self.duplicates_hidden += int((~keep).sum())
+        return df[keep]
+
+    def filter(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Return the rows of df kept, dates as dates."""
+        return self.drop_duplicates(to_output(df.take(self.select(df))))
+
+    def execute(self, path: str, chunk_size: int = 100000) -> pd.DataFrame:
+        """
+        Filter a CSV file, or a Parquet/Feather dataset, chunk by chunk,
+        only keeping the rows that match in memory. A listing database is
+        filtered by an SQL query instead, using its indexes.
+        """
+        if is_database(path):
+            self.reader = ListingDatabase(path)
+            try:
+                if not self.calibrated:
+                    self.calibrate(self.reader.sample(self.columns))
+                return self.drop_duplicates(self.reader.select(*self.to_sql()))
+            finally:
+                self.reader.close()
+
+        self.reader = ChunkReader(path, self.columns, chunk_size, self.row_group_filter())
+        return self.drop_duplicates(concat_chunks(
+            [fetch(self.select(df)) for df, fetch in self.reader], self.reader
+        ))
+
+    def explain(self) -> str:
+        """Describe the plan and what each predicate did."""
+        source = "" if self.reader is None else f" for {self.reader.path}"
+        lines = [f"Query plan{source}", "# -------------------------------------- #"]
+        if self.reader is not None:
+            lines += self.reader.describe()
+        if self.duplicates_hidden:
+            lines.append(f"\t* reposts hidden: {self.duplicates_hidden}")
+        for i, predicate in enumerate(self.predicates, start=1):
+            line = f"\t{i}. {predicate}: est. {round(100 * predicate.selectivity, 1)}% kept"
+            if predicate.rows_in:
+                line += (
+                    f", {predicate.rows_in} -> {predicate.rows_out} rows, "
+                    f"{round(predicate.seconds, 4)}s"
+                )
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class BatchPlan:
+    """
+    The query plans of several filter profiles, run over one read of the
+    input. A predicate profiles share, e.g. the same TOTAL_RENT_MAX or ZIP
+    code range, is evaluated once per chunk and its boolean mask reused by
+    each of them, and date columns are only parsed once. The work grows with
+    the number of distinct predicates rather than with the number of profiles.
+    """
+
+    def __init__(self, plans: Dict[str, QueryPlan]):
+        self.plans = plans
+        self.predicates = {}
+        self.profiles = {}
+        for plan in plans.values():
+            for predicate in plan.predicates:
+                self.predicates.setdefault(predicate.key(), predicate)
+                self.profiles[predicate.key()] = self.profiles.get(predicate.key(), 0) + 1
+        self.reader = None
+
+    @property
+    def columns(self) -> List[str]:
+        return list(dict.fromkeys(p.column for p in self.predicates.values()))
+
+    def row_group_filter(self) -> Optional["ds.Expression"]:
+        """
+        Row groups can only be skipped if every profile rules them out: the
+        predicates all profiles share, and any one profile's other predicates.
+        """
+        shared = [k for k, count in self.profiles.items() if count == len(self.plans)]
+        expression = combine(self.predicates[key] for key in shared)
+
+        alternatives = None
+        for plan in self.plans.values():
+            other = combine(p for p in plan.predicates if p.key() not in shared)
+            if other is None:
+                return expression
+            alternatives = other if alternatives is None else alternatives | other
+        if expression is None:
+            return alternatives
+        return expression & alternatives
+
+    def masks(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """Return the rows of df each profile keeps, as boolean masks."""
+        datetimes = {}
+        cache = {}
+        for key, predicate in self.predicates.items():
+            values = df[predicate.column]
+            if getattr(predicate, "is_date", False):
+                if predicate.column not in datetimes:
+                    datetimes[predicate.column] = to_datetimes(values)
+                values = datetimes[predicate.column]
+            cache[key] = predicate.apply(values)
+
+        masks = {}
+        for name, plan in self.plans.items():
+            mask = np.ones(len(df), dtype=bool)
+            for predicate in plan.predicates:
+                mask &= cache[predicate.key()]
+            masks[name] = mask
+        return masks
+
+    def execute(self, path: str, chunk_size: int = 100000) -> Dict[str, pd.DataFrame]:
+        """Filter the input for every profile, returning each one's rows by name."""
+        if is_database(path):
+            # SQLite evaluates each profile's query on its own indexes
+            return {name: plan.execute(path) for name, plan in self.plans.items()}
+
+        self.reader = ChunkReader(path, self.columns, chunk_size, self.row_group_filter())
+        kept = {name: [] for name in self.plans}
+        for df, fetch in self.reader:
+            masks = self.masks(df)
+            # Fetch the rows any profile keeps once, then share them out
+            rows = np.flatnonzero(np.logical_or.reduce(list(masks.values())))
+            if len(rows) == 0:
+                continue
+            rows_df = fetch(rows)
+            for name, mask in masks.items():
+                kept[name].append(rows_df.iloc[np.searchsorted(rows, np.flatnonzero(mask))])
+        return {
+            name: self.plans[name].drop_duplicates(concat_chunks(chunks, self.reader))
+            for name, chunks in kept.items()
+        }
+
+    def explain(self) -> str:
+        """Describe the shared predicates and what each of them did."""
+        if self.reader is None:
+            return "\n\n".join(
+                f"{name}: {plan.explain()}" for name, plan in self.plans.items()
+            )
+        lines = [
+            f"Batch plan for {self.reader.path}: {len(self.plans)} profiles, "
+            f"{sum(self.profiles.values())} predicates, {len(self.predicates)} distinct",
+            "# -------------------------------------- #",
+        ]
+        lines += self.reader.describe()
+        for i, (key, predicate) in enumerate(self.predicates.items(), start=1):
+            lines.append(
+                f"\t{i}. {predicate}: {self.profiles[key]} profiles, "
+                f"{predicate.rows_in} -> {predicate.rows_out} rows, "
+                f"{round(predicate.seconds, 4)}s"
+            )
+        return "\n".join(lines)
+
+
+def to_output(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the date columns of kept rows to dates, as filter_data returns them."""
+    df = df.copy()
+    for column in DATE_COLUMNS:
+        if column in df.columns:
+            df[column] = to_datetimes(df[column]).dt.date
+    return df
+
+
+def to_date(value: str) -> date:
+    return datetime.strptime(value, "%m/%d/%Y").date()
+
+
+def compile_plan(config_options: Dict[str, Union[str, int]]) -> QueryPlan:
+    """Compile the filter configuration into a query plan."""
+    max_days_since_creation = config_options["MAX_DAYS_SINCE_CREATION"]
+    available_from_range = config_options["AVAILABLE_FROM_RANGE"]
+    zipcode_filter_type = config_options["ZIPCODE_FILTER_TYPE"]
+
+    # Listing time details
+    predicates = [
+        Range(
+            "creation_date",
+            low=date.today() - timedelta(days=max_days_since_creation),
+        ),
+        IsIn("rental_period", config_options["RENTAL_PERIOD_FILTER"]),
+        Range(
+            "available_from",
+            low=to_date(available_from_range[0]),
+            high=to_date(available_from_range[1]),
+        ),
+    ]
+
+    # Area
+    if config_options["USE_ZIPCODE_FILTER"] == "yes":
+        if zipcode_filter_type == "range":
+            zipcode_range_filter = config_options["ZIPCODE_RANGE_FILTER"]
+            predicates.append(
+                Range("zip_code", zipcode_range_filter[0], zipcode_range_filter[1])
+            )
+        elif zipcode_filter_type == "list":
+            predicates.append(IsIn("zip_code", config_options["ZIPCODE_LIST_FILTER"]))
+        elif zipcode_filter_type == "exclude":
+            predicates.append(
+                IsIn("zip_code", config_options["ZIPCODE_EXCLUDE_FILTER"], exclude=True)
+            )
+        else:
+            print("\nWrong filter type for ZIP codes. Retry.")
+
+    if config_options["USE_DISTRICT_FILTER"] == "yes":
+        predicates.append(IsIn("district", config_options["DISTRICT_FILTER"]))
+
+    # Location, by the coordinates and fare zone of the ZIP code
+    geo_table_path = config_options.get("GEO_TABLE_PATH", GEO_TABLE_PATH)
+    if config_options.get("USE_LOCATION_FILTER", "no") == "yes":
+        latitude, longitude = config_options["LOCATION_POINT"]
+        radius = config_options["LOCATION_RADIUS_KM"]
+        predicates.append(InZipCodes(
+            "zip_code",
+            get_geo_index(geo_table_path).within(latitude, longitude, radius),
+            f"within {radius} km of {latitude}, {longitude}",
+        ))
+    if config_options.get("USE_FARE_ZONE_FILTER", "no") == "yes":
+        fare_zones = config_options["FARE_ZONE_FILTER"]
+        predicates.append(InZipCodes(
+            "zip_code",
+            get_geo_index(geo_table_path).in_fare_zones(fare_zones),
+            f"in fare zones {fare_zones}",
+        ))
+
+    # Money options
+    predicates.append(Range("total_monthly_cost", high=config_options["TOTAL_RENT_MAX"]))
+    predicates.append(Range("months_of_deposit", high=config_options["DEPOSIT_MAX"]))
+    if config_options["PREPAID_RENT"] == "yes":
+        predicates.append(
+            Range("months_of_prepaid_rent", high=config_options["PREPAID_RENT_MAX"])
+        )
+    predicates.append(Range("occupancy_price", high=config_options["OCCUPANCY_PRICE_MAX"]))
+
+    # Housing base characteristics
+    if config_options["USE_HOUSING_TYPE_FILTER"] == "yes":
+        predicates.append(IsIn("housing_type", config_options["HOUSING_TYPE_FILTER"]))
+
+    num_rooms_filter = config_options["NUMBER_OF_ROOMS_FILTER"]
+    size_filter = config_options["SIZE_FILTER"]
+    predicates.append(Range("number_of_rooms", num_rooms_filter[0], num_rooms_filter[1]))
+    predicates.append(Range("size", size_filter[0], size_filter[1]))
+
+    for column, option in FLAG_OPTIONS.items():
+        predicates.append(IsIn(column, config_options[option]))
+
+    return QueryPlan(predicates, config_options.get("HIDE_DUPLICATES", "no") == "yes")
+
+
+def compile_batch(profiles: Dict[str, Dict[str, Union[str, int]]]) -> BatchPlan:
+    """Compile filter configurations by profile name into one batch plan."""
+    return BatchPlan({name: compile_plan(options) for name, options in profiles.items()})
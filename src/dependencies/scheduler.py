@@ -0,0 +1,253 @@
+"""
+Rate limiting and retries for every request to a host: a token bucket sets
+the pace, the number of requests in flight adapts to how the host responds
+(additive increase, multiplicative decrease), Retry-After is honored and
+failed GET/HEAD requests are retried with jittered exponential backoff.
+"""
+
+
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from dependencies.metrics import count
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD"}
+MIN_RATE = 0.5
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Return the seconds to wait from a Retry-After header, in seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    """Allow rate requests per second on average, in bursts of up to burst."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.tokens = self.burst
+        self.updated = monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self.refill()
+            self.rate = rate
+
+    def refill(self) -> None:
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> None:
+        """Block until a request may go out."""
+        while True:
+            with self._lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class HostLimiter:
+    """
+    Pace and concurrency of the requests to one host. Every response on
+    time raises the request rate and the number of requests allowed in
+    flight a little; a throttled, failed or slow one halves both, at most
+    once per cooldown so a burst of errors doesn't collapse them. Until
+    the first of those, the rate grows by one per response instead, about
+    doubling every second, to find the host's limit quickly. While
+    the host asked to retry later, no request goes out. Without a rate,
+    only the concurrency adapts.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = 5.0,
+        max_rate: float = 50.0,
+        max_concurrency: int = 8,
+        target_latency: float = 2.0,
+        cooldown: float = 1.0,
+    ):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.concurrency = float(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.bucket = TokenBucket(rate) if rate else None
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.slow_start = True
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """Block until a request to the host may go out."""
+        with self._condition:
+            while True:
+                pause = self.paused_until - monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self.in_flight >= int(self.concurrency):
+                    self._condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+    def release(self, latency: float, ok: bool) -> None:
+        """Record how a request went, adapting rate and concurrency."""
+        with self._condition:
+            self.in_flight -= 1
+            if ok and latency <= self.target_latency:
+                self.concurrency = min(self.concurrency + 1 / self.concurrency, self.max_concurrency)
+                if self.bucket is not None:
+                    increase = 1 if self.slow_start else 1 / self.rate
+                    self.rate = min(self.rate + increase, self.max_rate)
+            elif monotonic() - self.last_decrease >= self.cooldown:
+                self.last_decrease = monotonic()
+                self.slow_start = False
+                self.concurrency = max(self.concurrency / 2, 1.0)
+                if self.bucket is not None:
+                    self.rate = max(self.rate / 2, MIN_RATE)
+            if self.bucket is not None:
+                self.bucket.set_rate(self.rate)
+            self._condition.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every request to the host for some seconds."""
+        with self._condition:
+            self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+
+class Scheduler:
+    """
+    Send requests through a HostLimiter per host, starting at rate
+    requests per second (None for no limit), retrying GET and HEAD
+    requests up to max_retries times on connection errors, timeouts and
+    429/5xx responses. Retries wait for Retry-After if the host sent one,
+    else for a random time of up to backoff * 2^attempt seconds, and never
+    longer than max_backoff either way.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = 5.0,
+        max_rate: float = 50.0,
+        max_concurrency: int = 8,
+        target_latency: float = 2.0,
+        max_retries: int = 4,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+    ):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiters: Dict[str, HostLimiter] = {}
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def get_limiter(self, url: str) -> HostLimiter:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.limiters:
+                self.limiters[host] = HostLimiter(
+                    self.rate, self.max_rate, self.max_concurrency, self.target_latency
+                )
+            return self.limiters[host]
+
+    def get_backoff(self, attempt: int) -> float:
+        """Full jitter: anywhere from 0 to the exponential backoff."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(
+        self, session: requests.Session, method: str, url: str, **kwargs
+    ) -> requests.Response:
+        """Send a request when the host allows it, retrying if it's safe to."""
+        limiter = self.get_limiter(url)
+        can_retry = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            limiter.acquire()
+            start_time = monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                limiter.release(monotonic() - start_time, ok=False)
+                if not can_retry or attempt >= self.max_retries:
+                    raise
+                wait = self.get_backoff(attempt)
+            except Exception:
+                limiter.release(monotonic() - start_time, ok=False)
+                raise
+            else:
+                with self._lock:
+                    self.requests += 1
+                ok = response.status_code not in RETRY_STATUSES
+                limiter.release(monotonic() - start_time, ok=ok)
+                if ok:
+                    return response
+
+                with self._lock:
+                    self.throttled += 1
+                count("http_throttled", status=response.status_code)
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None:
+                    retry_after = min(retry_after, self.max_backoff)
+                    limiter.pause(retry_after)
+                if not can_retry or attempt >= self.max_retries:
+                    return response
+                response.close()
+                wait = retry_after if retry_after is not None else self.get_backoff(attempt)
+
+            with self._lock:
+                self.retries += 1
+            count("http_retries")
+            attempt += 1
+            sleep(wait)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            stats = {
+                "requests": self.requests,
+                "retries": self.retries,
+                "throttled": self.throttled,
+            }
+            for host, limiter in self.limiters.items():
+                stats[host] = {
+                    "rate": round(limiter.rate, 1) if limiter.rate else None,
+                    "concurrency": round(limiter.concurrency, 1),
+                }
+        return stats
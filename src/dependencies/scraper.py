@@ -1,24 +1,57 @@
 """Scrape BoligPortal website dependencies."""
 
 
-import urllib
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+import math
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from datetime import date
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urljoin
 from tqdm import tqdm
-from time import time
-
-from dependencies.google_trans_new.google_trans_new import google_translator as ts
-
-
-def make_soup(url: str) -> str:
+from time import perf_counter, time
+
+from dependencies.metrics import count, observe, set_gauge, timed
+from dependencies.parsing import parse_html
+from dependencies.session import fetch
+from dependencies.structured import extract_structured_ad
+
+
+BASE_URL = "https://www.boligportal.dk"
+RESULTS_PER_PAGE = 18
+DANISH_MONTHS = {
+    "januar": 1,
+    "februar": 2,
+    "marts": 3,
+    "april": 4,
+    "maj": 5,
+    "juni": 6,
+    "juli": 7,
+    "august": 8,
+    "september": 9,
+    "oktober": 10,
+    "november": 11,
+    "december": 12,
+}
+DANISH_DATE_PATTERN = re.compile(r"(\d{1,2})\.?\s*([a-zæøå]+)\.?,?\s+(\d{4})")
+RESULTS_COUNT_PATTERN = re.compile(
+    r"(\d[\d\.]*)\s+(?:resultater|lejeboliger|boliger|annoncer)", re.IGNORECASE
+)
+
+# Only these elements are read, so only these are built when parsing
+AD_STRAINER = SoupStrainer(
+    ["span", "div"],
+    attrs={"class": ["css-1218edi", "css-1e8e3fr", "css-1bbi9fj", "css-1oj64sa"]},
+)
+RESULTS_STRAINER = SoupStrainer("div", attrs={"class": "css-1e7fg19"})
+
+
+def make_soup(url: str, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
     """Return an HTML body from an URL."""
-    req = urllib.request.Request(url, headers={"User-Agent": "Magic Browser"})
-    http = urllib.request.urlopen(req)
-
-    return BeautifulSoup(http, features="html.parser")
+    html = fetch(url)
+    with timed("parse", source="results"):
+        return parse_html(html, parse_only=parse_only)
 
 
 def get_only_numbers(seq: str) -> str:
@@ -49,10 +82,45 @@ def convert_string_to_binary(seq: str) -> str:
         return 0
 
 
+def parse_danish_date(seq: str) -> Optional[date]:
+    """Parse a Danish date such as '1. januar 2023' or '01.01.2023'."""
+    match = DANISH_DATE_PATTERN.search(seq.lower())
+    if match is not None and match.group(2) in DANISH_MONTHS:
+        day, month, year = match.groups()
+        try:
+            return date(int(year), DANISH_MONTHS[month], int(day))
+        except ValueError:
+            return None
+    try:
+        return datetime.strptime(seq.strip(), "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
 def scrape_ad(url: str) -> Dict:
-    """Fully scrape an ad from Bolig Portal."""
-    soup = make_soup(url)
-    translator = ts()
+    """
+    Fully scrape an ad from Bolig Portal. Text fields such as the summary
+    are left in Danish, see TranslationStage for translating them.
+    """
+    with timed("scrape_ad"):
+        return parse_ad(url, fetch(url))
+
+
+def parse_ad(url: str, html: bytes) -> Dict:
+    """
+    Extract an ad from the HTML of its page. The JSON record embedded in the
+    page is used when there is one, else the ad is read from the DOM.
+    """
+    ad = extract_structured_ad(url, html)
+    if ad is not None:
+        return ad
+    return parse_ad_dom(url, html)
+
+
+def parse_ad_dom(url: str, html: bytes) -> Dict:
+    """Extract an ad from the elements of its page."""
+    start_time = perf_counter()
+    soup = parse_html(html, parse_only=AD_STRAINER)
 
     # Fetch the keys of the apartment details e.g. 'Pet Friendly'
     key_details_section = soup.find_all("span", {"class": "css-1218edi"})
@@ -99,6 +167,9 @@ def scrape_ad(url: str) -> Dict:
     occupancy_price = check_info(scrape_dict, "Indflytningspris", "0")
     creation_date = check_info(scrape_dict, "Oprettelsesdato", "")
 
+    observe("parse", perf_counter() - start_time, source="dom")
+    start_time = perf_counter()
+
     # Cleaning
     # ----------------- #
     # Since the numerical values are all strings with added currency figures etc:
@@ -127,7 +198,7 @@ def scrape_ad(url: str) -> Dict:
     try:
         floor = int(remove_commas(get_only_numbers(floor)))
     except ValueError:
-        floor = translator.translate(floor, lang_src="da", lang_tgt="en").strip()
+        floor = floor.strip()
 
     # Binaries
     is_furnished = convert_string_to_binary(is_furnished)
@@ -157,23 +228,7 @@ def scrape_ad(url: str) -> Dict:
     if available_from == "Snarest muligt":
         available_from = date.today()
     else:
-        available_from = translator.translate(available_from, lang_src="da", lang_tgt="en").strip()
-        available_from = remove_commas(available_from)
-        try:
-            available_from = datetime.strptime(available_from, "%d %B %Y").date()
-        except ValueError:
-            try:
-                available_from = datetime.strptime(available_from, "%B %d %Y").date()
-            except ValueError:
-                try:
-                    available_from = datetime.strptime(available_from, "%B %d, %Y").date()
-                except ValueError:
-                    available_from = None
-
-    # Translations
-    housing_type = translator.translate(housing_type, lang_src="da", lang_tgt="en").strip()
-    rental_period = translator.translate(rental_period, lang_src="da", lang_tgt="en").strip()
-    summary = translator.translate(summary, lang_src="da", lang_tgt="en").strip()
+        available_from = parse_danish_date(available_from)
 
     # Calculated fields
     total_monthly_cost = monthly_rent + aconto
@@ -211,34 +266,170 @@ def scrape_ad(url: str) -> Dict:
         "has_balcony": has_balcony,
         "has_parking": has_parking,
     }
+    observe("cleanup", perf_counter() - start_time, source="dom")
 
     return ad
 
 
-def scrape_ads_urls(main_url: str, pages: int) -> List:
+def get_page_url(main_url: str, page: int) -> str:
+    """Return the URL of a results page, counting pages from 0."""
+    if page == 0:
+        return main_url
+    separator = "&" if "?" in main_url else "?"
+    return f"{main_url}{separator}offset={RESULTS_PER_PAGE*page}"
+
+
+def get_results_count(soup: BeautifulSoup) -> Optional[int]:
+    """Return the total number of results a search reports, if shown."""
+    match = RESULTS_COUNT_PATTERN.search(soup.get_text(" "))
+    if match is None:
+        return None
+    return int(remove_commas(match.group(1)))
+
+
+def get_ads_links(soup: BeautifulSoup, base_url: str = BASE_URL) -> List[str]:
+    """Return the links to all the ads on a results page, relative to base_url."""
+    links = []
+    for div in soup.find_all("div", {"class": "css-1e7fg19"}):
+        a = div.find("a", href=True)
+        if a is not None:
+            links.append(urljoin(base_url, a["href"]))
+    return links
+
+
+def scrape_results_page(main_url: str, page: int) -> Optional[List[str]]:
+    """
+    Return the ad links on one results page, or None if it fails, which
+    is not the same as an empty page past the last results.
+    """
+    try:
+        page_url = get_page_url(main_url, page)
+        return get_ads_links(
+            make_soup(page_url, parse_only=RESULTS_STRAINER), page_url
+        )
+    except Exception as e:
+        count("results_pages_failed")
+        tqdm.write(f"Failed to scrape results page {page}: {type(e).__name__}: {e}")
+        return None
+
+
+def scrape_ads_urls(
+    main_url: str, pages: int = 0, max_workers: int = 8
+) -> Tuple[Set[str], bool]:
     """
     Go to main results page, parse all susequent pages and
     retrieve links to all properties.
+
+    The number of pages is worked out from the results count on the first
+    page, capped at pages if that is above 0. The remaining pages are then
+    fetched concurrently. If the count is not shown, pages are fetched in
+    batches of max_workers until the first empty page, or until a whole
+    batch fails.
+
+    Returns the links, and whether every page was scraped, none failed or
+    left out by the pages limit, without which listings missing from the
+    links can't be taken as removed.
     """
     start_time = time()
-    all_links = []
+    all_links = set()
+    failed_pages = 0
 
-    for i in tqdm(range(0, pages)):
-        if i != 0:
-            next_page = f"&offset={18*i}"
-            soup = make_soup(main_url + next_page)
-        else:
-            soup = make_soup(main_url)
+    # Parsed in full, since the results count can be anywhere on the page
+    first_page = make_soup(main_url)
+    all_links.update(get_ads_links(first_page, main_url))
 
-        for div in soup.find_all("div", {"class": "css-1e7fg19"}):
-            a = div.find("a", href=True)
-            all_links.append("https://www.boligportal.dk" + a["href"])
+    results_count = get_results_count(first_page)
+    if results_count is not None:
+        last_page = math.ceil(results_count / RESULTS_PER_PAGE)
+        print(f"{results_count} results reported over {last_page} pages.")
+    else:
+        last_page = None
+    capped = pages > 0 and (last_page is None or pages < last_page)
+    if pages > 0:
+        last_page = pages if last_page is None else min(last_page, pages)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if results_count is not None:
+            futures = [
+                executor.submit(scrape_results_page, main_url, page)
+                for page in range(1, last_page)
+            ]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                links = future.result()
+                if links is None:
+                    failed_pages += 1
+                else:
+                    all_links.update(links)
+        else:
+            page = 1
+            found_empty_page = not all_links
+            with tqdm() as progress:
+                while not found_empty_page and (last_page is None or page < last_page):
+                    batch = range(page, page + max_workers)
+                    if last_page is not None:
+                        batch = range(page, min(page + max_workers, last_page))
+                    batch_failed = 0
+                    for links in executor.map(
+                        lambda p: scrape_results_page(main_url, p), batch
+                    ):
+                        progress.update()
+                        if links is None:
+                            batch_failed += 1
+                            continue
+                        if not links:
+                            found_empty_page = True
+                            break
+                        all_links.update(links)
+                    failed_pages += batch_failed
+                    if batch_failed == len(batch):
+                        # The site is down rather than out of results
+                        break
+                    page = batch.stop
+            # Only the last page was reached if paging ended on an empty one
+            capped = capped and not found_empty_page
 
     end_time = time()
     runtime = end_time - start_time
+    observe("discovery", runtime)
+    count("ad_links_found", len(all_links))
     print(f"Scraping for Ad URLs finished in {round(runtime,2):,}s")
-
-    all_links = set(all_links)
     print(f"{len(all_links)} links found.")
+    if failed_pages:
+        print(f"{failed_pages} results pages failed, so some links may be missing.")
+
+    return all_links, failed_pages == 0 and not capped
+
 
-    return all_links
+def scrape_ads(urls: Iterable[str], max_workers: int = 8) -> Iterator[Dict]:
+    """
+    Scrape all ads concurrently, keeping up to max_workers requests in flight,
+    and yield each ad as soon as it's parsed. An ad which fails to scrape is
+    reported and skipped, not fatal to the run.
+    """
+    start_time = time()
+    scraped = 0
+    failed_urls = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(scrape_ad, url): url for url in urls}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            url = futures[future]
+            try:
+                ad = future.result()
+            except Exception as e:
+                failed_urls.append(url)
+                count("ads_failed")
+                tqdm.write(f"Failed to scrape {url}: {type(e).__name__}: {e}")
+                continue
+            scraped += 1
+            count("ads_scraped")
+            yield ad
+
+    end_time = time()
+    runtime = end_time - start_time
+    throughput = scraped / runtime if runtime > 0 else 0.0
+    set_gauge("scrape_ads_per_second", throughput)
+    print(
+        f"Scraped {scraped} ads ({len(failed_urls)} failed) "
+        f"in {round(runtime,2):,}s: {round(throughput,2):,} ads/sec"
+    )
@@ -0,0 +1,148 @@
+"""Shared HTTP session with connection pooling for all scraping requests."""
+
+
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from dependencies.archive import PageArchive
+from dependencies.metrics import count, timed
+from dependencies.scheduler import Scheduler
+
+# urllib3 only decodes brotli responses when a brotli package is installed,
+# so only advertise it when we can actually read it.
+try:
+    import brotli  # noqa: F401
+
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+USER_AGENT = "Magic Browser"
+DEFAULT_POOL_SIZE = 8
+DEFAULT_TIMEOUT = (5.0, 30.0)
+# Validators of fetched pages kept until the listing index takes them
+MAX_VALIDATORS = 100000
+
+_session = None
+_timeout = DEFAULT_TIMEOUT
+_archive = None
+_scheduler = None
+_validators: "OrderedDict[str, Tuple[Optional[str], Optional[str]]]" = OrderedDict()
+_lock = threading.RLock()
+
+
+def configure_session(
+    pool_size: int = DEFAULT_POOL_SIZE,
+    timeout: Union[float, List[float], Tuple[float, float]] = DEFAULT_TIMEOUT,
+    archive: Optional[PageArchive] = None,
+    scheduler: Optional[Scheduler] = None,
+) -> requests.Session:
+    """
+    (Re)build the shared session. The pool keeps up to pool_size keep-alive
+    connections per host, timeout is either one value or (connect, read).
+    Every fetched page is stored in archive, if given. Requests are paced
+    and retried by scheduler, by default one with no rate limit and up to
+    pool_size requests in flight per host.
+    """
+    global _session, _timeout, _archive, _scheduler
+
+    session = requests.Session()
+    session.headers.update(
+        {"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING}
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = session
+        _timeout = tuple(timeout) if isinstance(timeout, (list, tuple)) else timeout
+        _archive = archive
+        _scheduler = scheduler or Scheduler(rate=None, max_concurrency=pool_size)
+
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the shared session, creating it with defaults if needed."""
+    if _session is None:
+        with _lock:
+            if _session is None:
+                configure_session()
+    return _session
+
+
+def get_scheduler() -> Scheduler:
+    get_session()
+    return _scheduler
+
+
+def fetch(url: str) -> bytes:
+    """GET an URL over the shared session and return the decoded body."""
+    with timed("fetch"):
+        response = get_scheduler().request(get_session(), "GET", url, timeout=_timeout)
+    count("http_responses", status=response.status_code)
+    response.raise_for_status()
+    count("bytes_downloaded", len(response.content))
+    if _archive is not None:
+        _archive.store(url, response.content)
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if etag or last_modified:
+        with _lock:
+            _validators[url] = (etag, last_modified)
+            if len(_validators) > MAX_VALIDATORS:
+                _validators.popitem(last=False)
+    return response.content
+
+
+def pop_validators(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """Return the (ETag, Last-Modified) an URL was last fetched with, and forget them."""
+    with _lock:
+        return _validators.pop(url, (None, None))
+
+
+def revalidate(
+    url: str, etag: Optional[str] = None, last_modified: Optional[str] = None
+) -> Tuple[bool, Optional[str], Optional[str]]:
+    """
+    Check with a conditional HEAD request if a page changed since it was
+    last seen with the given validators. Returns (changed, etag, last
+    modified). Without validators to compare, the page counts as changed,
+    since nothing shows it isn't.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    response = get_scheduler().request(
+        get_session(),
+        "HEAD",
+        url,
+        headers=headers,
+        timeout=_timeout,
+        allow_redirects=True,
+    )
+    if response.status_code == 304:
+        return False, etag, last_modified
+    response.raise_for_status()
+
+    new_etag = response.headers.get("ETag")
+    new_last_modified = response.headers.get("Last-Modified")
+    if etag and new_etag:
+        changed = new_etag != etag
+    elif last_modified and new_last_modified:
+        changed = new_last_modified != last_modified
+    else:
+        changed = True
+
+    return changed, new_etag or etag, new_last_modified or last_modified
@@ -0,0 +1,181 @@
+"""Typed columnar storage (Parquet or Feather) of scraped ads."""
+
+
+import os
+from datetime import date
+from typing import Dict, List, Optional, Set
+
+import pandas as pd
+
+# pyarrow is only needed when writing or reading columnar output
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+COLUMNAR_FORMATS = {".parquet": "parquet", ".feather": "feather"}
+# Folder name of each date's parts with partition_by_date, e.g. scrape_date=2023-01-15
+PARTITION_COLUMN = "scrape_date"
+FLAG_COLUMNS = [
+    "is_furnished",
+    "is_shareable",
+    "pets_allowed",
+    "has_elevator",
+    "students_only",
+    "has_balcony",
+    "has_parking",
+]
+
+
+def get_format(path: str) -> Optional[str]:
+    """Return the columnar format a path is meant for, or None for CSV."""
+    return COLUMNAR_FORMATS.get(os.path.splitext(path.rstrip("/"))[1])
+
+
+def check_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("Parquet and Feather output need pyarrow. Install it first.")
+
+
+def get_schema() -> "pa.Schema":
+    """Return the typed schema of an ad."""
+    check_pyarrow()
+    category = pa.dictionary(pa.int16(), pa.string())
+    return pa.schema(
+        [
+            ("url", pa.string()),
+            ("creation_date", pa.date32()),
+            ("scraped_date", pa.date32()),
+            ("full_address", pa.string()),
+            ("street", pa.string()),
+            ("zip_code", pa.int16()),
+            ("district", category),
+            ("housing_type", category),
+            ("size", pa.float32()),
+            ("number_of_rooms", pa.int16()),
+            ("floor", pa.string()),
+            ("rental_period", category),
+            ("available_from", pa.date32()),
+            ("summary", pa.string()),
+            ("monthly_rent", pa.int32()),
+            ("aconto", pa.int32()),
+            ("deposit", pa.int32()),
+            ("prepaid_rent", pa.int32()),
+            ("occupancy_price", pa.int32()),
+            ("total_monthly_cost", pa.int32()),
+            ("months_of_prepaid_rent", pa.int16()),
+            ("months_of_deposit", pa.int16()),
+        ]
+        + [(column, pa.int8()) for column in FLAG_COLUMNS]
+        + [("duplicate_of", pa.string())]
+    )
+
+
+def to_typed_row(ad: Dict) -> Dict:
+    """Return an ad with every value in the type of the schema."""
+    row = dict(ad)
+    row["zip_code"] = int(row["zip_code"]) if str(row.get("zip_code", "")).isdigit() else None
+    row["floor"] = None if row.get("floor") is None else str(row["floor"])
+    return row
+
+
+def write_part(ads: List[Dict], directory: str, name: str, partition_by_date: bool) -> None:
+    """
+    Write ads as one part file of a dataset directory. With
+    partition_by_date, the part goes into a 'scrape_date=YYYY-MM-DD'
+    subdirectory for each scraped date.
+    """
+    check_pyarrow()
+    output_format = get_format(directory)
+    schema = get_schema()
+
+    groups = {}
+    for ad in ads:
+        scraped_date = ad.get("scraped_date") or date.today()
+        key = f"{PARTITION_COLUMN}={scraped_date.isoformat()}" if partition_by_date else ""
+        groups.setdefault(key, []).append(to_typed_row(ad))
+
+    for key, rows in groups.items():
+        part_directory = os.path.join(directory, key)
+        os.makedirs(part_directory, exist_ok=True)
+        table = pa.Table.from_pylist(rows, schema=schema)
+        path = os.path.join(part_directory, f"{name}.{output_format}")
+        # Written aside and renamed, so a crash never leaves half a part.
+        # Readers skip files starting with a dot
+        temporary_path = os.path.join(part_directory, f".{name}.{output_format}")
+        if output_format == "parquet":
+            pq.write_table(table, temporary_path, compression="zstd")
+        else:
+            feather.write_feather(table, temporary_path, compression="zstd")
+        os.replace(temporary_path, path)
+
+
+def read_urls(directory: str, since: float = 0.0) -> Set[str]:
+    """Return the URLs of the ads in the part files of a dataset written since a time."""
+    check_pyarrow()
+    output_format = get_format(directory)
+    urls = set()
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if (
+                name.startswith(".")
+                or not name.endswith(f".{output_format}")
+                or os.path.getmtime(path) < since
+            ):
+                continue
+            if output_format == "parquet":
+                table = pq.read_table(path, columns=["url"])
+            else:
+                table = feather.read_table(path, columns=["url"])
+            urls.update(table.column("url").to_pylist())
+    return urls
+
+
+def open_dataset(path: str) -> "ds.Dataset":
+    """
+    Open a dataset directory, or a single file, by the schema of an ad.
+    Parts written with partition_by_date come with their scrape_date.
+    """
+    check_pyarrow()
+    schema = get_schema()
+    partitioning = None
+    if os.path.isdir(path) and any(
+        name.startswith(f"{PARTITION_COLUMN}=") for name in os.listdir(path)
+    ):
+        partition_schema = pa.schema([(PARTITION_COLUMN, pa.date32())])
+        partitioning = ds.partitioning(partition_schema, flavor="hive")
+        schema = schema.append(partition_schema.field(0))
+    return ds.dataset(path, format=get_format(path), schema=schema, partitioning=partitioning)
+
+
+def read_ads(
+    path: str, columns: Optional[List[str]] = None, rows: Optional[List[int]] = None
+) -> pd.DataFrame:
+    """
+    Read ads from a Parquet or Feather dataset directory, or a single file,
+    only reading the given columns, and only the given row positions if
+    any. Dates come back as datetime64 columns and categories as pandas
+    categoricals.
+    """
+    dataset = open_dataset(path)
+    if rows is None:
+        df = dataset.to_table(columns=columns).to_pandas()
+    else:
+        df = dataset.take(rows, columns=columns).to_pandas()
+        df.index = rows
+    for column in ["creation_date", "scraped_date", "available_from", PARTITION_COLUMN]:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column])
+    return df
+
+
+def load_ads(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Read ads from CSV or columnar storage, only the given columns if possible."""
+    if get_format(path) is not None:
+        return read_ads(path, columns)
+    return pd.read_csv(path, usecols=columns)
@@ -0,0 +1,233 @@
+"""
+Extract ads from the JSON record embedded in their page (Next.js data or
+JSON-LD), skipping DOM traversal and the cleanup of Danish strings.
+"""
+
+
+import json
+import re
+from datetime import date, datetime
+from time import perf_counter
+from typing import Any, Dict, Iterator, Optional, Union
+
+from dependencies.metrics import observe
+
+
+PAYLOAD_PATTERNS = [
+    re.compile(r'<script[^>]*id="__NEXT_DATA__"[^>]*>(.*?)</script>', re.DOTALL),
+    re.compile(r'<script[^>]*type="application/ld\+json"[^>]*>(.*?)</script>', re.DOTALL),
+]
+
+# Where each field of the ad schema may be found, by the keys used in
+# BoligPortal's own data and then by the schema.org names of JSON-LD.
+FIELD_KEYS = {
+    "creation_date": ["advertised_date", "creation_date", "created", "datePosted"],
+    "available_from": ["available_from", "availableFrom", "availabilityStarts"],
+    "street": ["street_name", "street", "streetAddress"],
+    "zip_code": ["postal_code", "zip_code", "zipcode", "postalCode"],
+    "city": ["city", "addressLocality"],
+    "district": ["city_area", "district", "addressRegion"],
+    "housing_type": ["category", "housing_type"],
+    "size": ["size_m2", "size", "floorSize"],
+    "number_of_rooms": ["rooms", "number_of_rooms", "numberOfRooms"],
+    "floor": ["floor", "floorLevel"],
+    "rental_period": ["rental_period", "rentalPeriod"],
+    "summary": ["description", "summary"],
+    "monthly_rent": ["monthly_rent", "rent", "price"],
+    "aconto": ["monthly_rent_extra_costs", "aconto"],
+    "deposit": ["deposit"],
+    "prepaid_rent": ["prepaid_rent"],
+    "occupancy_price": ["move_in_price", "occupancy_price"],
+    "is_furnished": ["furnished", "is_furnished"],
+    "is_shareable": ["shareable", "is_shareable"],
+    "pets_allowed": ["pets_allowed", "petsAllowed"],
+    "has_elevator": ["elevator", "has_elevator"],
+    "students_only": ["student_only", "students_only"],
+    "has_balcony": ["balcony", "has_balcony"],
+    "has_parking": ["parking", "has_parking"],
+}
+
+# Categories as the site shows them, so they translate like the scraped ones
+HOUSING_TYPES = {
+    "rental_apartment": "Lejlighed",
+    "rental_room": "Værelse",
+    "rental_house": "Hus",
+    "rental_townhouse": "Rækkehus",
+    "Apartment": "Lejlighed",
+    "House": "Hus",
+    "Room": "Værelse",
+}
+
+
+def find_payloads(html: str) -> Iterator[Any]:
+    """Yield the decoded JSON payloads embedded in a page."""
+    for pattern in PAYLOAD_PATTERNS:
+        for match in pattern.finditer(html):
+            try:
+                yield json.loads(match.group(1))
+            except ValueError:
+                continue
+
+
+def find_record(payload: Any) -> Optional[Dict]:
+    """Return the first object in a payload that looks like an ad, if any."""
+    stack = [payload]
+    while stack:
+        node = stack.pop(0)
+        if isinstance(node, dict):
+            keys = node.keys()
+            has_rent = any(key in keys for key in FIELD_KEYS["monthly_rent"])
+            has_offer = isinstance(node.get("offers"), dict)
+            if (has_rent or has_offer) and any(
+                key in keys for key in ["id", "@type", "url"]
+            ):
+                return node
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return None
+
+
+def flatten(record: Dict) -> Dict[str, Any]:
+    """Flatten nested objects (features, address, offers...) into one level."""
+    flat = {}
+    stack = [record]
+    while stack:
+        node = stack.pop(0)
+        for key, value in node.items():
+            if isinstance(value, dict) and set(value.keys()) & {"value", "@value"}:
+                value = value.get("value", value.get("@value"))
+            if isinstance(value, dict):
+                stack.append(value)
+            elif key not in flat:
+                flat[key] = value
+    return flat
+
+
+def lookup(flat: Dict[str, Any], field: str, default: Any = None) -> Any:
+    for key in FIELD_KEYS[field]:
+        if flat.get(key) is not None:
+            return flat[key]
+    return default
+
+
+def to_date(value: Union[str, int, None]) -> Optional[date]:
+    """Parse an ISO date or timestamp."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000 if value > 1e11 else value).date()
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def to_binary(value: Any) -> int:
+    if isinstance(value, str):
+        return 1 if value.lower() in ["true", "yes", "ja", "1"] else 0
+    return 1 if value else 0
+
+
+def to_floor(value: Any) -> Union[int, str]:
+    """Floors are numbers, e.g. 2 for '2. sal', or text such as 'Stuen', like on the page."""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(re.sub(r"[^\d]", "", str(value)))
+    except ValueError:
+        return str(value).strip()
+
+
+def to_rental_period(value: Any) -> str:
+    """Rental periods come as a number of months, 0 meaning unlimited."""
+    if isinstance(value, str) and not value.isdigit():
+        return value
+    months = int(value or 0)
+    if months == 0:
+        return "Ubegrænset"
+    elif months < 12:
+        return "1-11 måneder"
+    elif months < 24:
+        return "12-23 måneder"
+    return "24+ måneder"
+
+
+def extract_structured_ad(url: str, html: Union[str, bytes]) -> Optional[Dict]:
+    """
+    Build an ad from the JSON record embedded in its page. Returns None if
+    the page has no such record, so the caller can fall back to the DOM.
+    Missing fields come out as parse_ad_dom has them: 0 for amounts and
+    the floor, None for the available from date.
+    """
+    start_time = perf_counter()
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="replace")
+
+    record = None
+    for payload in find_payloads(html):
+        record = find_record(payload)
+        if record is not None:
+            break
+    observe("parse", perf_counter() - start_time, source="json")
+    if record is None:
+        return None
+
+    start_time = perf_counter()
+    flat = flatten(record)
+    monthly_rent = lookup(flat, "monthly_rent")
+    zip_code = lookup(flat, "zip_code")
+    creation_date = to_date(lookup(flat, "creation_date"))
+    if monthly_rent is None or zip_code is None or creation_date is None:
+        return None
+
+    monthly_rent = int(float(monthly_rent))
+    aconto = int(float(lookup(flat, "aconto", 0)))
+    deposit = int(float(lookup(flat, "deposit", 0)))
+    prepaid_rent = int(float(lookup(flat, "prepaid_rent", 0)))
+    occupancy_price = int(float(lookup(flat, "occupancy_price", 0)))
+
+    street = str(lookup(flat, "street", "")).strip()
+    zip_code = str(zip_code).strip()
+    city = str(lookup(flat, "city", "")).strip()
+    district = str(lookup(flat, "district", city)).strip()
+    full_address = f"{street}, {zip_code} {city}, {district}"
+
+    available_from = to_date(lookup(flat, "available_from"))
+    housing_type = str(lookup(flat, "housing_type", record.get("@type", "")))
+
+    ad = {
+        "url": url,
+        "creation_date": creation_date,
+        "scraped_date": date.today(),
+        "full_address": full_address,
+        "street": street,
+        "zip_code": zip_code,
+        "district": district,
+        "housing_type": HOUSING_TYPES.get(housing_type, housing_type),
+        "size": float(lookup(flat, "size", 0)),
+        "number_of_rooms": int(float(lookup(flat, "number_of_rooms", 0))),
+        "floor": to_floor(lookup(flat, "floor")),
+        "rental_period": to_rental_period(lookup(flat, "rental_period")),
+        "available_from": available_from,
+        "summary": re.sub(r"[\n\t]", "", str(lookup(flat, "summary", ""))),
+        "monthly_rent": monthly_rent,
+        "aconto": aconto,
+        "deposit": deposit,
+        "prepaid_rent": prepaid_rent,
+        "occupancy_price": occupancy_price,
+        "total_monthly_cost": monthly_rent + aconto,
+        "months_of_prepaid_rent": int(prepaid_rent / monthly_rent),
+        "months_of_deposit": int(deposit / monthly_rent),
+        "is_furnished": to_binary(lookup(flat, "is_furnished")),
+        "is_shareable": to_binary(lookup(flat, "is_shareable")),
+        "pets_allowed": to_binary(lookup(flat, "pets_allowed")),
+        "has_elevator": to_binary(lookup(flat, "has_elevator")),
+        "students_only": to_binary(lookup(flat, "students_only")),
+        "has_balcony": to_binary(lookup(flat, "has_balcony")),
+        "has_parking": to_binary(lookup(flat, "has_parking")),
+    }
+    observe("cleanup", perf_counter() - start_time, source="json")
+    return ad
@@ -0,0 +1,471 @@
+"""Danish to English translations, cached in memory and on disk."""
+
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from time import sleep, time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from dependencies.fingerprint import FingerprintStore
+from dependencies.metrics import count, timed
+
+
+DEFAULT_CACHE_PATH = "../data/translation_cache.sqlite"
+DEFAULT_CACHE_SIZE = 100000
+DEFAULT_MEMORY_SIZE = 4096
+# Hits whose last_used is written back to disk at once
+TOUCH_BATCH_SIZE = 1000
+# Each text of a batch is sent after a numbered marker, e.g. "[3] Lejlighed"
+MARKER_PATTERN = re.compile(r"\s*\[(\d+)\]\s*")
+DEFAULT_BACKEND = "google"
+DEFAULT_FIELDS = ["floor", "housing_type", "rental_period", "summary"]
+
+
+class TranslationCache:
+    """
+    Translations keyed by (text, source language, target language), kept in
+    SQLite across runs with an in-memory LRU in front. The disk cache keeps
+    at most max_entries, evicting the least recently used. When each entry
+    was last used is kept in memory for every hit, and written to disk in
+    batches, before evicting and on close.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_entries: int = DEFAULT_CACHE_SIZE,
+        memory_entries: int = DEFAULT_MEMORY_SIZE,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.touched: Dict[Tuple[str, str, str], float] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS translations (
+                text TEXT NOT NULL,
+                lang_src TEXT NOT NULL,
+                lang_tgt TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (text, lang_src, lang_tgt)
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)"
+        )
+        self.connection.commit()
+        (self.size,) = self.connection.execute("SELECT COUNT(*) FROM translations").fetchone()
+
+    def _remember(self, key: Tuple[str, str, str], translation: str) -> None:
+        """Put a translation in the in-memory LRU."""
+        self.memory[key] = translation
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _touch(self, key: Tuple[str, str, str]) -> None:
+        """Note that an entry was used now, writing back once enough are noted."""
+        self.touched[key] = time()
+        if len(self.touched) >= TOUCH_BATCH_SIZE:
+            self._write_touched()
+            self.connection.commit()
+
+    def _write_touched(self) -> None:
+        if self.touched:
+            self.connection.executemany(
+                "UPDATE translations SET last_used = ? "
+                "WHERE text = ? AND lang_src = ? AND lang_tgt = ?",
+                [(last_used, *key) for key, last_used in self.touched.items()],
+            )
+            self.touched = {}
+
+    def get(self, text: str, lang_src: str, lang_tgt: str) -> Optional[str]:
+        """Return a cached translation or None, counting hits and misses."""
+        key = (text, lang_src, lang_tgt)
+        with self._lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self._touch(key)
+                self.hits += 1
+                return self.memory[key]
+
+            row = self.connection.execute(
+                "SELECT translation FROM translations "
+                "WHERE text = ? AND lang_src = ? AND lang_tgt = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._touch(key)
+            self._remember(key, row[0])
+            self.hits += 1
+            return row[0]
+
+    def put(self, text: str, lang_src: str, lang_tgt: str, translation: str) -> None:
+        """Store a translation, evicting the oldest entries when full."""
+        self.put_many([(text, translation)], lang_src, lang_tgt)
+
+    def put_many(self, translations: List[Tuple[str, str]], lang_src: str, lang_tgt: str) -> None:
+        """Store (text, translation) pairs in one transaction."""
+        now = time()
+        with self._lock:
+            for text, translation in translations:
+                key = (text, lang_src, lang_tgt)
+                self._remember(key, translation)
+                self.touched.pop(key, None)
+                inserted = self.connection.execute(
+                    "INSERT OR IGNORE INTO translations VALUES (?, ?, ?, ?, ?)",
+                    (*key, translation, now),
+                ).rowcount
+                if inserted:
+                    self.size += 1
+                else:
+                    self.connection.execute(
+                        "UPDATE translations SET translation = ?, last_used = ? "
+                        "WHERE text = ? AND lang_src = ? AND lang_tgt = ?",
+                        (translation, now, *key),
+                    )
+            if self.size > self.max_entries:
+                # Evict a tenth extra so we don't evict on every insert
+                self._write_touched()
+                surplus = self.size - self.max_entries + self.max_entries // 10
+                self.connection.execute(
+                    "DELETE FROM translations WHERE rowid IN ("
+                    "SELECT rowid FROM translations ORDER BY last_used LIMIT ?)",
+                    (surplus,),
+                )
+                # Counted again, as other processes may share the file
+                (self.size,) = self.connection.execute(
+                    "SELECT COUNT(*) FROM translations"
+                ).fetchone()
+            self.connection.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache hit and miss counters."""
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        with self._lock:
+            self._write_touched()
+            self.connection.commit()
+            self.connection.close()
+
+
+class TranslationBackend(ABC):
+    """
+    Interface for translation services. Backends translate a batch of
+    texts, which may be sent as one request of up to max_batch_chars,
+    counting batch_overhead characters per text for separators.
+    """
+
+    max_batch_chars = 4500
+    batch_overhead = 1
+
+    def __init__(self):
+        self.requests = 0
+
+    @abstractmethod
+    def translate_batch(self, texts: List[str], lang_src: str, lang_tgt: str) -> List[str]:
+        """Return the translations of texts, in the same order."""
+
+
+def split_marked(translated: str, texts: int) -> Optional[List[str]]:
+    """
+    Split a translated batch back at its markers, or return None unless
+    every marker from 0 to texts - 1 came back once and in order.
+    """
+    parts = MARKER_PATTERN.split(translated.strip())
+    if parts[0].strip() or [int(i) for i in parts[1::2]] != list(range(texts)):
+        return None
+    return [part.strip() for part in parts[2::2]]
+
+
+class GoogleBackend(TranslationBackend):
+    """
+    Google Translate through google_trans_new. A batch is sent as one text,
+    each input on its own line after a numbered marker, and split back at
+    the markers. If any marker is lost or moved, the batch is translated
+    one text at a time instead.
+    """
+
+    batch_overhead = 8
+
+    def __init__(self):
+        super().__init__()
+        from dependencies.google_trans_new.google_trans_new import google_translator
+
+        self.translator = google_translator()
+
+    def _translate(self, text: str, lang_src: str, lang_tgt: str) -> str:
+        self.requests += 1
+        return self.translator.translate(text, lang_src=lang_src, lang_tgt=lang_tgt)
+
+    def translate_batch(self, texts: List[str], lang_src: str, lang_tgt: str) -> List[str]:
+        if len(texts) == 1:
+            return [self._translate(texts[0], lang_src, lang_tgt).strip()]
+
+        lines = [text.replace("\n", " ") for text in texts]
+        joined = "\n".join(f"[{i}] {line}" for i, line in enumerate(lines))
+        translations = split_marked(self._translate(joined, lang_src, lang_tgt), len(texts))
+        if translations is not None:
+            return translations
+
+        # Markers got lost or moved in translation, so go one by one
+        count("translation_batches_split")
+        return [self._translate(text, lang_src, lang_tgt).strip() for text in texts]
+
+
+class FakeBackend(TranslationBackend):
+    """
+    Local stand-in for testing and benchmarking without the network. Knows
+    a few common listing terms, returns anything else as is.
+    """
+
+    vocabulary = {
+        "Lejlighed": "Apartment",
+        "Rækkehus": "Townhouse",
+        "Hus": "House",
+        "Værelse": "Room",
+        "Ubegrænset": "Unlimited",
+        "1-11 måneder": "1-11 months",
+        "12-23 måneder": "12-23 months",
+        "24+ måneder": "24+ months",
+        "Stuen": "Ground floor",
+        "Kælder": "Basement",
+    }
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+
+    def translate_batch(self, texts: List[str], lang_src: str, lang_tgt: str) -> List[str]:
+        self.requests += 1
+        if self.latency:
+            sleep(self.latency)
+        return [self.vocabulary.get(text, text) for text in texts]
+
+
+TRANSLATION_BACKENDS = {"google": GoogleBackend, "fake": FakeBackend}
+
+_backend = None
+_backend_name = DEFAULT_BACKEND
+_cache = None
+_lock = threading.RLock()
+
+
+def configure_translation(
+    cache_path: str = DEFAULT_CACHE_PATH,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+    memory_size: int = DEFAULT_MEMORY_SIZE,
+    backend: str = DEFAULT_BACKEND,
+) -> TranslationCache:
+    """(Re)open the shared translation cache and pick the backend."""
+    global _cache, _backend, _backend_name
+    if backend not in TRANSLATION_BACKENDS:
+        raise ValueError(
+            f"Translation backend needs to be one of {list(TRANSLATION_BACKENDS)}. "
+            f"Detected '{backend}'."
+        )
+    with _lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = TranslationCache(cache_path, cache_size, memory_size)
+        if _backend is None or _backend_name != backend:
+            _backend = None
+            _backend_name = backend
+    return _cache
+
+
+def get_backend() -> TranslationBackend:
+    """Return the one backend instance shared by all translations."""
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = TRANSLATION_BACKENDS[_backend_name]()
+    return _backend
+
+
+def get_cache() -> TranslationCache:
+    """Return the shared translation cache, opening it with defaults if needed."""
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                configure_translation(backend=_backend_name)
+    return _cache
+
+
+def split_batches(
+    texts: Iterable[str], max_chars: int, overhead: int = 1
+) -> Iterable[List[str]]:
+    """Group texts into batches of at most max_chars, counting overhead per text."""
+    batch, size = [], 0
+    for text in texts:
+        if batch and size + len(text) + overhead > max_chars:
+            yield batch
+            batch, size = [], 0
+        batch.append(text)
+        size += len(text) + overhead
+    if batch:
+        yield batch
+
+
+def translate_many(texts: List[str], lang_src: str = "da", lang_tgt: str = "en") -> List[str]:
+    """
+    Translate a list of texts. Cached ones are answered from the cache,
+    the rest are sent to the backend in as few batches as it allows.
+    """
+    cache = get_cache()
+    backend = get_backend()
+
+    translations = [None] * len(texts)
+    missing = OrderedDict()
+    for i, text in enumerate(texts):
+        if not text.strip():
+            translations[i] = text.strip()
+            continue
+        translation = cache.get(text, lang_src, lang_tgt)
+        if translation is None:
+            missing.setdefault(text, []).append(i)
+        else:
+            translations[i] = translation
+
+    count("translation_texts", len(texts))
+    count("translation_cached", len(texts) - sum(len(i) for i in missing.values()))
+    for batch in split_batches(missing.keys(), backend.max_batch_chars, backend.batch_overhead):
+        count("translation_calls")
+        with timed("translation"):
+            batch_translations = backend.translate_batch(batch, lang_src, lang_tgt)
+        cache.put_many(list(zip(batch, batch_translations)), lang_src, lang_tgt)
+        for text, translation in zip(batch, batch_translations):
+            for i in missing[text]:
+                translations[i] = translation
+
+    return translations
+
+
+def translate(text: str, lang_src: str = "da", lang_tgt: str = "en") -> str:
+    """Translate a text, only asking the backend if it's not in the cache."""
+    return translate_many([text], lang_src, lang_tgt)[0]
+
+
+class TranslationStage:
+    """
+    Background worker which translates the text fields of parsed ads, so
+    parsing never waits on translation. Ads are translated in place in
+    batches of up to batch_size, or whatever arrived within max_wait
+    seconds, then handed to on_translated. With a fingerprint store, ads
+    matching one translated before reuse its translations instead. Ads
+    whose batch fails to translate are passed on in Danish, and counted
+    in failed. Any other error in a batch, e.g. from on_translated, drops
+    that batch but not the worker: it goes on with the next, and close()
+    raises the first error once every submitted ad is done.
+    """
+
+    def __init__(
+        self,
+        fields: List[str] = DEFAULT_FIELDS,
+        batch_size: int = 20,
+        max_wait: float = 1.0,
+        lang_src: str = "da",
+        lang_tgt: str = "en",
+        on_translated: Optional[Callable[[Dict], None]] = None,
+        fingerprints: Optional[FingerprintStore] = None,
+    ):
+        self.fields = fields
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.lang_src = lang_src
+        self.lang_tgt = lang_tgt
+        self.on_translated = on_translated
+        self.fingerprints = fingerprints
+        self.translated = 0
+        self.failed = 0
+        self.error: Optional[Exception] = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, ad: Dict) -> None:
+        """Queue an ad for translation."""
+        self.queue.put(ad)
+
+    def close(self) -> None:
+        """Translate whatever is still queued and stop the worker."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self) -> None:
+        closing = False
+        while not closing:
+            batch = [self.queue.get()]
+            deadline = time() + self.max_wait
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time(), 0)))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                closing = True
+                batch.pop()
+            if batch:
+                try:
+                    self._translate(batch)
+                    if self.on_translated is not None:
+                        for ad in batch:
+                            self.on_translated(ad)
+                except Exception as e:
+                    count("translation_failed")
+                    print(f"Failed to handle {len(batch)} ads: {type(e).__name__}: {e}")
+                    if self.error is None:
+                        self.error = e
+
+    def _translate(self, ads: List[Dict]) -> None:
+        if not self.fields:
+            return
+        if self.fingerprints is not None:
+            ads = self.fingerprints.reuse(ads, self.fields)
+        fields = [
+            (ad, field)
+            for ad in ads
+            for field in self.fields
+            if isinstance(ad.get(field), str)
+        ]
+        try:
+            translations = translate_many(
+                [ad[field] for ad, field in fields], self.lang_src, self.lang_tgt
+            )
+        except Exception as e:
+            # Keep the Danish text rather than lose the ads
+            self.failed += len(ads)
+            count("ads_untranslated", len(ads))
+            print(f"Failed to translate {len(ads)} ads: {type(e).__name__}: {e}")
+            if self.fingerprints is not None:
+                self.fingerprints.discard(ads)
+            return
+
+        for (ad, field), translation in zip(fields, translations):
+            ad[field] = translation
+        self.translated += len(ads)
+        if self.fingerprints is not None:
+            self.fingerprints.add(ads, self.fields)
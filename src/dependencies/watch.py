@@ -0,0 +1,219 @@
+"""
+Watch for new listings: poll the first results pages, newest first, on a
+schedule, and scrape, translate and filter only the ads not seen before,
+emitting the matches as soon as they're found.
+"""
+
+
+import json
+import random
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime
+from time import sleep
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from dependencies.fingerprint import FingerprintStore
+from dependencies.listing_index import ListingIndex, get_ad_id
+from dependencies.metrics import count, timed
+from dependencies.query_plan import compile_plan
+from dependencies.scraper import (
+    RESULTS_STRAINER,
+    get_ads_links,
+    get_page_url,
+    make_soup,
+    scrape_ads,
+)
+from dependencies.storage import to_typed_row
+from dependencies.translation import DEFAULT_FIELDS, TranslationStage
+from dependencies.writer import AD_SCHEMA
+
+
+DEFAULT_INTERVAL = 300
+DEFAULT_PAGES = 3
+# An ad that fails to scrape is tried again on the next polls, up to this
+MAX_ATTEMPTS = 3
+
+
+def get_watch_url(main_url: str, sort: str = "") -> str:
+    """Return the search URL with the sort parameter e.g. 'sort=newest' added."""
+    if not sort:
+        return main_url
+    separator = "&" if "?" in main_url else "?"
+    return f"{main_url}{separator}{sort}"
+
+
+def find_new_urls(watch_url: str, known: Set[str], max_pages: int = DEFAULT_PAGES) -> Tuple[List[str], int]:
+    """
+    Return the URLs of the ads not known yet on the first results pages,
+    and how many pages were fetched. With results sorted newest first,
+    paging stops at the first page showing a known ad, as every ad after it
+    is older.
+    """
+    new_urls = []
+    for page in range(max_pages):
+        page_url = get_page_url(watch_url, page)
+        links = get_ads_links(make_soup(page_url, parse_only=RESULTS_STRAINER), page_url)
+        new_links = [
+            url for url in links if get_ad_id(url) not in known and url not in new_urls
+        ]
+        new_urls += new_links
+        if not links or len(new_links) < len(links):
+            return new_urls, page + 1
+    return new_urls, max_pages
+
+
+class MatchSink(ABC):
+    """Where matching ads go, one at a time as soon as they're found."""
+
+    @abstractmethod
+    def emit(self, ad: Dict) -> None:
+        """Pass on a matching ad."""
+
+    def close(self) -> None:
+        pass
+
+
+class StdoutSink(MatchSink):
+    """Print a line per match."""
+
+    def emit(self, ad: Dict) -> None:
+        print(
+            f"[{datetime.now().strftime('%H:%M:%S')}] Match: {ad['full_address']}, "
+            f"{ad['size']} m², {ad['total_monthly_cost']} kr./month, "
+            f"available from {ad['available_from']}: {ad['url']}",
+            flush=True,
+        )
+
+
+class FileSink(MatchSink):
+    """Append each match to a JSON lines file, flushed right away."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def emit(self, ad: Dict) -> None:
+        self.file.write(json.dumps(ad, ensure_ascii=False, default=str) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def get_sink(output: str) -> MatchSink:
+    """A FileSink for a path, a StdoutSink for '-' or nothing."""
+    if not output or output == "-":
+        return StdoutSink()
+    return FileSink(output)
+
+
+class Watcher:
+    """
+    Poll the watch_urls every interval seconds (with some jitter) for ads
+    not in the listing index, scrape and translate them, hand them to on_scraped,
+    and emit the ones matching the filter options to the sink. The filters
+    are compiled again on every poll, so relative dates stay current.
+    """
+
+    def __init__(
+        self,
+        watch_urls: List[str],
+        filter_options: Dict,
+        listing_index: ListingIndex,
+        sink: MatchSink,
+        pages: int = DEFAULT_PAGES,
+        interval: float = DEFAULT_INTERVAL,
+        max_workers: int = 8,
+        translate_fields: List[str] = DEFAULT_FIELDS,
+        translation_batch_size: int = 20,
+        on_scraped: Optional[Callable[[List[Dict]], None]] = None,
+        on_poll: Optional[Callable[[], None]] = None,
+        fingerprints: Optional[FingerprintStore] = None,
+    ):
+        self.watch_urls = watch_urls
+        self.filter_options = filter_options
+        self.listing_index = listing_index
+        self.sink = sink
+        self.pages = pages
+        self.interval = interval
+        self.max_workers = max_workers
+        self.translate_fields = translate_fields
+        self.translation_batch_size = translation_batch_size
+        self.on_scraped = on_scraped
+        self.on_poll = on_poll
+        self.fingerprints = fingerprints
+        self.known = set(listing_index.get_known())
+        self.attempts = Counter()
+        self.matches = 0
+
+    def poll(self) -> int:
+        """Look for new ads once, returning how many matched."""
+        with timed("watch_poll"):
+            urls = []
+            for watch_url in self.watch_urls:
+                new_urls, pages = find_new_urls(watch_url, self.known, self.pages)
+                # A listing in several searches is only scraped once
+                found_ids = {get_ad_id(url) for url in urls}
+                urls += [url for url in new_urls if get_ad_id(url) not in found_ids]
+                count("watch_pages", pages)
+            count("watch_polls")
+            if not urls:
+                return 0
+
+            ads = list(scrape_ads(urls, self.max_workers))
+            translation_stage = TranslationStage(
+                self.translate_fields,
+                batch_size=self.translation_batch_size,
+                fingerprints=self.fingerprints,
+            )
+            for ad in ads:
+                translation_stage.submit(ad)
+            translation_stage.close()
+
+            scraped_urls = [ad["url"] for ad in ads]
+            for url in set(urls) - set(scraped_urls):
+                self.attempts[url] += 1
+                if self.attempts[url] >= MAX_ATTEMPTS:
+                    self.known.add(get_ad_id(url))
+            if not ads:
+                return 0
+            if self.on_scraped is not None:
+                self.on_scraped(ads)
+
+            plan = compile_plan(self.filter_options)
+            df = pd.DataFrame([to_typed_row(ad) for ad in ads], columns=AD_SCHEMA)
+            matches = plan.filter(df).to_dict("records")
+            for ad in matches:
+                self.sink.emit(ad)
+            # Only known once its match is out, so a failed poll scrapes it again
+            self.listing_index.mark_scraped(scraped_urls)
+            self.known.update(get_ad_id(url) for url in scraped_urls)
+            count("watch_new_ads", len(ads))
+            count("watch_matches", len(matches))
+        self.matches += len(matches)
+        return len(matches)
+
+    def run(self, polls: int = 0) -> None:
+        """Poll until stopped with Ctrl+C, or polls times if above 0."""
+        done = 0
+        try:
+            while True:
+                try:
+                    matches = self.poll()
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] Poll done, {matches} new matches.")
+                except Exception as e:
+                    count("watch_failed_polls")
+                    print(f"Failed to poll: {type(e).__name__}: {e}")
+                if self.on_poll is not None:
+                    self.on_poll()
+                done += 1
+                if polls > 0 and done >= polls:
+                    break
+                sleep(self.interval * random.uniform(0.9, 1.1))
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        finally:
+            self.sink.close()
@@ -0,0 +1,269 @@
+"""
+Work queue of ad URLs shared by any number of worker processes: discovery
+enqueues the URLs, each worker claims a batch at a time under a lease, and
+marks them done once the ads are saved. The lease of a worker that dies
+runs out after the visibility timeout, and its URLs are claimed again.
+"""
+
+
+import os
+import socket
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from time import sleep, time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from dependencies.listing_index import get_ad_id
+from dependencies.metrics import count
+from dependencies.scraper import scrape_ads
+
+
+DEFAULT_QUEUE_PATH = "../data/work_queue.sqlite"
+DEFAULT_VISIBILITY_TIMEOUT = 300
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+def get_worker_id() -> str:
+    """e.g. 'scraper-2-4711' for process 4711 on host scraper-2"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def get_task_id(url: str) -> str:
+    """The ad ID, so the same listing found by several searches is queued once."""
+    return get_ad_id(url) or url
+
+
+class WorkQueue(ABC):
+    """
+    Interface for work queues. A claimed URL stays hidden from other
+    workers until it's completed or failed, or its lease runs out.
+    """
+
+    @abstractmethod
+    def enqueue(self, urls: Iterable[str], source: str = "") -> int:
+        """
+        Queue URLs, returning how many were queued. A URL already waiting
+        is not queued twice; one done or failed before is queued again.
+        """
+
+    @abstractmethod
+    def claim(self, worker: str, batch_size: int) -> List[str]:
+        """Lease up to batch_size URLs to a worker."""
+
+    @abstractmethod
+    def complete(self, urls: Iterable[str], worker: str) -> None:
+        """Mark URLs done, their ads being saved."""
+
+    @abstractmethod
+    def fail(self, urls: Iterable[str], worker: str) -> None:
+        """Release URLs for another attempt, or give up on them after max_attempts."""
+
+    @abstractmethod
+    def renew(self, worker: str) -> None:
+        """Restart the leases a worker holds, as if just claimed."""
+
+    @abstractmethod
+    def is_drained(self, worker: Optional[str] = None) -> bool:
+        """
+        Whether no URL is left to claim now or after a lease runs out, not
+        counting the URLs leased to worker, if given.
+        """
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Return how many URLs are pending, leased, done and failed."""
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """
+    Work queue in a SQLite file, for workers on one host or sharing a local
+    disk. Claims are made in an immediate transaction, so two workers never
+    lease the same URL at once.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_QUEUE_PATH,
+        visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Transactions are begun explicitly, waiting for other workers' to end
+        self.connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                source TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_expires REAL,
+                enqueued REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_expires)"
+        )
+
+    def enqueue(self, urls: Iterable[str], source: str = "") -> int:
+        now = time()
+        rows = [(get_task_id(url), url, source, now, now) for url in urls]
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            before = self.connection.total_changes
+            self.connection.executemany(
+                """
+                INSERT INTO tasks (task_id, url, source, enqueued, updated)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (task_id) DO UPDATE SET
+                    url = excluded.url,
+                    source = excluded.source,
+                    status = 'pending',
+                    attempts = 0,
+                    enqueued = excluded.enqueued,
+                    updated = excluded.updated
+                WHERE tasks.status IN ('done', 'failed')
+                """,
+                rows,
+            )
+            added = self.connection.total_changes - before
+            self.connection.execute("COMMIT")
+        count("queue_enqueued", added)
+        return added
+
+    def claim(self, worker: str, batch_size: int) -> List[str]:
+        now = time()
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            # URLs whose lease ran out on their last attempt are given up on
+            self.connection.execute(
+                "UPDATE tasks SET status = 'failed', worker = NULL, updated = ? "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            rows = self.connection.execute(
+                "SELECT task_id, url FROM tasks "
+                "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY enqueued LIMIT ?",
+                (now, batch_size),
+            ).fetchall()
+            self.connection.executemany(
+                "UPDATE tasks SET status = 'leased', attempts = attempts + 1, "
+                "worker = ?, lease_expires = ?, updated = ? WHERE task_id = ?",
+                [(worker, now + self.visibility_timeout, now, task_id) for task_id, _ in rows],
+            )
+            self.connection.execute("COMMIT")
+        count("queue_claimed", len(rows))
+        return [url for _, url in rows]
+
+    def complete(self, urls: Iterable[str], worker: str) -> None:
+        now = time()
+        task_ids = [(now, get_task_id(url)) for url in urls]
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany(
+                "UPDATE tasks SET status = 'done', worker = NULL, updated = ? "
+                "WHERE task_id = ?",
+                task_ids,
+            )
+            self.connection.execute("COMMIT")
+        count("queue_completed", len(task_ids))
+
+    def fail(self, urls: Iterable[str], worker: str) -> None:
+        now = time()
+        task_ids = [(self.max_attempts, now, get_task_id(url), worker) for url in urls]
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' "
+                "ELSE 'pending' END, worker = NULL, lease_expires = NULL, updated = ? "
+                "WHERE task_id = ? AND status = 'leased' AND worker = ?",
+                task_ids,
+            )
+            self.connection.execute("COMMIT")
+        count("queue_failed", len(task_ids))
+
+    def renew(self, worker: str) -> None:
+        now = time()
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute(
+                "UPDATE tasks SET lease_expires = ?, updated = ? "
+                "WHERE status = 'leased' AND worker = ?",
+                (now + self.visibility_timeout, now, worker),
+            )
+            self.connection.execute("COMMIT")
+
+    def is_drained(self, worker: Optional[str] = None) -> bool:
+        with self._lock:
+            (left,) = self.connection.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status = 'pending' "
+                "OR (status = 'leased' AND worker IS NOT ?)",
+                (worker,),
+            ).fetchone()
+        return left == 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT status, COUNT(*) FROM tasks GROUP BY status"
+            ).fetchall()
+        stats = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+        stats.update(dict(rows))
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+
+def scrape_queued_ads(
+    queue: WorkQueue,
+    worker: str,
+    batch_size: int = 20,
+    max_workers: int = 8,
+    poll_interval: float = 5.0,
+) -> Iterator[Dict]:
+    """
+    Claim batches of URLs from the queue and yield their ads as they're
+    scraped, releasing the ones that fail for another attempt. The caller
+    completes the URLs once the ads are saved. While the queue is empty but
+    other workers hold leases, wait for them to finish or run out, and stop
+    once nothing is left.
+
+    The URLs yielded but not yet completed are still leased to this worker,
+    so they don't keep it waiting, and their leases are renewed while it
+    waits, so it doesn't claim and scrape them again.
+    """
+    while True:
+        urls = queue.claim(worker, batch_size)
+        if not urls:
+            if queue.is_drained(worker):
+                return
+            queue.renew(worker)
+            sleep(poll_interval)
+            continue
+
+        scraped_urls = set()
+        for ad in scrape_ads(urls, max_workers):
+            scraped_urls.add(ad["url"])
+            yield ad
+        failed_urls = [url for url in urls if url not in scraped_urls]
+        if failed_urls:
+            queue.fail(failed_urls, worker)
@@ -0,0 +1,236 @@
+"""Write scraped ads to disk as they come, with a checkpoint to resume from."""
+
+
+import csv
+import io
+import os
+from datetime import date
+from time import time
+from typing import Callable, Dict, List, Optional, Set
+
+from dependencies.general import add_timestamp
+from dependencies.metrics import count, timed
+from dependencies.storage import get_format, read_urls, write_part
+
+
+AD_SCHEMA = [
+    "url",
+    "creation_date",
+    "scraped_date",
+    "full_address",
+    "street",
+    "zip_code",
+    "district",
+    "housing_type",
+    "size",
+    "number_of_rooms",
+    "floor",
+    "rental_period",
+    "available_from",
+    "summary",
+    "monthly_rent",
+    "aconto",
+    "deposit",
+    "prepaid_rent",
+    "occupancy_price",
+    "total_monthly_cost",
+    "months_of_prepaid_rent",
+    "months_of_deposit",
+    "is_furnished",
+    "is_shareable",
+    "pets_allowed",
+    "has_elevator",
+    "students_only",
+    "has_balcony",
+    "has_parking",
+    "duplicate_of",
+]
+DATE_FORMAT = "%m/%d/%Y"
+
+
+def format_row(ad: Dict) -> Dict:
+    """Return an ad with dates as strings, ready for writing."""
+    row = {}
+    for key in AD_SCHEMA:
+        value = ad.get(key)
+        if isinstance(value, date):
+            value = value.strftime(DATE_FORMAT)
+        row[key] = "" if value is None else value
+    return row
+
+
+def read_csv_urls(path: str) -> Set[str]:
+    """
+    Return the URLs of the ads in a CSV output. A last row left unfinished
+    by a crash is cut off, so appending starts on a new row.
+    """
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        content = f.read()
+    lines = io.StringIO(content, newline="")
+    ends = []
+    rows = []
+    reader = csv.reader(iter(lines.readline, ""))
+    try:
+        for row in reader:
+            rows.append(row)
+            ends.append(lines.tell())
+    except csv.Error:
+        # An unclosed quote at the very end
+        rows.append(None)
+    if rows and not content.endswith("\n"):
+        rows.pop()
+        ends = ends[:len(rows)]
+        end = ends[-1] if ends else 0
+        with open(path, "rb+") as f:
+            f.truncate(len(content[:end].encode("utf-8")))
+    return {row[0] for row in rows[1:] if row and row[0]}
+
+
+def upgrade_csv_header(path: str) -> bool:
+    """
+    Rewrite a CSV output saved with an older AD_SCHEMA in the current one,
+    so rows appended to it line up with the header. Columns the older
+    schema lacked are left empty. Returns whether it was rewritten.
+    """
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames == AD_SCHEMA:
+            return False
+        rows = list(reader)
+    # Written aside and renamed, so a crash leaves one file or the other
+    with open(path + ".tmp", "w", newline="", encoding="utf-8") as f:
+        dict_writer = csv.DictWriter(f, AD_SCHEMA, restval="", extrasaction="ignore")
+        dict_writer.writeheader()
+        dict_writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    return True
+
+
+class AdWriter:
+    """
+    Append ads to a CSV file in batches of batch_size. After each batch is
+    flushed, the URLs in it are added to a checkpoint file next to the
+    output path and the ads are passed to on_flush. If a run dies, the next
+    run with the same output path resumes the same file and can skip
+    completed_urls: the checkpointed URLs, and any saved by the dead run
+    after its last checkpoint. A CSV file saved with older columns is
+    rewritten in the current ones first. close() removes the checkpoint
+    once the run is complete.
+
+    An output path ending in .parquet or .feather is a typed dataset folder
+    instead, shared by all runs, with one part file per batch. With
+    partition_by_date, parts go in a subfolder per scraped date.
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        timestr: str,
+        batch_size: int = 20,
+        on_flush: Optional[Callable[[List[Dict]], None]] = None,
+        partition_by_date: bool = False,
+    ):
+        self.checkpoint_path = output_path.rstrip("/") + ".checkpoint"
+        self.output_format = get_format(output_path)
+        self.timestr = timestr
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.partition_by_date = partition_by_date
+        self.buffer = []
+        self.completed_urls = set()
+        self.written = 0
+        self.parts = 0
+
+        if os.path.isfile(self.checkpoint_path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                # The output path, then when the run began, which older checkpoints lack
+                header = f.readline().rstrip("\n").split("\t")
+                self.completed_urls = {line.strip() for line in f if line.strip()}
+            self.output_path = header[0]
+            self.started = float(header[1]) if len(header) > 1 else 0.0
+            self.resumed = os.path.exists(self.output_path)
+            if self.resumed:
+                if self.output_format is None:
+                    self.completed_urls |= read_csv_urls(self.output_path)
+                    upgrade_csv_header(self.output_path)
+                else:
+                    self.completed_urls |= read_urls(self.output_path, self.started)
+        else:
+            self.started = time()
+            if self.output_format is None:
+                self.output_path = add_timestamp(output_path, timestr)
+            else:
+                self.output_path = output_path
+            self.resumed = False
+
+        if self.output_format is None:
+            self.output_file = open(
+                self.output_path,
+                "a" if self.resumed else "w",
+                newline="",
+                encoding="utf-8",
+            )
+            self.dict_writer = csv.DictWriter(self.output_file, AD_SCHEMA)
+        if not self.resumed:
+            self.completed_urls = set()
+            if self.output_format is None:
+                self.dict_writer.writeheader()
+                self.output_file.flush()
+            else:
+                os.makedirs(self.output_path, exist_ok=True)
+            with open(self.checkpoint_path, "w", encoding="utf-8") as f:
+                f.write(f"{self.output_path}\t{self.started}\n")
+
+        self.checkpoint_file = open(self.checkpoint_path, "a", encoding="utf-8")
+
+    def write(self, ad: Dict) -> None:
+        """Buffer an ad, flushing when the batch is full."""
+        self.buffer.append(ad)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered ads to disk and checkpoint them."""
+        if not self.buffer:
+            return
+        with timed("write", format=self.output_format or "csv"):
+            if self.output_format is None:
+                self.dict_writer.writerows(format_row(ad) for ad in self.buffer)
+                self.output_file.flush()
+                os.fsync(self.output_file.fileno())
+            else:
+                write_part(
+                    self.buffer,
+                    self.output_path,
+                    f"part-{self.timestr}-{self.parts:05d}",
+                    self.partition_by_date,
+                )
+                self.parts += 1
+        count("ads_written", len(self.buffer))
+
+        for ad in self.buffer:
+            self.checkpoint_file.write(ad["url"] + "\n")
+            self.completed_urls.add(ad["url"])
+        self.checkpoint_file.flush()
+        os.fsync(self.checkpoint_file.fileno())
+
+        self.written += len(self.buffer)
+        if self.on_flush is not None:
+            self.on_flush(self.buffer)
+        self.buffer = []
+
+    def close(self, complete: bool = True) -> None:
+        """
+        Flush what's left and, if the run is complete, drop the checkpoint.
+        Otherwise it's kept for the next run to resume from.
+        """
+        try:
+            self.flush()
+        finally:
+            if self.output_format is None:
+                self.output_file.close()
+            self.checkpoint_file.close()
+        if complete:
+            os.remove(self.checkpoint_path)
@@ -2,11 +2,32 @@
 
 
 import argparse
-import csv
+import os
 import sys
 from datetime import datetime
+from typing import Dict, List
 
+from dependencies.archive import PageArchive
+from dependencies.database import ListingDatabase
+from dependencies.fingerprint import FingerprintStore
 from dependencies.general import *
+from dependencies.listing_index import ListingIndex, select_urls_to_scrape
+from dependencies.metrics import reset_metrics, save_report, timed
+from dependencies.parsing import configure_parser
+from dependencies.pipeline import (
+    DEFAULT_PARSE_WORKERS,
+    DEFAULT_QUEUE_SIZE,
+    parse_pages,
+    scrape_ads_pipeline,
+)
+from dependencies.query_plan import compile_batch, compile_plan
+from dependencies.scheduler import Scheduler
+from dependencies.session import configure_session, get_scheduler
+from dependencies.storage import load_ads
+from dependencies.watch import Watcher, get_sink, get_watch_url
+from dependencies.work_queue import SQLiteWorkQueue, get_worker_id, scrape_queued_ads
+from dependencies.translation import TranslationStage, configure_translation
+from dependencies.writer import AdWriter
 from dependencies.scraper import *
 from dependencies.filter import *
 
@@ -29,6 +50,31 @@ parser.add_argument(
     default="../config/scraper_config.json",
 )
 
+parser.add_argument(
+    "--since",
+    type=str,
+    required=False,
+    help="With reparse, only use pages archived from this YYYY-MM-DD date",
+    default=None,
+)
+
+parser.add_argument(
+    "--until",
+    type=str,
+    required=False,
+    help="With reparse, only use pages archived until this YYYY-MM-DD date",
+    default=None,
+)
+
+parser.add_argument(
+    "--input",
+    type=str,
+    nargs="+",
+    required=False,
+    help="With import, CSV files or Parquet/Feather datasets of earlier runs",
+    default=[],
+)
+
 parser.add_argument(
     "--filter_config",
     type=str,
@@ -37,13 +83,82 @@ parser.add_argument(
     default="../config/filter_config.json",
 )
 
+parser.add_argument(
+    "--filter_profiles",
+    type=str,
+    required=False,
+    help="With batch, a folder of filter configurations, one per person",
+    default="../config/filter_profiles",
+)
+
+parser.add_argument(
+    "--explain",
+    action="store_true",
+    help="Print the filter query plan, with rows kept and time per filter",
+)
+
+parser.add_argument(
+    "--polls",
+    type=int,
+    required=False,
+    help="With watch, stop after this many polls, 0 to keep watching",
+    default=0,
+)
+
+parser.add_argument(
+    "--worker_id",
+    type=str,
+    required=False,
+    help="With worker, the name its leases are held under",
+    default=get_worker_id(),
+)
+
+parser.add_argument(
+    "--metrics_path",
+    type=str,
+    required=False,
+    help="Folder for the run reports and the Prometheus metrics file",
+    default="../data/metrics",
+)
+
+parser.add_argument(
+    "--throughput_alert",
+    type=float,
+    required=False,
+    help="Warn when scrape ads/sec drops by more than this fraction of recent runs",
+    default=0.2,
+)
+
 
-@timing
 def main(args) -> None:
-    """Main method to either scrape or filter scraped data."""
+    """
+    Main method to either scrape or filter scraped data, then report where
+    the time went.
+    """
     timestr = datetime.now().strftime("%Y_%m_%d-%I_%M_%S_%p")
-    
-    if args.mode == "scrape" or args.mode == "full":
+    # Workers started together each save their own run report
+    report_name = f"{timestr}-{args.worker_id}" if args.mode == "worker" else timestr
+    reset_metrics()
+    try:
+        run(args, timestr)
+    finally:
+        report = save_report(args.metrics_path, report_name, args.mode, args.throughput_alert)
+        print("\nTime per stage: ")
+        print("# -------------------------------------- #")
+        for stage, stats in report["stages"].items():
+            print(
+                f"\t* {stage}: {stats['count']} x {stats['mean_ms']} ms "
+                f"(p99 {stats['p99_ms']} ms) = {round(stats['seconds'], 2)}s"
+            )
+        print(f"Elapsed time: {round(report['seconds'] / 60, 2):,} min")
+        for alert in report["alerts"]:
+            print(f"WARNING: {alert}")
+        print(f"Run report saved to {args.metrics_path}")
+
+
+def run(args, timestr: str) -> None:
+    """Either scrape or filter scraped data, depending on the mode."""
+    if args.mode in ["scrape", "full", "reparse", "import", "watch", "discover", "worker"]:
         scraper_config_options = load_configuration_file(args.scraper_config)
 
         if scraper_config_options is False:
@@ -59,53 +174,343 @@ def main(args) -> None:
                 print(f"\t* {option}: {scraper_config_options[option]}")
             print()
             main_url = scraper_config_options["MAIN_URL"]
+            # One search, or a list of them e.g. one per region
+            main_urls = main_url if isinstance(main_url, list) else [main_url]
             results_pages = scraper_config_options["RESULTS_PAGES"]
             scraper_output_path = scraper_config_options["OUTPUT_PATH"]
+            max_concurrent_requests = scraper_config_options.get(
+                "MAX_CONCURRENT_REQUESTS", 8
+            )
+            http_timeout = scraper_config_options.get("HTTP_TIMEOUT", [5, 30])
+            rate_limit = scraper_config_options.get("RATE_LIMIT", 5)
+            max_rate_limit = scraper_config_options.get("MAX_RATE_LIMIT", 50)
+            target_latency = scraper_config_options.get("TARGET_LATENCY", 2.0)
+            max_retries = scraper_config_options.get("MAX_RETRIES", 4)
+            translation_cache_path = scraper_config_options.get(
+                "TRANSLATION_CACHE_PATH", "../data/translation_cache.sqlite"
+            )
+            translation_cache_size = scraper_config_options.get(
+                "TRANSLATION_CACHE_SIZE", 100000
+            )
+            translation_backend = scraper_config_options.get(
+                "TRANSLATION_BACKEND", "google"
+            )
+            translate_fields = scraper_config_options.get(
+                "TRANSLATE_FIELDS", ["floor", "housing_type", "rental_period", "summary"]
+            )
+            translation_batch_size = scraper_config_options.get(
+                "TRANSLATION_BATCH_SIZE", 20
+            )
+            incremental = scraper_config_options.get("INCREMENTAL", "no")
+            revalidate_known = scraper_config_options.get("REVALIDATE_KNOWN", "no")
+            listing_index_path = scraper_config_options.get(
+                "LISTING_INDEX_PATH", "../data/listing_index.sqlite"
+            )
+            write_batch_size = scraper_config_options.get("WRITE_BATCH_SIZE", 20)
+            parser_backend = scraper_config_options.get("PARSER_BACKEND", "lxml")
+            parser_workers = scraper_config_options.get("PARSER_WORKERS", DEFAULT_PARSE_WORKERS)
+            page_queue_size = scraper_config_options.get("PAGE_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)
+            archive_pages = scraper_config_options.get("ARCHIVE_PAGES", "no")
+            archive_path = scraper_config_options.get("ARCHIVE_PATH", "../data/archive")
+            partition_by_date = scraper_config_options.get("PARTITION_BY_DATE", "no")
+            save_to_database = scraper_config_options.get("SAVE_TO_DATABASE", "no")
+            database_path = scraper_config_options.get(
+                "DATABASE_PATH", "../data/listings.sqlite"
+            )
+            watch_sort = scraper_config_options.get("WATCH_SORT", "")
+            watch_pages = scraper_config_options.get("WATCH_PAGES", 3)
+            watch_interval = scraper_config_options.get("WATCH_INTERVAL", 300)
+            watch_output = scraper_config_options.get("WATCH_OUTPUT", "-")
+            queue_path = scraper_config_options.get(
+                "QUEUE_PATH", "../data/work_queue.sqlite"
+            )
+            queue_batch_size = scraper_config_options.get("QUEUE_BATCH_SIZE", 20)
+            queue_visibility_timeout = scraper_config_options.get(
+                "QUEUE_VISIBILITY_TIMEOUT", 300
+            )
+            queue_max_attempts = scraper_config_options.get("QUEUE_MAX_ATTEMPTS", 5)
+            deduplicate = scraper_config_options.get("DEDUPLICATE", "no")
+            fingerprint_path = scraper_config_options.get(
+                "FINGERPRINT_PATH", "../data/fingerprints.sqlite"
+            )
+            duplicate_similarity = scraper_config_options.get("DUPLICATE_SIMILARITY", 0.8)
 
-            # Scrape main page for URL list to parse
+            # Keep every ad in the listing database, updating known ones and
+            # their price history
             # -------------------------------------- #
-            urls_list = scrape_ads_urls(main_url, results_pages)
+            database = None
+            if save_to_database == "yes" or args.mode == "import":
+                database = ListingDatabase(database_path)
+
+            if args.mode == "import":
+                for input_path in args.input:
+                    ads = load_ads(input_path).to_dict("records")
+                    changes = database.upsert(ads)
+                    print(f"{len(ads)} ads imported from {input_path}, {changes} new or changed.")
+                database.close()
+                return
+
+            # Share one pool of keep-alive connections between all requests,
+            # paced per host, keeping a copy of every page fetched in the archive
+            # -------------------------------------- #
+            archive = None
+            if archive_pages == "yes" or args.mode == "reparse":
+                archive = PageArchive(archive_path)
+            configure_session(
+                pool_size=max_concurrent_requests,
+                timeout=http_timeout,
+                archive=archive if args.mode != "reparse" else None,
+                scheduler=Scheduler(
+                    rate=rate_limit,
+                    max_rate=max_rate_limit,
+                    max_concurrency=max_concurrent_requests,
+                    target_latency=target_latency,
+                    max_retries=max_retries,
+                ),
+            )
+            configure_parser(parser_backend)
+            translation_cache = configure_translation(
+                translation_cache_path,
+                translation_cache_size,
+                backend=translation_backend,
+            )
 
-            # Iterate thorugh all the ads
+            # Recognize unchanged and reposted ads by their content, reusing
+            # the translations of the ad first seen
             # -------------------------------------- #
-            ads_list = []
+            fingerprint_store = None
+            if deduplicate == "yes":
+                fingerprint_store = FingerprintStore(fingerprint_path, duplicate_similarity)
 
-            i = 1
-            for url in tqdm(urls_list):
-                print(f"No. {i}: {url}")
-                ad = scrape_ad(url)
-                ads_list.append(ad)
-                i += 1
+            if args.mode == "watch":
+                # Poll the newest listings, only scraping and filtering the
+                # ones not seen before, until stopped
+                # -------------------------------------- #
+                filter_config_options = load_configuration_file(args.filter_config)
+                if filter_config_options is False:
+                    print(
+                        "\nMissing, empty or wrongly named filter config file. \
+                        Program will terminate."
+                    )
+                    sys.exit()
+                listing_index = ListingIndex(listing_index_path)
+                watcher = Watcher(
+                    [get_watch_url(url, watch_sort) for url in main_urls],
+                    filter_config_options,
+                    listing_index,
+                    get_sink(watch_output),
+                    pages=watch_pages,
+                    interval=watch_interval,
+                    max_workers=max_concurrent_requests,
+                    translate_fields=translate_fields,
+                    translation_batch_size=translation_batch_size,
+                    on_scraped=database.upsert if database is not None else None,
+                    on_poll=lambda: save_report(
+                        args.metrics_path, timestr, args.mode, args.throughput_alert
+                    ),
+                    fingerprints=fingerprint_store,
+                )
+                print(f"Watching {', '.join(watcher.watch_urls)} every {watch_interval}s.")
+                watcher.run(args.polls)
+                listing_index.close()
+                if archive is not None:
+                    archive.close()
+                if database is not None:
+                    database.close()
+                if fingerprint_store is not None:
+                    print(f"Fingerprints: {fingerprint_store.stats()}")
+                    fingerprint_store.close()
+                translation_cache.close()
+                print(f"{watcher.matches} matches found.")
+                return
 
-            # Can't save datetime properly. Make strings
-            for ad in ads_list:
-                creation_date = ad["creation_date"]
-                ad["creation_date"] = creation_date.strftime("%m/%d/%Y")
+            if args.mode == "reparse":
+                # Re-parse the archived ad pages without going online
+                # -------------------------------------- #
+                ad_writer = AdWriter(
+                    add_timestamp(scraper_output_path, "reparse"),
+                    timestr,
+                    batch_size=write_batch_size,
+                    on_flush=database.upsert if database is not None else None,
+                    partition_by_date=partition_by_date == "yes",
+                )
+                scraper_output_path = ad_writer.output_path
+                pages = archive.iter_pages(
+                    since=args.since, until=args.until, url_pattern="%-id-%"
+                )
+                ads = parse_pages(pages, parser_workers)
+            elif args.mode == "worker":
+                # Scrape the ads discovered into the work queue a batch at a
+                # time, marking them done once saved, until none are left
+                # -------------------------------------- #
+                work_queue = SQLiteWorkQueue(
+                    queue_path, queue_visibility_timeout, queue_max_attempts
+                )
+                if incremental == "yes":
+                    listing_index = ListingIndex(listing_index_path)
 
-                scraped_date = ad["scraped_date"]
-                ad["scraped_date"] = scraped_date.strftime("%m/%d/%Y")
+                def on_flush(ads: List[Dict]) -> None:
+                    urls = [ad["url"] for ad in ads]
+                    if incremental == "yes":
+                        listing_index.mark_scraped(urls)
+                    if database is not None:
+                        database.upsert(ads)
+                    work_queue.complete(urls, args.worker_id)
 
-                available_from = ad["available_from"]
-                ad["available_from"] = available_from.strftime("%m/%d/%Y")
+                ad_writer = AdWriter(
+                    add_timestamp(scraper_output_path, args.worker_id),
+                    timestr,
+                    batch_size=write_batch_size,
+                    on_flush=on_flush,
+                    partition_by_date=partition_by_date == "yes",
+                )
+                scraper_output_path = ad_writer.output_path
+                print(f"Worker {args.worker_id} claiming from {queue_path}: {work_queue.stats()}")
+                ads = scrape_queued_ads(
+                    work_queue,
+                    args.worker_id,
+                    batch_size=queue_batch_size,
+                    max_workers=max_concurrent_requests,
+                )
+            else:
+                # Scrape main pages for URL list to parse
+                # -------------------------------------- #
+                urls_by_search = {}
+                discovery_complete = True
+                for url in main_urls:
+                    urls_by_search[url], complete = scrape_ads_urls(
+                        url, results_pages, max_concurrent_requests
+                    )
+                    discovery_complete = discovery_complete and complete
+                urls_list = set().union(*urls_by_search.values())
 
-            keys = ads_list[0].keys()
+                # Only scrape listings we haven't captured in earlier runs
+                # -------------------------------------- #
+                if incremental == "yes":
+                    listing_index = ListingIndex(listing_index_path)
+                    urls_list, listing_counts = select_urls_to_scrape(
+                        urls_list,
+                        listing_index,
+                        revalidate_known=revalidate_known == "yes",
+                        max_workers=max_concurrent_requests,
+                        discovery_complete=discovery_complete,
+                    )
+                    print(
+                        f"Listings: {listing_counts['new']} new, "
+                        f"{listing_counts['changed']} changed, "
+                        f"{listing_counts['unchanged']} unchanged, "
+                        f"{listing_counts['removed']} removed."
+                    )
+                    if not discovery_complete:
+                        print("Not every results page was scraped, so none were marked removed.")
 
-            # Save the output to a CSV file. You can view it in Excel later
+                if args.mode == "discover":
+                    # Leave the scraping to the workers
+                    # -------------------------------------- #
+                    work_queue = SQLiteWorkQueue(
+                        queue_path, queue_visibility_timeout, queue_max_attempts
+                    )
+                    to_scrape = set(urls_list)
+                    for search_url, urls in urls_by_search.items():
+                        queued = work_queue.enqueue(
+                            [url for url in urls if url in to_scrape], source=search_url
+                        )
+                        print(f"{queued} ads queued from {search_url}")
+                    print(f"Queue: {work_queue.stats()}")
+                    work_queue.close()
+                    if incremental == "yes":
+                        listing_index.close()
+                    if archive is not None:
+                        archive.close()
+                    if database is not None:
+                        database.close()
+                    if fingerprint_store is not None:
+                        fingerprint_store.close()
+                    return
+
+                # Save each ad to a CSV file as soon as it's ready, resuming
+                # the last run if it didn't finish. You can view it in Excel later
+                # -------------------------------------- #
+                def on_flush(ads: List[Dict]) -> None:
+                    if incremental == "yes":
+                        listing_index.mark_scraped([ad["url"] for ad in ads])
+                    if database is not None:
+                        database.upsert(ads)
+
+                ad_writer = AdWriter(
+                    scraper_output_path,
+                    timestr,
+                    batch_size=write_batch_size,
+                    on_flush=on_flush,
+                    partition_by_date=partition_by_date == "yes",
+                )
+                scraper_output_path = ad_writer.output_path
+                if ad_writer.resumed:
+                    print(
+                        f"Resuming {scraper_output_path}: "
+                        f"{len(ad_writer.completed_urls)} ads already saved."
+                    )
+                    urls_list = [
+                        url for url in urls_list if url not in ad_writer.completed_urls
+                    ]
+
+                # Scrape all the ads, several at a time, parsing them in
+                # PARSER_WORKERS processes if set
+                # -------------------------------------- #
+                if parser_workers > 0:
+                    ads = scrape_ads_pipeline(
+                        urls_list,
+                        fetch_workers=max_concurrent_requests,
+                        parse_workers=parser_workers,
+                        queue_size=page_queue_size,
+                    )
+                else:
+                    ads = scrape_ads(urls_list, max_concurrent_requests)
+
+            # Translate the ads in batches in the background meanwhile
             # -------------------------------------- #
-            scraper_output_path = (
-                (".").join(scraper_output_path.split(".")[:-1])
-                + "_"
-                + timestr
-                + "."
-                + scraper_output_path.split(".")[-1]
+            translation_stage = TranslationStage(
+                translate_fields,
+                batch_size=translation_batch_size,
+                on_translated=ad_writer.write,
+                fingerprints=fingerprint_store,
             )
-
-            with open(
-                scraper_output_path, "w", newline="", encoding="utf-8"
-            ) as output_file:
-                dict_writer = csv.DictWriter(output_file, keys)
-                dict_writer.writeheader()
-                dict_writer.writerows(ads_list)
+            for ad in ads:
+                translation_stage.submit(ad)
+            translation_error = None
+            try:
+                translation_stage.close()
+            except Exception as e:
+                translation_error = e
+            # Some ads may not have been saved, so keep the checkpoint to resume from
+            ad_writer.close(complete=translation_error is None)
+            if args.mode == "worker":
+                print(f"Queue: {work_queue.stats()}")
+                work_queue.close()
+            if incremental == "yes" and args.mode != "reparse":
+                listing_index.close()
+            if archive is not None:
+                archive.close()
+            if database is not None:
+                database.close()
+            print(f"Requests: {get_scheduler().stats()}")
+            print(f"Translation cache: {translation_cache.stats()}")
+            translation_cache.close()
+            if translation_stage.failed:
+                print(
+                    f"{translation_stage.failed} ads failed to translate and were "
+                    f"saved in Danish, so filters on English values will skip them."
+                )
+            if fingerprint_store is not None:
+                print(f"Fingerprints: {fingerprint_store.stats()}")
+                fingerprint_store.close()
+            print(f"{ad_writer.written} ads saved to {scraper_output_path}")
+            if translation_error is not None:
+                print(
+                    f"Failed to save every ad: {type(translation_error).__name__}: "
+                    f"{translation_error}. Run again to resume {scraper_output_path}."
+                )
+                sys.exit(1)
 
     if args.mode == "filter" or args.mode == "full":
         filter_config_options = load_configuration_file(args.filter_config)
@@ -127,26 +532,90 @@ def main(args) -> None:
             filter_input_path = filter_config_options["INPUT_PATH"]
             if args.mode == "full":
                 filter_input_path = scraper_output_path
-            filter_output_path = filter_config_options["OUTPUT_PATH"]
-            
-            filter_output_path = (
-                (".").join(filter_output_path.split(".")[:-1])
-                + "_"
-                + timestr
-                + "."
-                + filter_output_path.split(".")[-1]
+            filter_output_path = add_timestamp(
+                filter_config_options["OUTPUT_PATH"], timestr
             )
 
-            df = pd.read_csv(filter_input_path)
-            filtered_data = filter_data(df, filter_config_options)
+            filter_chunk_size = filter_config_options.get("CHUNK_SIZE", 100000)
+
+            # Compile the filters into a plan and run it over the input
+            # chunk by chunk, so only the matching listings are kept in memory
+            # -------------------------------------- #
+            query_plan = compile_plan(filter_config_options)
+            with timed("filter"):
+                filtered_data = query_plan.execute(filter_input_path, filter_chunk_size)
+            print(
+                f"\nSelection reduced from {query_plan.rows_read} "
+                f"to {filtered_data.shape[0]} listings."
+            )
+            if args.explain:
+                print()
+                print(query_plan.explain())
 
             # Save the output to an Excel file
             # -------------------------------------- #
             with pd.ExcelWriter(filter_output_path) as writer:
                 filtered_data.to_excel(writer, sheet_name="Filtered Data")
 
-    if args.mode not in ["scrape", "filter", "full"]:
-        print(f"Mode needs to be either 'scrape', 'filter' or 'full'. Detected '{args.mode}'.")
+    if args.mode == "batch":
+        filter_profiles = {}
+        if os.path.isdir(args.filter_profiles):
+            for file_name in sorted(os.listdir(args.filter_profiles)):
+                if file_name.endswith(".json"):
+                    profile_options = load_configuration_file(
+                        os.path.join(args.filter_profiles, file_name)
+                    )
+                    if profile_options is not False:
+                        filter_profiles[file_name[:-len(".json")]] = profile_options
+
+        if not filter_profiles:
+            print(
+                f"\nNo filter profiles found in {args.filter_profiles}. \
+                Program will terminate."
+            )
+            sys.exit()
+
+        # Profiles reading the same input share one pass over it, each
+        # filter shared between profiles being evaluated once
+        # -------------------------------------- #
+        profiles_by_input = {}
+        for name, profile_options in filter_profiles.items():
+            profiles_by_input.setdefault(profile_options["INPUT_PATH"], {})[name] = profile_options
+
+        for filter_input_path, profiles in profiles_by_input.items():
+            print(f"\nFiltering {filter_input_path} for {len(profiles)} profiles: ")
+            print("# -------------------------------------- #")
+            batch_plan = compile_batch(profiles)
+            with timed("filter"):
+                filtered_data = batch_plan.execute(
+                    filter_input_path,
+                    max(p.get("CHUNK_SIZE", 100000) for p in profiles.values()),
+                )
+            if args.explain:
+                print(batch_plan.explain())
+                print()
+
+            # Save each profile's output to its own Excel file
+            # -------------------------------------- #
+            for name, profile_options in profiles.items():
+                filter_output_path = add_timestamp(
+                    profile_options["OUTPUT_PATH"], f"{name}_{timestr}"
+                )
+                with pd.ExcelWriter(filter_output_path) as writer:
+                    filtered_data[name].to_excel(writer, sheet_name="Filtered Data")
+                print(
+                    f"\t* {name}: {filtered_data[name].shape[0]} listings "
+                    f"saved to {filter_output_path}"
+                )
+
+    if args.mode not in [
+        "scrape", "filter", "full", "reparse", "batch", "import", "watch", "discover", "worker"
+    ]:
+        print(
+            "Mode needs to be either 'scrape', 'filter', 'full', 'reparse', "
+            "'batch', 'import', 'watch', 'discover' or 'worker'. "
+            f"Detected '{args.mode}'."
+        )
         sys.exit()
 
 
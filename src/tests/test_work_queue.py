@@ -0,0 +1,164 @@
+"""
+Tests of the work queue. Run from the src folder:
+python -m unittest discover tests
+"""
+
+
+import os
+import tempfile
+import threading
+import unittest
+from collections import Counter
+from time import sleep
+from unittest import mock
+
+from dependencies import work_queue
+from dependencies.work_queue import SQLiteWorkQueue, scrape_queued_ads
+
+
+URLS = [f"https://www.boligportal.dk/lejligheder/koebenhavn/2-vaer-id-{i}" for i in range(5)]
+
+
+def fake_scrape_ads(urls, max_workers):
+    for url in urls:
+        yield {"url": url}
+
+
+class SQLiteWorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "work_queue.sqlite")
+        self.queues = []
+
+    def tearDown(self):
+        for queue in self.queues:
+            queue.close()
+        self.directory.cleanup()
+
+    def open_queue(self, **kwargs) -> SQLiteWorkQueue:
+        queue = SQLiteWorkQueue(self.path, **kwargs)
+        self.queues.append(queue)
+        return queue
+
+    def test_enqueues_each_listing_once(self):
+        queue = self.open_queue()
+        self.assertEqual(queue.enqueue(URLS), len(URLS))
+        self.assertEqual(queue.enqueue(URLS + [URLS[0] + "?from=search"]), 0)
+        self.assertEqual(queue.stats()["pending"], len(URLS))
+
+    def test_claimed_urls_are_hidden_until_completed(self):
+        queue = self.open_queue()
+        queue.enqueue(URLS)
+        claimed = queue.claim("worker-a", 3)
+        self.assertEqual(claimed, URLS[:3])
+        self.assertEqual(queue.claim("worker-b", 10), URLS[3:])
+        self.assertEqual(queue.claim("worker-b", 10), [])
+        queue.complete(claimed, "worker-a")
+        self.assertEqual(queue.stats(), {"pending": 0, "leased": 2, "done": 3, "failed": 0})
+
+    def test_failed_urls_are_claimed_again(self):
+        queue = self.open_queue()
+        queue.enqueue(URLS[:2])
+        claimed = queue.claim("worker-a", 2)
+        # Only the worker holding the lease can release it
+        queue.fail(claimed, "worker-b")
+        self.assertEqual(queue.claim("worker-b", 2), [])
+        queue.fail(claimed[:1], "worker-a")
+        self.assertEqual(queue.claim("worker-b", 2), claimed[:1])
+
+    def test_gives_up_after_max_attempts(self):
+        queue = self.open_queue(max_attempts=3)
+        queue.enqueue(URLS[:1])
+        for _ in range(3):
+            self.assertEqual(queue.claim("worker-a", 1), URLS[:1])
+            queue.fail(URLS[:1], "worker-a")
+        self.assertEqual(queue.claim("worker-a", 1), [])
+        self.assertEqual(queue.stats()["failed"], 1)
+        self.assertTrue(queue.is_drained())
+        # Found again by discovery, it gets a fresh start
+        self.assertEqual(queue.enqueue(URLS[:1]), 1)
+        self.assertEqual(queue.claim("worker-a", 1), URLS[:1])
+
+    def test_expired_lease_is_claimed_by_another_worker(self):
+        queue = self.open_queue(visibility_timeout=0.1, max_attempts=2)
+        queue.enqueue(URLS[:1])
+        self.assertEqual(queue.claim("worker-a", 1), URLS[:1])
+        self.assertFalse(queue.is_drained())
+        sleep(0.2)
+        self.assertEqual(queue.claim("worker-b", 1), URLS[:1])
+        # Worker a's late results no longer release worker b's lease
+        queue.fail(URLS[:1], "worker-a")
+        self.assertEqual(queue.stats()["leased"], 1)
+        # Its last attempt run out too, it's given up on
+        sleep(0.2)
+        self.assertEqual(queue.claim("worker-c", 1), [])
+        self.assertEqual(queue.stats()["failed"], 1)
+
+    def test_concurrent_claims_never_share_a_url(self):
+        urls = [f"https://www.boligportal.dk/lejligheder/koebenhavn/id-{i}" for i in range(500)]
+        self.open_queue().enqueue(urls)
+        workers = [f"worker-{i}" for i in range(4)]
+        # A queue per worker, as separate processes would each open the file
+        queues = {worker: self.open_queue() for worker in workers}
+        claimed = {worker: [] for worker in workers}
+
+        def work(worker: str) -> None:
+            while True:
+                urls = queues[worker].claim(worker, 7)
+                if not urls:
+                    return
+                claimed[worker] += urls
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        all_claimed = [url for urls in claimed.values() for url in urls]
+        self.assertEqual(sorted(all_claimed), sorted(urls))
+
+
+class ScrapeQueuedAdsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.queue = SQLiteWorkQueue(
+            os.path.join(self.directory.name, "work_queue.sqlite"), visibility_timeout=0.3
+        )
+        self.scraped = Counter()
+        patcher = mock.patch.object(work_queue, "scrape_ads", self.scrape_ads)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.queue.close()
+        self.directory.cleanup()
+
+    def scrape_ads(self, urls, max_workers):
+        self.scraped.update(urls)
+        return fake_scrape_ads(urls, max_workers)
+
+    def test_stops_without_waiting_for_own_leases(self):
+        # The ads yielded are still buffered by the writer, so not completed
+        self.queue.enqueue(URLS)
+        ads = list(scrape_queued_ads(self.queue, "worker-a", batch_size=2, poll_interval=0.05))
+        self.assertEqual(sorted(ad["url"] for ad in ads), sorted(URLS))
+        self.assertEqual(set(self.scraped.values()), {1})
+        self.assertEqual(self.queue.stats()["leased"], len(URLS))
+
+    def test_keeps_own_leases_while_waiting_for_others(self):
+        self.queue.enqueue(URLS)
+        other_queue = SQLiteWorkQueue(self.queue.path, visibility_timeout=60)
+        self.addCleanup(other_queue.close)
+        other_urls = other_queue.claim("worker-b", 1)
+        # Worker b finishes after worker a's leases would have run out
+        timer = threading.Timer(1.0, other_queue.complete, (other_urls, "worker-b"))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        ads = list(scrape_queued_ads(self.queue, "worker-a", batch_size=2, poll_interval=0.05))
+        self.assertEqual(len(ads), len(URLS) - 1)
+        self.assertNotIn(other_urls[0], self.scraped)
+        self.assertEqual(set(self.scraped.values()), {1})
+
+
+if __name__ == "__main__":
+    unittest.main()